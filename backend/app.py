@@ -1,20 +1,37 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 import os
 import logging
 from pathlib import Path
 from werkzeug.utils import secure_filename
-import librosa
+from werkzeug.security import safe_join
+import hashlib
+import importlib
+import threading
+from urllib.parse import quote
 import numpy as np
-import soundfile as sf
-import whisper
-import music21
 import traceback
-import plotly
 import json
 import re
+import shutil
+import time
+import uuid
+from contextlib import ExitStack
 from functools import wraps
-from music21.meter import TimeSignature
+from models import ModelRegistry
+from metrics import REGISTRY, Gauge, StackSampler, collect, server_timing, span
+from jobs import JobQueue, in_job, report_progress, QUEUED, DONE, FAILED
+from cache import AnalysisCache, cache_key, file_hash, remember_hash
+from fingerprint import FingerprintIndex
+from resumable import (IncompleteUpload, OffsetMismatch, UploadNotFound, UploadStore,
+                     copy_hashing)
+from encoding import JSON, MIMETYPES, encode
+from edits import (HOP_LENGTH, envelope_tempo, find_edit, mel_db_frames, onset_envelope,
+                   splice_frames, splice_notes)
+from chords import roman_numerals
+from maps import TEMPO_STD, key_map, tempo_curve, tempo_map
+from notes import (estimate_key, estimate_meter, key_name, load_note_arrays, midi_note_arrays,
+                   note_arrays, note_columns, notes_to_score, save_note_arrays, score_notes)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -22,13 +39,104 @@ app = Flask(__name__)
 
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-UPLOAD_FOLDER = Path('uploads')
+UPLOAD_FOLDER = Path(os.environ.get('SONGFLOWY_UPLOAD_FOLDER', 'uploads'))
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 app.config['UPLOAD_FOLDER'] = str(UPLOAD_FOLDER)
 
 ONSET_THRESHOLD = 0.7
 FRAME_THRESHOLD = 0.2
 
+WHISPER_MODEL = 'base'
+# Processes transcribing chunks of vocals in parallel for requests; 0
+# transcribes them one after the other in the calling process, as job
+# workers always do, each with its own model, so that the models loaded
+# are at most JOB_WORKERS + WHISPER_WORKERS
+WHISPER_WORKERS = int(os.environ.get('SONGFLOWY_WHISPER_WORKERS', min(4, os.cpu_count() or 1)))
+SEPARATOR_MODEL = 'UVR-MDX-NET-Inst_HQ_3.onnx'
+BASIC_PITCH_MODEL = 'basic-pitch-icassp-2022'
+
+# Sample rates the analyses decode to (librosa and basic-pitch, Whisper)
+SAMPLE_RATE = 22050
+WHISPER_SAMPLE_RATE = 16000
+
+# Recordings longer than this (seconds) are analyzed block by block
+STREAM_MIN_SECONDS = 600
+
+# Edited songs are transcribed again within this margin (seconds) around
+# the changed region, unless it covers more than this fraction of the song
+EDIT_MARGIN = 2.0
+EDIT_MAX_FRACTION = 0.5
+
+# Analysis outputs cached by audio content and parameters
+CACHE_FOLDER = UPLOAD_FOLDER / 'cache'
+CACHE_MAX_MB = int(os.environ.get('SONGFLOWY_CACHE_MB', 10240))
+
+# Uploads are fingerprinted to find the songs they are another encoding or
+# trim of, unless SONGFLOWY_FINGERPRINTS=0
+FINGERPRINTS = os.environ.get('SONGFLOWY_FINGERPRINTS', '1') != '0'
+FINGERPRINT_INDEX = UPLOAD_FOLDER / 'fingerprints.sqlite3'
+
+# Score formats of /api/export: file name in the cache entry and mimetype
+EXPORT_FORMATS = {
+    'musicxml': ('score.musicxml', 'application/vnd.recordare.musicxml+xml'),
+    'mxl': ('score.mxl', 'application/vnd.recordare.musicxml'),
+    'midi': ('notes.mid', 'audio/midi'),
+}
+
+# Compressed formats /uploads/ can transcode to: soundfile format, subtype
+# and mimetype
+TRANSCODE_FORMATS = {
+    'ogg': ('OGG', 'VORBIS', 'audio/ogg'),
+    'mp3': ('MP3', 'MPEG_LAYER_III', 'audio/mpeg'),
+}
+
+# Browser cache lifetime of files requested with their content hash (?v=)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Default results index of /api/batch, in the `batch` folder of the uploads
+# that holds its manifests and results, and its largest worker pool
+BATCH_OUTPUT = 'results.jsonl'
+BATCH_WORKERS = int(os.environ.get('SONGFLOWY_BATCH_WORKERS', os.cpu_count() or 1))
+
+# Analysis libraries are imported on first use, or ahead of time in a
+# background thread for these modules (see `preload_modules`)
+ANALYSIS_MODULES = ['librosa', 'soundfile', 'music21', 'whisper', 'plotly', 'pitch', 'waveform']
+PRELOAD_MODULES = os.environ.get('SONGFLOWY_PRELOAD_MODULES', '').split(',')
+
+# ONNX separation models, and how chunked separation spreads over cores:
+# segments inferred concurrently and ONNX Runtime threads per inference
+SEPARATOR_MODEL_DIR = os.environ.get('SONGFLOWY_SEPARATOR_MODEL_DIR', '/tmp/audio-separator-models')
+SEPARATOR_WORKERS = int(os.environ.get('SONGFLOWY_SEPARATOR_WORKERS', 0)) or None
+SEPARATOR_BATCH_SIZE = int(os.environ.get('SONGFLOWY_SEPARATOR_BATCH_SIZE', 1))
+SEPARATOR_INTRA_OP_THREADS = int(os.environ.get('SONGFLOWY_SEPARATOR_INTRA_OP_THREADS', 0)) or None
+SEPARATOR_INTER_OP_THREADS = int(os.environ.get('SONGFLOWY_SEPARATOR_INTER_OP_THREADS', 0)) or None
+# Chunked separation is opt-in until its stems have been checked against
+# audio-separator's with the real model weights
+SEPARATOR_CHUNKED = os.environ.get('SONGFLOWY_SEPARATOR_CHUNKED', '0') == '1'
+
+# Memory budget for resident models and the models to load at startup
+MODEL_MEMORY_MB = int(os.environ.get('SONGFLOWY_MODEL_MEMORY_MB', 4096))
+WARMUP_MODELS = os.environ.get('SONGFLOWY_WARMUP_MODELS', '').split(',')
+
+# Worker processes for background analysis jobs
+JOB_WORKERS = int(os.environ.get('SONGFLOWY_JOB_WORKERS', 2))
+
+# If SONGFLOWY_PROFILE_REQUESTS=1, requests sent with an X-Profile header
+# are profiled by sampling their stack every PROFILE_INTERVAL_MS. The last
+# PROFILE_KEEP profiles are kept in PROFILE_FOLDER, which is not served
+PROFILE_REQUESTS = os.environ.get('SONGFLOWY_PROFILE_REQUESTS', '0') == '1'
+PROFILE_INTERVAL_MS = float(os.environ.get('SONGFLOWY_PROFILE_INTERVAL_MS', 5))
+PROFILE_FOLDER = Path(os.environ.get('SONGFLOWY_PROFILE_FOLDER', '/tmp/songflowy-profiles'))
+PROFILE_KEEP = int(os.environ.get('SONGFLOWY_PROFILE_KEEP', 100))
+
+# Counters of the server process's caches, exported by /metrics
+CACHE_LOOKUPS = REGISTRY.add(Gauge('cache_lookups', 'Analysis cache lookups', ('result',)))
+MODEL_LOOKUPS = REGISTRY.add(Gauge('model_lookups', 'Model registry lookups',
+                                   ('model', 'result')))
+MODEL_LOAD_SECONDS = REGISTRY.add(Gauge('model_load_seconds', 'Time spent loading models',
+                                        ('model',)))
+MODEL_MEMORY = REGISTRY.add(Gauge('model_memory_bytes', 'Estimated memory of loaded models'))
+
 # @app.after_request
 # def after_request(response):
 #     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -50,6 +158,127 @@ def add_cor_acao(route):
 
 app.route = add_cor_acao(app.route)
 
+@app.before_request
+def start_request_metrics():
+    """Time the request, gather its spans and sample it if X-Profile is set"""
+    g.start = time.perf_counter()
+    g.exit_stack = ExitStack()
+    g.spans = g.exit_stack.enter_context(collect())
+    if PROFILE_REQUESTS and request.headers.get('X-Profile'):
+        g.sampler = StackSampler(interval=PROFILE_INTERVAL_MS / 1000).start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe the request latency and report its stages in Server-Timing
+
+    Streamed responses are timed up to their first byte.
+    """
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    with REGISTRY.lock:
+        REGISTRY['request_seconds'].observe(time.perf_counter() - g.start, route=route,
+                                            method=request.method,
+                                            status=response.status_code)
+    if g.spans:
+        response.headers['Server-Timing'] = server_timing(g.spans)
+        response.headers['Timing-Allow-Origin'] = '*'
+
+    sampler = g.pop('sampler', None)
+    if sampler is not None:
+        sampler.stop()
+        response.headers['X-Profile'] = save_profile(sampler.collapsed(), request.endpoint).name
+    return response
+
+def save_profile(collapsed, endpoint):
+    """Write a request's profile to PROFILE_FOLDER, keeping only the newest ones"""
+    PROFILE_FOLDER.mkdir(mode=0o700, parents=True, exist_ok=True)
+    path = PROFILE_FOLDER / (f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+                             f"-{endpoint}.folded")
+    path.write_text(collapsed)
+    # Names sort by the second they were written in
+    for old in sorted(PROFILE_FOLDER.glob('*.folded'))[:-PROFILE_KEEP]:
+        old.unlink(missing_ok=True)
+    return path
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    exit_stack = g.pop('exit_stack', None)
+    if exit_stack is not None:
+        exit_stack.close()
+
+def preload_modules(names, background=True):
+    """Import analysis modules now, or in a daemon thread if `background`"""
+    names = [n for n in names if n]
+    if not names:
+        return None
+
+    def _preload():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logging.error(f"Preloading module {name} failed: {e}")
+        logging.info(f"Preloaded modules: {', '.join(names)}")
+
+    if not background:
+        return _preload()
+    thread = threading.Thread(target=_preload, name='preload-modules', daemon=True)
+    thread.start()
+    return thread
+
+def load_whisper(name=WHISPER_MODEL):
+    import whisper
+    return whisper.load_model(name)
+
+def load_whisper_pool(name=WHISPER_MODEL):
+    from lyrics import WhisperPool
+    return WhisperPool(name, workers=WHISPER_WORKERS)
+
+def load_basic_pitch():
+    from basic_pitch.inference import Model
+    from basic_pitch import ICASSP_2022_MODEL_PATH
+    return Model(ICASSP_2022_MODEL_PATH)
+
+def load_separator(output_format='wav'):
+    from audio_separator.separator import Separator
+    separator = Separator(
+        output_format=output_format,
+        output_dir=str(UPLOAD_FOLDER),
+        model_file_dir=SEPARATOR_MODEL_DIR,
+    )
+    separator.load_model(model_filename=SEPARATOR_MODEL)
+    return separator
+
+def load_chunked_separator():
+    from separation import ChunkedSeparator, MDX_MODELS
+    model_path = Path(SEPARATOR_MODEL_DIR) / SEPARATOR_MODEL
+    if not model_path.exists():
+        from audio_separator.separator import Separator
+        Separator(model_file_dir=SEPARATOR_MODEL_DIR).download_model_files(SEPARATOR_MODEL)
+    return ChunkedSeparator(
+        model_path, **MDX_MODELS[SEPARATOR_MODEL],
+        batch_size=SEPARATOR_BATCH_SIZE,
+        workers=SEPARATOR_WORKERS,
+        intra_op_threads=SEPARATOR_INTRA_OP_THREADS,
+        inter_op_threads=SEPARATOR_INTER_OP_THREADS,
+    )
+
+model_registry = ModelRegistry(memory_budget_mb=MODEL_MEMORY_MB)
+model_registry.register('whisper', load_whisper)
+model_registry.register('whisper-pool', load_whisper_pool, size_mb=300 * max(WHISPER_WORKERS, 1))
+model_registry.register('basic-pitch', load_basic_pitch, size_mb=20)
+model_registry.register('separator', load_separator, size_mb=250)
+model_registry.register('chunked-separator', load_chunked_separator, size_mb=100)
+preload_modules(PRELOAD_MODULES)
+model_registry.warm_up(WARMUP_MODELS, background=True)
+
+job_queue = JobQueue(UPLOAD_FOLDER / 'jobs.sqlite3', max_workers=JOB_WORKERS)
+
+analysis_cache = AnalysisCache(CACHE_FOLDER, max_size_mb=CACHE_MAX_MB)
+
+fingerprint_index = FingerprintIndex(FINGERPRINT_INDEX) if FINGERPRINTS else None
+
+upload_store = UploadStore(UPLOAD_FOLDER)
+
 # @app.route('/')
 # def serve_vue_app():
 #     return app.send_static_file('index.html')
@@ -93,37 +322,168 @@ def upload_file():
     tp = request.form.get('type', 'vocal')
     filename = secure_filename_with_unicode(file.filename)
     filepath = UPLOAD_FOLDER / filename
-    file.save(filepath)
+    content_hash = save_upload(file, filepath)
+    logging.info(f"File uploaded: {filepath}")
+
+    return jsonify({'path': str(filepath), 'hash': content_hash,
+                    'duplicate_job': submit_duplicate_lookup(filepath),
+                    'analyzed': analyzed_stages(filepath)})
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload of `length` bytes named `filename`"""
+    params = request.get_json(silent=True) or request.form
+    filename = params.get('filename')
+    length = params.get('length', request.headers.get('Upload-Length'))
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    try:
+        length = int(length)
+        if length < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid upload length'}), 400
+
+    upload_id = upload_store.create(secure_filename_with_unicode(filename), length)
+    response = jsonify({'upload_id': upload_id, 'offset': 0})
+    response.headers['Location'] = f'/api/uploads/{upload_id}'
+    response.headers['Upload-Offset'] = '0'
+    return response, 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Offset to resume an upload from; HEAD returns it in Upload-Offset"""
+    try:
+        status = upload_store.status(upload_id)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    response = jsonify(status)
+    response.headers['Upload-Offset'] = str(status['offset'])
+    response.headers['Upload-Length'] = str(status['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    """Append the request body at the Upload-Offset of an upload"""
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Missing or invalid Upload-Offset header'}), 400
+
+    try:
+        offset = upload_store.append(upload_id, offset, request.stream)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except OffsetMismatch as e:
+        response = jsonify({'error': str(e), 'offset': e.expected})
+        response.headers['Upload-Offset'] = str(e.expected)
+        return response, 409
+
+    response = Response(status=204)
+    response.headers['Upload-Offset'] = str(offset)
+    return response
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Publish a complete upload and report the analyses already cached for it"""
+    try:
+        filepath = UPLOAD_FOLDER / upload_store.status(upload_id)['filename']
+        content_hash = upload_store.finalize(upload_id, filepath)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except IncompleteUpload as e:
+        return jsonify({'error': str(e)}), 409
+
+    remember_hash(filepath, content_hash)
     logging.info(f"File uploaded: {filepath}")
+    return jsonify({'path': str(filepath), 'hash': content_hash,
+                    'duplicate_job': submit_duplicate_lookup(filepath),
+                    'analyzed': analyzed_stages(filepath)})
+
+def save_upload(file, filepath):
+    """Save a multipart file, hashing it on the way to disk"""
+    digest = hashlib.sha256()
+    with open(filepath, 'wb') as out:
+        copy_hashing(file.stream, out, digest)
+    remember_hash(filepath, digest.hexdigest())
+    return digest.hexdigest()
+
+def submit_duplicate_lookup(audio_path):
+    """Job adopting the analysis of the song an upload duplicates, if any
+
+    Fingerprinting decodes the whole upload, so it runs in the background;
+    the job's result is the match `adopt_duplicate` returns. None when
+    fingerprints are disabled.
+    """
+    if not FINGERPRINTS:
+        return None
+    return job_queue.submit('duplicate', adopt_duplicate, str(audio_path))
+
+def analyzed_stages(audio_path):
+    """Stages whose results are cached for this content, e.g. from a duplicate"""
+    keys = {
+        'tempo': tempo_key(audio_path),
+        'sheet': midi_key(audio_path),
+        'separate': separation_key(audio_path),
+    }
+    return sorted(stage for stage, key in keys.items() if analysis_cache.entry(key).is_dir())
+
+def get_audio_path():
+    """Path of the audio to analyze, from an uploaded `file` or a `path` field"""
+    file = request.files.get('file')
+    if file and file.filename:
+        filepath = UPLOAD_FOLDER / secure_filename_with_unicode(file.filename)
+        save_upload(file, filepath)
+        return filepath
+    if request.form.get('path'):
+        return Path(request.form['path'])
+    return None
 
-    return jsonify({'path': str(filepath)})
+def wants_async():
+    """Whether the client asked for a background job instead of waiting"""
+    return request.values.get('async', '').lower() in ('1', 'true', 'yes')
+
+def negotiate():
+    """Response format requested through the Accept header, JSON by default"""
+    return request.accept_mimetypes.best_match(MIMETYPES, default=JSON)
+
+def respond(data, mimetype=None):
+    """Encode a result that may contain NumPy arrays"""
+    mimetype = mimetype or negotiate()
+    with span('encode') as s:
+        body = encode(data, mimetype)
+        s.size = len(body)
+    return Response(body, mimetype=mimetype)
+
+def wants_plot(default):
+    value = request.values.get('plot')
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+def wants_musicxml():
+    return request.values.get('musicxml', '').lower() in ('1', 'true', 'yes')
+
+def submit_job(kind, task, *args):
+    job_id = job_queue.submit(kind, task, *args)
+    return jsonify({'job_id': job_id, 'status': QUEUED}), 202
 
 @app.route('/api/sheet', methods=['POST'])
 def generate_sheet():
     """Generate sheet music from audio file"""
     filepath = Path(request.form['path'])
+    musicxml = wants_musicxml()
+    # Previous version of an edited song, whose analysis is reused
+    base = request.form.get('base')
+    if base is not None and not Path(base).is_file():
+        return jsonify({'error': f'Base file not found: {base}'}), 404
+
+    if wants_async():
+        return submit_job('sheet', sheet_task, str(filepath), musicxml, base)
     
     try:
-        # Convert to sheet music
-        score = audio_to_sheet_music(filepath)
-
-        # Get time signature
-        ts = next(score.recurse().getElementsByClass(TimeSignature), None)
-        if not ts:
-            ts = TimeSignature()
-            ts.guessFromStream(score)
-            
-        # Convert to MusicXML
-        xml_path = filepath.with_suffix('.xml')
-        score.write('musicxml', xml_path)
-        
-        return jsonify({
-            'musicxml': str(xml_path),
-            'tempo': score.metronomeMarkBoundaries()[0][2].number,
-            'notes': get_score_notes(score),
-            'key': score.analyze('key').tonic.name,
-            'time_signature': (ts.numerator, ts.denominator)
-        })
+        mimetype = negotiate()
+        result = sheet_task(filepath, musicxml, base, columns=mimetype != JSON)
+        return respond(result, mimetype)
         
     except Exception as e:
         print(traceback.format_exc())
@@ -131,179 +491,1024 @@ def generate_sheet():
 
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe_audio():
-    if 'file' not in request.files:
+    """Lyrics of a song's vocals, with word timestamps aligned to its notes
+
+    Takes an optional `language`; `separate=0` transcribes the audio as is
+    instead of its vocal stem.
+    """
+    filepath = get_audio_path()
+    if filepath is None:
         return jsonify({'error': 'No file provided'}), 400
-    
-    filepath = request.files['path']
-    
-    # 使用Whisper进行语音识别
-    model = whisper.load_model("base")
-    result = model.transcribe(filepath)
+    language = request.values.get('language') or None
+    separate = request.values.get('separate', '1').lower() not in ('0', 'false', 'no')
 
-    logging.info("Transcription completed.")
-    
-    return jsonify({
-        'text': result['text'],
-        'segments': result['segments']
-    })
+    if wants_async():
+        return submit_job('transcribe', transcribe_task, str(filepath), language, separate)
+
+    try:
+        return jsonify(transcribe_task(filepath, language, separate))
+    except Exception as e:
+        logging.error(f"Transcription failed: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/separate', methods=['POST'])
 def separate_audio():
-    if 'file' not in request.files:
+    # Save uploaded file, or take the path of a finished chunked upload
+    input_path = get_audio_path()
+    if input_path is None:
         return jsonify({'error': 'No file provided'}), 400
 
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-
-    # Save uploaded file
-    filename = secure_filename_with_unicode(file.filename)
-    input_path = UPLOAD_FOLDER / filename
-    
-    # Create output paths
-    vocal_path = UPLOAD_FOLDER / f'vocal_{filename}'
-    bgm_path = UPLOAD_FOLDER / f'bgm_{filename}'
+    entry = analysis_cache.lookup(separation_key(input_path))
+    if entry is not None:
+        link_stems(entry, input_path)
+    else:
+        if wants_async():
+            return submit_job('separate', separate_task, str(input_path))
 
-    if not vocal_path.exists() or not bgm_path.exists():
         try:
-            file.save(str(input_path))
-            from audio_separator.separator import Separator
-
-            # Initialize the Separator with other configuration properties, below
-            separator = Separator(
-                output_format=bgm_path.suffix.strip('.'),
-                output_dir=str(UPLOAD_FOLDER),
-            )
-            separator.load_model(model_filename='UVR-MDX-NET-Inst_HQ_3.onnx')
-
-            outputs = separator.separate(
-                str(input_path),
-                primary_output_name=bgm_path.stem,
-                secondary_output_name=vocal_path.stem
-            )
-
-            logging.info("Separation completed: %s", outputs)
-            
+            separate_task(input_path)
         except Exception as e:
             logging.error("Separation failed: %s", str(e))
             return jsonify({'error': str(e)}), 500
 
-    return jsonify({
-        'song': str(input_path),
-        'vocal': str(vocal_path),
-        'instrumental': str(bgm_path)
-    })
+    return jsonify(separation_result(input_path))
+
+@app.route('/api/score', methods=['POST'])
+def score_take():
+    """Score a sung take against the vocals of a `reference` song
+
+    Returns the pitch (cents) and timing (seconds) error of each of the
+    reference's vocal notes and an overall score out of 100.
+    """
+    filepath = get_audio_path()
+    if filepath is None:
+        return jsonify({'error': 'No file provided'}), 400
+    reference = request.form.get('reference')
+    if not reference:
+        return jsonify({'error': 'No reference provided'}), 400
+    if not Path(reference).is_file():
+        return jsonify({'error': f'Reference file not found: {reference}'}), 404
+
+    if wants_async():
+        return submit_job('score', score_task, str(filepath), reference)
+
+    try:
+        return jsonify(score_task(filepath, reference))
+    except Exception as e:
+        logging.error(f"Scoring failed: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/analyze_pitch', methods=['POST'])
 def analyze_pitch():
     """Analyze pitch of an audio file"""
-    if 'file' not in request.files:
+    filepath = get_audio_path()
+    if filepath is None:
         return jsonify({'error': 'No file provided'}), 400
-    
-    filepath = request.files['path']
+
+    if request.values.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return Response(stream_pitch(filepath), mimetype='application/x-ndjson')
 
     try:
-        # Load the audio file
-        y, sr = librosa.load(filepath)
-        
-        # Extract pitch and timing information
-        pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-        
-        # Get time points for the pitch values
-        times = librosa.times_like(pitches)
-        
-        # For each frame, find the pitch with highest magnitude
-        pitch_values = []
-        for i in range(len(pitches[0])):
-            index = magnitudes[:,i].argmax()
-            pitch = pitches[index,i]
-            if pitch > 0:  # Only include valid pitches
-                note = librosa.hz_to_note(pitch)
-                pitch_values.append(note)
-        
-        # Create a plotly plot of the pitch contour
-        pitch_contour = plotly.graph_objs.Scatter(
-            x=times,
-            y=pitches[magnitudes.argmax(axis=0), range(pitches.shape[1])],
-            mode='lines',
-            name='Pitch Contour'
-        )
+        from pitch import midi_to_note_names
 
-        layout = plotly.graph_objs.Layout(
-            title='Pitch Contour',
-            xaxis=dict(title='Time (s)'),
-            yaxis=dict(title='Frequency (Hz)')
-        )
+        # Predominant pitch of every frame, in one vectorized pass
+        contour = song_pitch_contour(filepath)
+        times, voiced = contour['times'], contour['voiced']
 
-        fig = plotly.graph_objs.Figure(data=[pitch_contour], layout=layout)
-        
-        # Convert the plot to JSON for the frontend
-        plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+        mimetype = negotiate()
+        if mimetype == JSON:
+            result = {
+                'frequencies': midi_to_note_names(contour['midi'][voiced]).tolist(),
+                'times': times,
+            }
+        else:
+            # Typed arrays, one value per frame; MIDI is -1 where unvoiced
+            result = {k: contour[k] for k in ('times', 'hz', 'midi', 'cents', 'confidence')}
+
+        # The plot is optional so clients can render from the raw arrays
+        if wants_plot(default=mimetype == JSON):
+            result['plot'] = pitch_plot(times, contour['hz'])
 
         logging.info("Pitch analysis completed.")
         
         # Return the analysis results
-        return jsonify({
-            'frequencies': pitch_values,
-            'times': times.tolist(),
-            'plot': plot_json
-        })
+        return respond(result, mimetype)
         
     except Exception as e:
         logging.error(f"Error in pitch analysis: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def pitch_plot(times, frequencies):
+    """Plotly figure of a pitch contour, as JSON"""
+    import plotly
+
+    pitch_contour = plotly.graph_objs.Scatter(
+        x=times,
+        y=frequencies,
+        mode='lines',
+        name='Pitch Contour'
+    )
+
+    layout = plotly.graph_objs.Layout(
+        title='Pitch Contour',
+        xaxis=dict(title='Time (s)'),
+        yaxis=dict(title='Frequency (Hz)')
+    )
+
+    fig = plotly.graph_objs.Figure(data=[pitch_contour], layout=layout)
+    
+    # Convert the plot to JSON for the frontend
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+def stream_pitch(filepath):
+    """Pitch frames, onsets and tempo of each block as JSON lines"""
+    from pitch import stream_analysis
+    try:
+        for block in stream_analysis(filepath):
+            yield json.dumps({
+                k: v.tolist() if isinstance(v, np.ndarray) else v
+                for k, v in block.items() if k != 'voiced'
+            }) + '\n'
+    except Exception as e:
+        logging.error(f"Error in pitch analysis: {str(e)}")
+        yield json.dumps({'error': str(e)}) + '\n'
+
+@app.route('/api/batch', methods=['POST'])
+def batch_analyze():
+    """Analyze many songs in a background job
+
+    Takes JSON with the song `paths` (or the name of a `manifest` file), the
+    `stages` to run, the number of `workers` and optionally the name of the
+    `output` JSONL file, which also lets a repeated request resume an
+    interrupted batch. Manifests and outputs are files of the `batch` folder
+    of the uploads; other paths are only taken by the `batch.py` command.
+    Returns 202 with the job.
+    """
+    from batch import STAGES, batch_task, read_manifest
+
+    params = request.get_json(silent=True) or {}
+    if params.get('manifest'):
+        manifest = batch_file(params['manifest'])
+        if manifest is None:
+            return jsonify({'error': 'Manifest must be in the batch folder'}), 400
+        if not manifest.is_file():
+            return jsonify({'error': 'Manifest not found'}), 404
+        paths = read_manifest(manifest)
+    else:
+        paths = params.get('paths')
+    if not paths or not isinstance(paths, list):
+        return jsonify({'error': 'No paths provided'}), 400
+
+    stages = params.get('stages', list(STAGES))
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        return jsonify({'error': f"Unknown stages: {', '.join(sorted(unknown))}"}), 400
+
+    output = batch_file(params.get('output', BATCH_OUTPUT))
+    if output is None:
+        return jsonify({'error': 'Output must be in the batch folder'}), 400
+    workers = params.get('workers', BATCH_WORKERS)
+    if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+        return jsonify({'error': 'workers must be a positive integer'}), 400
+    return submit_job('batch', batch_task, paths, str(output), stages,
+                      min(workers, BATCH_WORKERS))
+
+def batch_file(name):
+    """Path of a file of the batch folder, or None if `name` leads out of it"""
+    folder = (UPLOAD_FOLDER / 'batch').resolve()
+    path = (folder / str(name)).resolve()
+    return path if path != folder and path.is_relative_to(folder) else None
+
+@app.route('/api/models', methods=['GET'])
+def model_stats():
+    """Model load times, hit/miss counters and memory usage"""
+    return jsonify(model_registry.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, stage and job latency histograms and cache counters
+
+    Stages of background jobs are counted once the job has finished.
+    """
+    cache = analysis_cache.stats()
+    models = model_registry.stats()
+    with REGISTRY.lock:
+        CACHE_LOOKUPS.set(cache['hits'], result='hit')
+        CACHE_LOOKUPS.set(cache['misses'], result='miss')
+        MODEL_MEMORY.set(models['memory_usage_mb'] * 2**20)
+        for name, stats in models['models'].items():
+            MODEL_LOOKUPS.set(stats['hits'], model=name, result='hit')
+            MODEL_LOOKUPS.set(stats['misses'], model=name, result='miss')
+            MODEL_LOAD_SECONDS.set(stats['load_seconds'], model=name)
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.pop('result')
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Result of a finished job; 202 with the status while it is running"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == FAILED:
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != DONE:
+        job.pop('result')
+        return jsonify(job), 202
+    return jsonify(job['result'])
+
+@app.route('/api/export', methods=['GET'])
+def export_score():
+    """Download the score of a song as MusicXML, compressed MXL or MIDI
+
+    The export is written once per song content and format and served with
+    a strong ETag, so clients can revalidate with If-None-Match.
+    """
+    path = request.args.get('path')
+    fmt = request.args.get('format', 'musicxml').lower()
+    if not path:
+        return jsonify({'error': 'No path provided'}), 400
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    if not Path(path).is_file():
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        export_path, etag = export_task(path, fmt)
+        name, mimetype = EXPORT_FORMATS[fmt]
+        response = send_file(export_path, mimetype=mimetype, etag=etag, conditional=True,
+                             download_name=Path(path).stem + Path(name).suffix)
+        response.cache_control.no_cache = True  # Revalidate, the path may change content
+        return response
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/uploads/<path:filename>')
 def serve_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve an upload or stem with byte ranges and a content-hash ETag
+
+    `?format=ogg|mp3` serves a cached compressed transcode instead. URLs
+    carrying the content hash of the file as `?v=` (see `media_url`) always
+    refer to the same bytes, so browsers may cache them for good; other
+    requests are revalidated with the ETag.
+    """
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+
+    fmt = request.args.get('format')
+    if fmt is not None and fmt not in TRANSCODE_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    try:
+        content_hash = file_hash(path)
+        if fmt is None:
+            served, etag, mimetype = path, content_hash, None
+        else:
+            served, etag = transcode(path, fmt)
+            mimetype = TRANSCODE_FORMATS[fmt][2]
+
+        # send_file answers Range and If-None-Match requests, and hands the
+        # file to the server's sendfile when it has one
+        response = send_file(served, mimetype=mimetype, etag=etag, conditional=True)
+        if request.args.get('v') == content_hash:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    except Exception as e:
+        logging.error(f"Serving {filename} failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def media_url(path):
+    """URL of an upload that pins its current content for browser caching"""
+    try:
+        relative = Path(path).resolve().relative_to(UPLOAD_FOLDER.resolve())
+    except ValueError:
+        return None  # Not served from the upload folder
+    return f"/uploads/{quote(relative.as_posix())}?v={file_hash(path)}"
+
+def transcode(path, fmt):
+    """Path and ETag of a compressed copy of an audio file, written once"""
+    import soundfile as sf
+    key = cache_key(file_hash(path), 'transcode', format=fmt)
+    name = f'audio.{fmt}'
+    with span('transcode', size=os.path.getsize(path)) as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            logging.info(f"Transcoding {path} to {fmt}")
+            major, subtype, _ = TRANSCODE_FORMATS[fmt]
+            with analysis_cache.store(key) as tmp, sf.SoundFile(path) as src:
+                with sf.SoundFile(tmp / name, 'w', samplerate=src.samplerate,
+                                  channels=src.channels, format=major, subtype=subtype) as dst:
+                    for block in src.blocks(blocksize=1 << 16):
+                        dst.write(block)
+            entry = analysis_cache.entry(key)
+    return entry / name, key
+
 
+def sheet_task(filepath, musicxml=False, base=None, columns=False):
+    """Transcribe an audio file and summarize its notes, key and meter
 
-def quantize_duration(duration, base_duration=0.25):
-    """Quantize a duration to the nearest standard note length"""
-    # Standard note lengths (in quarter notes)
-    standard_lengths = [4.0, 2.0, 1.0, 0.5, 0.25, 0.125]
+    The summary is computed from the note arrays; the music21 score is only
+    built when the MusicXML is requested. If the song is an edit of `base`,
+    only the edited region is transcribed again. With `columns`, the notes
+    are typed columns (see `notes.note_columns`) instead of a list of dicts.
+    """
+    filepath = Path(filepath)
+    if base is not None:
+        report_progress(0.05, 'Analyzing the edited region')
+        reanalyze_edit(filepath, base)
+
+    report_progress(0.1, 'Converting audio to MIDI')
+    notes = predict_note_arrays(filepath)
+    tempo = detect_tempo(filepath)
+    beats = detect_beats(filepath)
+
+    report_progress(0.5, 'Recognizing chords')
+    chords = detect_chords(filepath)
+
+    report_progress(0.6, 'Analyzing notes')
+    with span('note_analysis'):
+        tonic, mode, _ = estimate_key(notes)
+        keys = key_map(notes)
+        key = keys or key_name(tonic, mode)
+        result = {
+            'tempo': tempo,
+            'key': tonic,
+            'mode': mode,
+            'time_signature': estimate_meter(notes, tempo),
+            'chords': roman_numerals(chords, key),
+            'key_map': keys,
+            'tempo_map': tempo_map(beats),
+            'beats': beats,
+        }
+        if columns:
+            result.update(note_columns(notes, tempo, key, beats))
+        else:
+            result['notes'] = score_notes(notes, tempo, key, beats)
+
+    if musicxml:
+        report_progress(0.8, 'Writing MusicXML')
+        result['musicxml'] = str(export_task(filepath, 'musicxml')[0])
     
-    # Find the closest standard length
-    quantized = min(standard_lengths, key=lambda x: abs(x - duration))
-    return max(quantized, base_duration)  # Ensure minimum duration
+    return result
 
-def audio_to_sheet_music(audio_path):
-    """Convert audio file to sheet music notation"""
-    from basic_pitch.inference import predict
-    from basic_pitch import ICASSP_2022_MODEL_PATH
+def score_task(filepath, reference):
+    """Score a take against a reference, from their cached contours
 
-    midi_path = audio_path.with_suffix('.mid')
+    The reference's vocal stem is used when the song has been separated,
+    and its notes are the ones basic-pitch transcribes from it.
+    """
+    from performance import score_performance
+    vocal_path, _ = separation_paths(reference)
+    source = vocal_path if vocal_path.is_file() else Path(reference)
 
-    if not midi_path.exists():
-        logging.info(f"Converting {audio_path} to MIDI...")
+    report_progress(0.1, 'Analyzing the reference')
+    reference_contour = song_pitch_contour(source)
+    notes = predict_note_arrays(source)
+    report_progress(0.6, 'Analyzing the take')
+    take_contour = song_pitch_contour(filepath)
+    report_progress(0.8, 'Scoring')
+    with span('performance_score'):
+        result = score_performance(take_contour, reference_contour, notes,
+                                   SAMPLE_RATE / HOP_LENGTH)
+    result['reference'] = str(source)
+    return result
 
-        # Load the audio file
-        y, sr = librosa.load(str(audio_path))
-        
-        # Detect tempo
-        tempo = librosa.beat.beat_track(y=y, sr=sr)[0]
-        if isinstance(tempo, np.ndarray):
-            tempo = float(tempo[0])
-
-        logging.info(f"Detected tempo: {tempo} bpm")
-        model_output, midi_data, note_events = predict(
-            audio_path, midi_tempo=tempo,
-            onset_threshold=ONSET_THRESHOLD, 
-            frame_threshold=FRAME_THRESHOLD,
+def lyrics_key(audio_path, language=None):
+    from lyrics import MAX_CHUNK_SECONDS, MAX_GAP, TOP_DB
+    return cache_key(file_hash(audio_path), 'lyrics', model=WHISPER_MODEL,
+                     language=language or 'auto', top_db=TOP_DB, max_gap=MAX_GAP,
+                     max_chunk=MAX_CHUNK_SECONDS)
+
+def transcribe_task(filepath, language=None, separate=True):
+    """Transcribe the lyrics of a song from its vocal stem
+
+    The transcript is cached by content and language; its words are then
+    aligned to the onsets of the vocal melody's notes.
+    """
+    from lyrics import InlineTranscriber, align_words, transcribe_lyrics
+    from waveform import load_waveform
+
+    vocal_path = Path(filepath)
+    if separate and not vocal_path.name.startswith('vocal_'):
+        report_progress(0.05, 'Separating vocals')
+        vocal_path = Path(separate_task(vocal_path)['vocal'])
+
+    key = lyrics_key(vocal_path, language)
+    with analysis_cache.lock(key):
+        lyrics = analysis_cache.load_json(key)
+        if lyrics is None:
+            # 使用Whisper进行语音识别
+            report_progress(0.3, 'Loading model')
+            y, sr = load_waveform(vocal_path, analysis_cache, sr=WHISPER_SAMPLE_RATE)
+            with ExitStack() as stack:
+                if WHISPER_WORKERS and not in_job():
+                    transcriber = model_registry.get('whisper-pool')
+                else:
+                    # Whisper's kv-cache hooks make the model one caller's at a time
+                    transcriber = InlineTranscriber(stack.enter_context(
+                        model_registry.use('whisper')))
+                with span('whisper', size=y.nbytes):
+                    lyrics = transcribe_lyrics(
+                        np.asarray(y), sr, transcriber, language,
+                        progress=lambda f: report_progress(0.35 + 0.45 * f, 'Transcribing'))
+            lyrics = analysis_cache.save_json(key, lyrics)
+            logging.info("Transcription completed.")
+
+    report_progress(0.8, 'Aligning words to notes')
+    with span('lyrics_alignment'):
+        lyrics['words'] = align_words(lyrics['words'], predict_note_arrays(vocal_path)['start'])
+    return lyrics
+
+def separation_paths(input_path):
+    """Output paths of the vocal and instrumental stems of a song"""
+    input_path = Path(input_path)
+    vocal_path = input_path.with_name(f'vocal_{input_path.name}')
+    bgm_path = input_path.with_name(f'bgm_{input_path.name}')
+    return vocal_path, bgm_path
+
+def separation_method(input_path):
+    """'chunked' if enabled and the stems can be streamed in the song's format, else 'full'"""
+    from separation import can_write
+    return 'chunked' if SEPARATOR_CHUNKED and can_write(Path(input_path).suffix) else 'full'
+
+def separation_key(input_path, content_hash=None):
+    output_format = Path(input_path).suffix.strip('.')
+    return cache_key(content_hash or file_hash(input_path), 'separate', model=SEPARATOR_MODEL,
+                     output_format=output_format, method=separation_method(input_path))
+
+def link_stems(entry, input_path):
+    """Expose the cached stems of a song as its vocal_/bgm_ files"""
+    input_path = Path(input_path)
+    hashes = {}
+    if (entry / 'hashes.json').exists():
+        with open(entry / 'hashes.json') as f:
+            hashes = json.load(f)
+    for stem, path in zip(('vocal', 'bgm'), separation_paths(input_path)):
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(entry / f'{stem}{input_path.suffix}', tmp_path)
+        except OSError:
+            shutil.copyfile(entry / f'{stem}{input_path.suffix}', tmp_path)
+        os.replace(tmp_path, path)
+        # Stem hashes are stored with the entry so serving them never rehashes
+        if stem in hashes:
+            remember_hash(path, hashes[stem])
+
+def separate_task(input_path):
+    """Separate a song into vocal and instrumental stems"""
+    input_path = Path(input_path)
+    key = separation_key(input_path)
+
+    with span('separation', size=os.path.getsize(input_path)) as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            report_progress(0.1, 'Loading model')
+            with analysis_cache.store(key) as tmp:
+                if separation_method(input_path) == 'chunked':
+                    with model_registry.use('chunked-separator') as separator:
+                        report_progress(0.2, 'Separating')
+                        outputs = separator.separate(
+                            input_path,
+                            tmp / f'bgm{input_path.suffix}',
+                            tmp / f'vocal{input_path.suffix}',
+                            progress=lambda f: report_progress(0.2 + 0.75 * f, 'Separating'),
+                        )
+                else:
+                    outputs = separate_whole_song(input_path, key, tmp)
+                with open(tmp / 'hashes.json', 'w') as f:
+                    json.dump({stem: file_hash(tmp / f'{stem}{input_path.suffix}')
+                               for stem in ('vocal', 'bgm')}, f)
+
+            logging.info("Separation completed: %s", outputs)
+            entry = analysis_cache.entry(key)
+
+    link_stems(entry, input_path)
+    return separation_result(input_path)
+
+def separate_whole_song(input_path, key, out_dir):
+    """Separate with audio-separator, for formats soundfile cannot write"""
+    # The separator is shared across requests, one per output format
+    with model_registry.use('separator', output_format=input_path.suffix.strip('.')) as separator:
+        report_progress(0.2, 'Separating')
+        outputs = separator.separate(
+            str(input_path),
+            primary_output_name=f'{key}_bgm',
+            secondary_output_name=f'{key}_vocal'
         )
+    for stem in ('vocal', 'bgm'):
+        shutil.move(UPLOAD_FOLDER / f'{key}_{stem}{input_path.suffix}',
+                    out_dir / f'{stem}{input_path.suffix}')
+    return outputs
+
+def separation_result(input_path):
+    """Paths of a song and its stems, and URLs that pin their content"""
+    vocal_path, bgm_path = separation_paths(input_path)
+    paths = {'song': input_path, 'vocal': vocal_path, 'instrumental': bgm_path}
+    return {
+        **{k: str(v) for k, v in paths.items()},
+        'urls': {k: media_url(v) for k, v in paths.items()},
+    }
+
+def audio_duration(audio_path):
+    """Duration in seconds, read from the header when possible"""
+    import librosa
+    import soundfile as sf
+    try:
+        return sf.info(str(audio_path)).duration
+    except RuntimeError:
+        return librosa.get_duration(path=str(audio_path))
+
+def tempo_key(audio_path, content_hash=None):
+    return cache_key(content_hash or file_hash(audio_path), 'tempo', method='beat_track')
 
-        with open(midi_path, 'wb') as f:
-            midi_data.write(f)
+def detect_tempo(audio_path):
+    """Tempo of an audio file in bpm, cached by content"""
+    from pitch import stream_analysis
+
+    key = tempo_key(audio_path)
+    with span('tempo') as s, analysis_cache.lock(key):
+        tempo = analysis_cache.load_json(key)
+        s.cache = 'hit' if tempo is not None else 'miss'
+
+        if tempo is None:
+            if audio_duration(audio_path) > STREAM_MIN_SECONDS:
+                # Only the onset envelope of long recordings is held in memory
+                *_, last = stream_analysis(audio_path)
+                tempo = last['song_tempo'] or 120.0
+            else:
+                # The tempo beat_track would detect, from the stored envelope
+                tempo = envelope_tempo(song_onset_envelope(audio_path), SAMPLE_RATE)
+            tempo = analysis_cache.save_json(key, float(tempo))
+
+    return tempo
+
+def beats_key(audio_path):
+    return cache_key(file_hash(audio_path), 'beats', method='dynamic', std_bpm=TEMPO_STD)
+
+def detect_beats(audio_path):
+    """Beat times in seconds of an audio file, cached
+
+    Beats are tracked at the tempo of each frame, estimated near the song's
+    tempo, so that they follow a song that speeds up or slows down.
+    """
+    key = beats_key(audio_path)
+    with span('beats') as s:
+        beats = analysis_cache.load_json(key)
+        s.cache = 'hit' if beats is not None else 'miss'
+        if beats is None:
+            import librosa
+            tempo = detect_tempo(audio_path)
+            frames = []
+            if tempo:
+                envelope = song_onset_envelope(audio_path)
+                _, frames = librosa.beat.beat_track(
+                    onset_envelope=envelope, sr=SAMPLE_RATE, hop_length=HOP_LENGTH,
+                    bpm=tempo_curve(envelope, SAMPLE_RATE, tempo, HOP_LENGTH))
+            times = librosa.frames_to_time(frames, sr=SAMPLE_RATE, hop_length=HOP_LENGTH)
+            beats = analysis_cache.save_json(key, [round(t, 4) for t in times.tolist()])
+    return beats
+
+def chords_key(audio_path, source):
+    from chords import CHORD_QUALITIES, P_STAY
+    return cache_key(file_hash(audio_path), 'chords', source=file_hash(source),
+                     qualities=sorted(CHORD_QUALITIES), p_stay=P_STAY, grid='beats')
+
+def detect_chords(audio_path):
+    """Chord timeline of a song on its beats, cached by content
+
+    Chords are recognized on the instrumental stem when the song has been
+    separated, where the vocals do not blur them.
+    """
+    from chords import chord_timeline
+    from waveform import load_waveform
+
+    source = separation_paths(audio_path)[1]
+    if not source.is_file():
+        source = Path(audio_path)
+    key = chords_key(audio_path, source)
+    with span('chords') as s:
+        chords = analysis_cache.load_json(key)
+        s.cache = 'hit' if chords is not None else 'miss'
+        if chords is None:
+            beats = detect_beats(audio_path)
+            y, sr = load_waveform(source, analysis_cache, sr=SAMPLE_RATE)
+            s.size = y.nbytes
+            chords = analysis_cache.save_json(key, chord_timeline(y, sr, beats))
+    return chords
+
+def onset_key(audio_path):
+    return cache_key(file_hash(audio_path), 'onset', sr=SAMPLE_RATE, hop_length=HOP_LENGTH,
+                     frame_db=True)
+
+def song_onset_entry(audio_path):
+    """Cache entry of the onset strength envelope of an audio file
+
+    Holds `onset.npy` and `frame_db.npy`, the loudest mel bin of each frame
+    (see `edits.onset_envelope`).
+    """
+    from waveform import load_waveform
+    key = onset_key(audio_path)
+    with span('onset_envelope') as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            y, sr = load_waveform(audio_path, analysis_cache, sr=SAMPLE_RATE)
+            s.size = y.nbytes
+            envelope, frame_db = onset_envelope(y, sr, return_frame_db=True)
+            with analysis_cache.store(key) as tmp:
+                np.save(tmp / 'onset.npy', envelope)
+                np.save(tmp / 'frame_db.npy', frame_db)
+            entry = analysis_cache.entry(key)
+    return entry
+
+def song_onset_envelope(audio_path):
+    """Onset strength envelope of an audio file, cached by content"""
+    return np.load(song_onset_entry(audio_path) / 'onset.npy')
+
+def contour_key(audio_path):
+    return cache_key(file_hash(audio_path), 'contour', sr=SAMPLE_RATE, hop_length=HOP_LENGTH)
+
+def song_pitch_contour(audio_path):
+    """Pitch contour arrays of an audio file (see `pitch.pitch_contour`), cached"""
+    from pitch import analyze_contour
+    from waveform import load_waveform
+    key = contour_key(audio_path)
+    with span('pitch_contour') as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            y, sr = load_waveform(audio_path, analysis_cache, sr=SAMPLE_RATE)
+            s.size = y.nbytes
+            with analysis_cache.store(key) as tmp:
+                np.savez(tmp / 'contour.npz', **analyze_contour(y, sr, hop_length=HOP_LENGTH))
+            entry = analysis_cache.entry(key)
+    with np.load(entry / 'contour.npz') as data:
+        return {k: data[k] for k in data.files}
+
+def midi_key(audio_path, content_hash=None):
+    return cache_key(content_hash or file_hash(audio_path), 'midi', model=BASIC_PITCH_MODEL,
+                     onset_threshold=ONSET_THRESHOLD,
+                     frame_threshold=FRAME_THRESHOLD)
+
+def predict_notes(y, midi_tempo=120):
+    """Run basic-pitch on a waveform decoded at its 22050 Hz sample rate
+
+    Equivalent to `basic_pitch.inference.predict`, which only accepts a
+    path and would decode the file again.
+    """
+    from basic_pitch import note_creation
+    from basic_pitch.constants import AUDIO_N_SAMPLES, AUDIO_SAMPLE_RATE, FFT_HOP
+    from basic_pitch.inference import unwrap_output
+
+    model = model_registry.get('basic-pitch')
+    n_overlapping_frames = 30
+    overlap_len = n_overlapping_frames * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+
+    # Windows are read from `y` (possibly memory-mapped) one at a time, as
+    # if it were preceded by half an overlap of silence
+    pad = overlap_len // 2
+    output = {'note': [], 'onset': [], 'contour': []}
+    with span('basic_pitch', size=y.nbytes):
+        for start in range(-pad, len(y), hop_size):
+            window = np.asarray(y[max(start, 0):start + AUDIO_N_SAMPLES], dtype=np.float32)
+            window = np.pad(window, (max(-start, 0), 0))
+            window = np.pad(window, (0, AUDIO_N_SAMPLES - len(window)))
+            for k, v in model.predict(window[np.newaxis, :, np.newaxis]).items():
+                output[k].append(v)
+
+    with span('note_creation'):
+        model_output = {
+            k: unwrap_output(np.concatenate(v), len(y), n_overlapping_frames)
+            for k, v in output.items()
+        }
+        midi_data, note_events = note_creation.model_output_to_notes(
+            model_output,
+            onset_thresh=ONSET_THRESHOLD,
+            frame_thresh=FRAME_THRESHOLD,
+            min_note_len=int(np.round(127.70 / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP))),
+            midi_tempo=midi_tempo,
+        )
+    return model_output, midi_data, note_events
+
+def predict_midi(audio_path):
+    """Transcribe an audio file to MIDI with basic-pitch, cached by content"""
+    key = midi_key(audio_path)
+    with span('midi') as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            from waveform import load_waveform
+            logging.info(f"Converting {audio_path} to MIDI...")
+
+            tempo = detect_tempo(audio_path)
+            logging.info(f"Detected tempo: {tempo} bpm")
+
+            y, _ = load_waveform(audio_path, analysis_cache, sr=SAMPLE_RATE)
+            model_output, midi_data, note_events = predict_notes(y, midi_tempo=tempo)
+
+            with analysis_cache.store(key) as tmp:
+                with open(tmp / 'notes.mid', 'wb') as f:
+                    midi_data.write(f)
+                save_note_arrays(tmp / 'notes.npz', note_arrays(note_events))
+            entry = analysis_cache.entry(key)
+
+    return entry / 'notes.mid'
+
+def reanalyze_edit(audio_path, base_path):
+    """Analyze an edited song from the analysis of its previous version
+
+    The region where the audio differs from `base_path` is transcribed again
+    with `EDIT_MARGIN` seconds on each side, and its notes and onset envelope
+    are spliced into those of the previous version, which are then stored as
+    the edited song's own. Returns False, leaving the song to be analyzed
+    whole, if the previous version was never transcribed or the edit covers
+    more than `EDIT_MAX_FRACTION` of the song.
+    """
+    from basic_pitch.note_creation import note_events_to_midi
+    from waveform import load_waveform
+
+    audio_path, base_path = Path(audio_path), Path(base_path)
+    key = midi_key(audio_path)
+    with ExitStack() as locks:
+        locks.enter_context(analysis_cache.lock(key))
+        if analysis_cache.lookup(key) is not None:
+            return True
+        base_entry = analysis_cache.lookup(midi_key(base_path))
+        if base_entry is None or not (base_entry / 'notes.npz').exists():
+            return False
+
+        # Locate the edit on the decoded audio at its native rate, where the
+        # samples outside it are the same in both versions
+        old, old_sr = load_waveform(base_path, analysis_cache)
+        new, new_sr = load_waveform(audio_path, analysis_cache)
+        if old_sr != new_sr:
+            return False
+        start, old_stop, new_stop = (i / new_sr for i in find_edit(old, new))
+        duration = len(new) / new_sr
+        if new_stop - start + 2 * EDIT_MARGIN > EDIT_MAX_FRACTION * duration:
+            return False
+        lo, hi = max(start - EDIT_MARGIN, 0), min(new_stop + EDIT_MARGIN, duration)
+        shift = new_stop - old_stop
+        logging.info(f"Re-analyzing {audio_path} from {lo:.1f}s to {hi:.1f}s, "
+                     f"edited from {base_path}")
+
+        locks.enter_context(span('edit_reanalysis'))
+        y, sr = load_waveform(audio_path, analysis_cache, sr=SAMPLE_RATE)
+
+        # Onset envelope, clamped below the loudest bin of the edited song,
+        # found from the new frames and the base's frames kept around them
+        fps = sr / HOP_LENGTH
+        frame_lo, frame_hi = int(lo * fps), int(np.ceil(hi * fps))
+        frame_shift = int(round(shift * fps))
+        base_onsets = song_onset_entry(base_path)
+        frame_db = splice_frames(np.load(base_onsets / 'frame_db.npy'),
+                                 mel_db_frames(y, sr, frame_lo, frame_hi),
+                                 frame_lo, frame_hi, frame_shift)
+        envelope = splice_frames(
+            np.load(base_onsets / 'onset.npy'),
+            onset_envelope(y, sr, frame_lo, frame_hi, ref_db=float(frame_db.max(initial=0.0))),
+            frame_lo, frame_hi, frame_shift)
+
+        # And the tempo beat tracking would find in it, under the locks of
+        # their own computation (see `detect_tempo`)
+        tempo_cache_key, onsets_cache_key = tempo_key(audio_path), onset_key(audio_path)
+        with analysis_cache.lock(tempo_cache_key), analysis_cache.lock(onsets_cache_key):
+            if analysis_cache.lookup(onsets_cache_key) is None:
+                with analysis_cache.store(onsets_cache_key) as tmp:
+                    np.save(tmp / 'onset.npy', envelope)
+                    np.save(tmp / 'frame_db.npy', frame_db)
+            tempo = analysis_cache.load_json(tempo_cache_key)
+            if tempo is None:
+                tempo = analysis_cache.save_json(tempo_cache_key, envelope_tempo(envelope, sr))
+
+        # Notes, transcribed with another margin of audio as context
+        first = int(max(lo - EDIT_MARGIN, 0) * sr)
+        last = int(min(hi + EDIT_MARGIN, duration) * sr)
+        _, _, events = predict_notes(y[first:last], midi_tempo=tempo)
+        fresh = note_arrays([(s + first / sr, e + first / sr, *rest) for s, e, *rest in events])
+        notes = splice_notes(load_note_arrays(base_entry / 'notes.npz'), fresh,
+                             lo, hi, shift, edit_start=start)
+
+        midi = note_events_to_midi([
+            (float(s), float(e), int(p), float(a), None)
+            for s, e, p, a in zip(notes['start'], notes['end'], notes['pitch'], notes['amplitude'])
+        ], midi_tempo=tempo)
+        with analysis_cache.store(key) as tmp:
+            with open(tmp / 'notes.mid', 'wb') as f:
+                midi.write(f)
+            save_note_arrays(tmp / 'notes.npz', notes)
+    return True
+
+def find_duplicate(audio_path):
+    """Indexed song that an audio file is another encoding or trim of, or None
+
+    The file is indexed too, so that later uploads can match it. Files with
+    the same content as one indexed already share its cache entries anyway
+    and are not looked up.
+    """
+    from fingerprint import landmarks, refine_offset
+    from waveform import load_waveform, waveform_key
+    content_hash = file_hash(audio_path)
+    if content_hash in fingerprint_index:
+        return None
+    with span('fingerprint', size=os.path.getsize(audio_path)):
+        y, sr = load_waveform(audio_path, analysis_cache, sr=SAMPLE_RATE)
+        hashes, frames = landmarks(y, sr)
+    with span('fingerprint_lookup'):
+        match = fingerprint_index.lookup(hashes, frames, sr, exclude=content_hash)
+    fingerprint_index.add(content_hash, Path(audio_path).suffix, len(y) / sr, hashes, frames)
+    if match is None:
+        return None
+
+    # To the sample, from the matched song's waveform if it was ever analyzed
+    entry = analysis_cache.lookup(waveform_key(match['hash'], SAMPLE_RATE))
+    if entry is not None:
+        reference = np.load(entry / 'pcm.npy', mmap_mode='r')
+        offset = refine_offset(y, reference, int(round(match['offset'] * sr)))
+        match['offset'] = round(offset / sr, 4)
+    return match
+
+def adopt_duplicate(audio_path):
+    """Analyze an upload from the analysis of the song it duplicates
+
+    The tempo, notes and stems of the matched song, moved by the upload's
+    offset in it and cut to its length, are stored as the upload's own, as
+    `reanalyze_edit` does for edits. Uploads that run past the matched song
+    are only reported. Returns the match, with the `stages` adopted.
+    """
+    if not FINGERPRINTS:
+        return None
+    audio_path = Path(audio_path)
+    try:
+        match = find_duplicate(audio_path)
+        if match is None:
+            return None
+        duration = audio_duration(audio_path)
+        # One frame of slack for the peaks the codecs moved
+        slack = 0.05
+        match['stages'] = []
+        if match['offset'] >= -slack and match['offset'] + duration <= match['seconds'] + slack:
+            for stage, adopt in (('tempo', adopt_tempo), ('sheet', adopt_notes),
+                                 ('separate', adopt_stems)):
+                if adopt(audio_path, match, duration):
+                    match['stages'].append(stage)
+        logging.info(f"{audio_path} duplicates {match['hash']} from {match['offset']}s, "
+                     f"adopted {match['stages']}")
+        return match
+    except Exception as e:
+        logging.warning(f"Could not look up duplicates of {audio_path}: {e}")
+        return None
+
+def adopt_tempo(audio_path, match, duration):
+    """Store the tempo of the matched song as the upload's own"""
+    tempo = analysis_cache.load_json(tempo_key(audio_path, content_hash=match['hash']))
+    key = tempo_key(audio_path)
+    if tempo is None:
+        return False
+    with analysis_cache.lock(key):
+        if analysis_cache.entry(key).is_dir():
+            return False
+        analysis_cache.save_json(key, tempo)
+    return True
+
+def adopt_notes(audio_path, match, duration):
+    """Store the notes of the matched song inside the upload, moved to its start"""
+    from basic_pitch.note_creation import note_events_to_midi
+    source = analysis_cache.lookup(midi_key(audio_path, content_hash=match['hash']))
+    key = midi_key(audio_path)
+    if source is None or not (source / 'notes.npz').exists():
+        return False
+    with analysis_cache.lock(key):
+        if analysis_cache.entry(key).is_dir():
+            return False
+        notes = load_note_arrays(source / 'notes.npz')
+        start, end = notes['start'] - match['offset'], notes['end'] - match['offset']
+        inside = (end > 0) & (start < duration)
+        notes = {k: v[inside] for k, v in notes.items()}
+        notes['start'] = np.maximum(start[inside], 0)
+        notes['end'] = np.minimum(end[inside], duration)
+        midi = note_events_to_midi([
+            (float(s), float(e), int(p), float(a), None)
+            for s, e, p, a in zip(notes['start'], notes['end'], notes['pitch'], notes['amplitude'])
+        ], midi_tempo=analysis_cache.load_json(tempo_key(audio_path)) or 120)
+        with analysis_cache.store(key) as tmp:
+            with open(tmp / 'notes.mid', 'wb') as f:
+                midi.write(f)
+            save_note_arrays(tmp / 'notes.npz', notes)
+    return True
+
+def adopt_stems(audio_path, match, duration):
+    """Cut the upload's stems from those of the matched song
+
+    Only when soundfile can read the matched song's stems and write the
+    upload's; other formats are separated again.
+    """
+    import soundfile as sf
+    from separation import can_write
+    if not (can_write(match['suffix']) and can_write(audio_path.suffix)):
+        return False
+    source_path = audio_path.with_suffix(match['suffix'])
+    source = analysis_cache.lookup(separation_key(source_path, content_hash=match['hash']))
+    key = separation_key(audio_path)
+    if source is None:
+        return False
+    with analysis_cache.lock(key):
+        if analysis_cache.entry(key).is_dir():
+            return False
+        with analysis_cache.store(key) as tmp:
+            hashes = {}
+            for stem in ('vocal', 'bgm'):
+                with sf.SoundFile(str(source / f'{stem}{match["suffix"]}')) as f:
+                    sr = f.samplerate
+                    first, length = int(round(match['offset'] * sr)), int(round(duration * sr))
+                    lead = max(-first, 0)
+                    f.seek(max(first, 0))
+                    y = f.read(length - lead, always_2d=True)
+                # Silence where the upload starts before the matched song
+                y = np.pad(y, ((lead, length - lead - len(y)), (0, 0)))
+                path = tmp / f'{stem}{audio_path.suffix}'
+                sf.write(str(path), y, sr)
+                hashes[stem] = file_hash(path)
+            with open(tmp / 'hashes.json', 'w') as f:
+                json.dump(hashes, f)
+    return True
+
+def predict_note_arrays(audio_path):
+    """Note onsets, offsets, pitches and amplitudes of an audio file"""
+    midi_path = predict_midi(Path(audio_path))
+    arrays_path = midi_path.with_name('notes.npz')
+    if arrays_path.exists():
+        return load_note_arrays(arrays_path)
+    # Entries cached before the arrays were stored only have the MIDI
+    return midi_note_arrays(midi_path)
+
+def audio_to_sheet_music(audio_path):
+    """Convert audio file to sheet music notation"""
+    import music21
+    midi_path = predict_midi(Path(audio_path))
 
     # Convert to music21 score
-    score = music21.converter.parse(midi_path)
+    with span('music21_parse', size=os.path.getsize(midi_path)):
+        score = music21.converter.parse(midi_path)
     return score
 
+def export_task(audio_path, fmt='musicxml'):
+    """Path and ETag of a song's score exported as `fmt`, written once
+
+    The MIDI is the cached basic-pitch output itself; the other formats are
+    written by music21 from the notes quantized on the beat track, only
+    when the export is not cached yet.
+    """
+    midi_path = predict_midi(Path(audio_path))
+    if fmt == 'midi':
+        return midi_path, midi_path.parent.name
+
+    name, _ = EXPORT_FORMATS[fmt]
+    key = cache_key(midi_key(audio_path), 'export', format=fmt, grid='beats', maps=1,
+                    beats=beats_key(audio_path))
+    with span('export') as s, analysis_cache.lock(key):
+        entry = analysis_cache.lookup(key)
+        s.cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            logging.info(f"Exporting {audio_path} as {fmt}")
+            notes = predict_note_arrays(audio_path)
+            tempo = detect_tempo(audio_path)
+            beats = detect_beats(audio_path)
+            with span('music21_score'):
+                tonic, mode, _ = estimate_key(notes)
+                score = notes_to_score(notes, tempo, tonic, mode, estimate_meter(notes, tempo),
+                                       beats, key_map(notes), tempo_map(beats))
+            with span(f'write_{fmt}'), analysis_cache.store(key) as tmp:
+                score.write(fmt, tmp / name)
+            entry = analysis_cache.entry(key)
+    return entry / name, key
+
 def get_score_notes(score):
+    import music21
+
     # Extract note data from the score
     notes = []
     
-    for note in score.flat.notes:
+    for note in score.flatten().notes:
         if isinstance(note, music21.note.Note):
             # Get note name and octave
             note_name = note.pitch.step
@@ -320,4 +1525,5 @@ def get_score_notes(score):
     return notes
 
 if __name__ == '__main__':
+    preload_modules(ANALYSIS_MODULES)
     app.run(debug=True, port=5000)
@@ -0,0 +1,225 @@
+"""Batch analysis of whole song libraries.
+
+Songs listed in a manifest (a text file with one path per line, or a
+directory to scan) are analyzed by a pool of worker processes. Each worker
+imports the analysis code and loads its models once, then reuses them for
+every song it receives.
+
+One JSON record per song is appended to the output JSONL file as soon as the
+song is done. The file is also the results index: a rerun skips songs whose
+file is unchanged and already has a successful record with the requested
+stages, so an interrupted batch resumes where it stopped.
+
+    python batch.py songs.txt --output results.jsonl --stages sheet,pitch
+
+Records are flat (note lists are not included; /api/sheet serves them from
+the analysis cache), so they can also be written as Parquet with pyarrow.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+STAGES = ('sheet', 'separate', 'pitch')
+AUDIO_EXTENSIONS = {'.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac', '.aiff'}
+
+# Analysis module of this worker process, imported once by `_init_worker`
+_app = None
+
+
+def read_manifest(manifest):
+    """Audio paths of a manifest file or of a directory tree"""
+    manifest = Path(manifest)
+    if manifest.is_dir():
+        return sorted(str(p) for p in manifest.rglob('*')
+                      if p.suffix.lower() in AUDIO_EXTENSIONS)
+    with open(manifest) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def file_signature(path):
+    """Cheap identity of a file's current content, to detect edits on resume"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_index(output):
+    """Latest record of each path already in the output file"""
+    index = {}
+    if not Path(output).exists():
+        return index
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by an interrupted run
+            index[record['path']] = record
+    return index
+
+
+def is_done(record, path, stages):
+    return (record is not None and record['status'] == 'done'
+            and record['signature'] == file_signature(path)
+            and set(stages) <= set(record['stages']))
+
+
+def _init_worker(warmup):
+    global _app
+    import app
+    _app = app
+    if warmup:
+        app.model_registry.warm_up(warmup, background=False)
+
+
+def pitch_summary(path):
+    """Range and median of the voiced pitch of a song, in MIDI numbers"""
+    import numpy as np
+    contour = _app.song_pitch_contour(path)
+    midi = contour['midi'][contour['voiced']]
+    if not len(midi):
+        return {'voiced_ratio': 0.0}
+    low, median, high = np.percentile(midi, [5, 50, 95])
+    return {
+        'voiced_ratio': round(float(contour['voiced'].mean()), 4),
+        'pitch_low': int(low),
+        'pitch_median': int(median),
+        'pitch_high': int(high),
+    }
+
+
+def analyze_song(path, stages):
+    """Run the requested stages on one song; never raises"""
+    record = {'path': path, 'signature': file_signature(path), 'stages': list(stages),
+              'status': 'done', 'error': None}
+    start = time.perf_counter()
+    try:
+        record['hash'] = _app.file_hash(path)
+        if 'sheet' in stages:
+            sheet = _app.sheet_task(path)
+            record.update(
+                tempo=sheet['tempo'], key=sheet['key'], mode=sheet['mode'],
+                time_signature='/'.join(map(str, sheet['time_signature'])),
+                n_notes=len(sheet['notes']))
+        if 'separate' in stages:
+            stems = _app.separate_task(path)
+            record.update(vocal=stems['vocal'], instrumental=stems['instrumental'])
+        if 'pitch' in stages:
+            record.update(pitch_summary(path))
+    except Exception as e:
+        logging.exception(f"Batch analysis of {path} failed")
+        record.update(status='failed', error=str(e))
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def write_parquet(records, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Writing Parquet requires pyarrow (pip install pyarrow)')
+    pq.write_table(pa.Table.from_pylist(records), str(path))
+
+
+def run_batch(paths, output, stages=STAGES, workers=None, warmup=(), parquet=None,
+              progress=None):
+    """Analyze `paths` into the JSONL file `output`, skipping finished songs
+
+    `progress(done, total, songs_per_minute)` is called after each song.
+    Returns a summary with the counts of analyzed, failed and skipped songs.
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    paths = list(dict.fromkeys(paths))
+    index = load_index(output)
+    missing = [p for p in paths if not os.path.isfile(p)]
+    todo = [p for p in paths
+            if os.path.isfile(p) and not is_done(index.get(p), p, stages)]
+    logging.info(f"Batch: {len(todo)} songs to analyze, "
+                 f"{len(paths) - len(todo) - len(missing)} already done, {len(missing)} missing")
+
+    # Start on a fresh line after a record cut short by an interruption
+    if output.exists() and output.stat().st_size:
+        with open(output, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+    done = failed = 0
+    start = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(list(warmup),),
+        ) as executor, open(output, 'a') as out:
+            futures = [executor.submit(analyze_song, p, list(stages)) for p in todo]
+            for future in as_completed(futures):
+                record = future.result()
+                index[record['path']] = record
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+                done += 1
+                failed += record['status'] == 'failed'
+                rate = 60 * done / (time.perf_counter() - start)
+                if progress is not None:
+                    progress(done, len(todo), rate)
+                logging.info(f"Batch: {done}/{len(todo)} songs, {rate:.1f} songs/min")
+
+    elapsed = time.perf_counter() - start
+    if parquet:
+        write_parquet([index[p] for p in paths if p in index], parquet)
+
+    return {
+        'output': str(output),
+        'analyzed': done - failed,
+        'failed': failed,
+        'skipped': len(paths) - len(todo) - len(missing),
+        'missing': missing,
+        'seconds': round(elapsed, 1),
+        'songs_per_minute': round(60 * done / elapsed, 2) if done else 0.0,
+    }
+
+
+def batch_task(paths, output, stages=STAGES, workers=None):
+    """Background job of /api/batch"""
+    from jobs import report_progress
+    return run_batch(paths, output, stages, workers, progress=lambda done, total, rate:
+                     report_progress(done / total, f"{done}/{total} songs, {rate:.1f} songs/min"))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Analyze a song library in parallel')
+    parser.add_argument('manifest', help='file with one audio path per line, or a directory')
+    parser.add_argument('--output', default='batch_results.jsonl',
+                        help='JSONL results, also used to resume (default: %(default)s)')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma-separated stages among ' + ', '.join(STAGES))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--warmup', default='', help='models to load in each worker up front')
+    parser.add_argument('--parquet', default=None, help='also write the records as Parquet')
+    args = parser.parse_args()
+
+    summary = run_batch(
+        read_manifest(args.manifest), args.output,
+        stages=[s for s in args.stages.split(',') if s],
+        workers=args.workers,
+        warmup=[m for m in args.warmup.split(',') if m],
+        parquet=args.parquet,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
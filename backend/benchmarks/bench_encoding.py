@@ -0,0 +1,75 @@
+"""Payload size and encode time of pitch and note results per format
+
+Usage: python benchmarks/bench_encoding.py [--minutes 4] [--notes 2000]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import librosa
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bench_pitch import synthetic_melody
+from encoding import ARRAYS, JSON, MSGPACK, encode
+from pitch import analyze_contour, midi_to_note_names
+
+
+def pitch_plot(times, hz):
+    """The plotly figure analyze_pitch embeds in its JSON response"""
+    import json
+    import plotly
+    fig = plotly.graph_objs.Figure(
+        data=[plotly.graph_objs.Scatter(x=times, y=hz, mode='lines', name='Pitch Contour')],
+        layout=plotly.graph_objs.Layout(title='Pitch Contour'))
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def payloads(minutes, n_notes):
+    contour = analyze_contour(synthetic_melody(minutes), 22050)
+    voiced = contour['voiced']
+    arrays = {k: contour[k] for k in ('times', 'hz', 'midi', 'cents', 'confidence')}
+    legacy = {'frequencies': midi_to_note_names(contour['midi'][voiced]).tolist(),
+              'times': contour['times']}
+
+    rng = np.random.default_rng(0)
+    starts = np.cumsum(rng.choice([0.5, 1.0], n_notes)).astype(np.float32)
+    durations = rng.choice([0.25, 0.5, 1.0], n_notes).astype(np.float32)
+    midi = rng.integers(55, 80, n_notes).astype(np.int16)
+    notes = [{'noteName': librosa.midi_to_note(m, unicode=False), 'start': float(s),
+              'duration': float(d)} for s, d, m in zip(starts, durations, midi)]
+    sheet = {'tempo': 120.0, 'key': 'A', 'time_signature': [4, 4]}
+
+    return [
+        ('pitch', 'json + plot', JSON, lambda: {**legacy, 'plot': pitch_plot(contour['times'], contour['hz'])}),
+        ('pitch', 'json', JSON, lambda: legacy),
+        ('pitch', 'arrays', ARRAYS, lambda: arrays),
+        ('pitch', 'msgpack', MSGPACK, lambda: arrays),
+        ('sheet', 'json', JSON, lambda: {**sheet, 'notes': notes}),
+        ('sheet', 'arrays', ARRAYS, lambda: {**sheet, 'notes_start': starts,
+                                             'notes_duration': durations, 'notes_midi': midi}),
+        ('sheet', 'msgpack', MSGPACK, lambda: {**sheet, 'notes_start': starts,
+                                               'notes_duration': durations, 'notes_midi': midi}),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=float, default=4)
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'result':>6} {'format':>12} {'KB':>9} {'encode ms':>10}")
+    for result, name, mimetype, build in payloads(args.minutes, args.notes):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            body = encode(build(), mimetype)
+            best = min(best, time.perf_counter() - start)
+        print(f"{result:>6} {name:>12} {len(body) / 1024:>9.1f} {best * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
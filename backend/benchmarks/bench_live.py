@@ -0,0 +1,105 @@
+"""Latency and throughput of the live scoring server with synthetic singers
+
+Each client opens a session and streams a sung melody in 32 ms chunks,
+paced in real time unless --fast is given. Latency is measured from
+sending a chunk to receiving its pitch frames.
+
+Usage: python benchmarks/bench_live.py [--clients 1 10 50] [--seconds 10] [--fast]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from live import serve
+
+SR = 16000
+CHUNK = 512  # One hop, so every chunk produces one pitch frame
+SCALE = [0, 2, 4, 5, 7, 9, 11, 12]
+
+
+def melody(seconds, bpm=120):
+    beat = 60 / bpm
+    notes = [{'pitch': 69 + SCALE[i % 8], 'start': i * beat, 'end': (i + 1) * beat}
+             for i in range(int(seconds * bpm / 60))]
+    t = np.arange(int(SR * beat)) / SR
+    audio = np.concatenate([0.3 * np.sin(2 * np.pi * 440 * 2 ** (SCALE[i % 8] / 12) * t)
+                            for i in range(len(notes))]).astype(np.float32)
+    return notes, audio
+
+
+def start_server():
+    """Run the server on its own event loop thread and return its port"""
+    loop = asyncio.new_event_loop()
+    ready = loop.create_future()
+    threading.Thread(target=loop.run_until_complete,
+                     args=(serve('127.0.0.1', 0, ready=ready),), daemon=True).start()
+    while not ready.done():
+        time.sleep(0.01)
+    return next(iter(ready.result().sockets)).getsockname()[1]
+
+
+async def client(port, notes, audio, realtime):
+    from websockets.asyncio.client import connect
+
+    latencies = []
+    sent = []
+    async with connect(f'ws://127.0.0.1:{port}', compression=None) as ws:
+        await ws.send(json.dumps({'notes': notes, 'sample_rate': SR}))
+        await ws.recv()
+
+        async def receive():
+            async for message in ws:
+                event = json.loads(message)
+                if event['type'] == 'pitch':
+                    latencies.append(time.perf_counter() - sent.pop(0))
+                elif event['type'] == 'summary':
+                    return
+
+        receiver = asyncio.create_task(receive())
+        # The first chunk fills the analysis frame and produces no output
+        await ws.send(audio[:2048 - CHUNK].tobytes())
+        start = time.perf_counter()
+        for i, pos in enumerate(range(2048 - CHUNK, len(audio) - CHUNK, CHUNK)):
+            if realtime:
+                await asyncio.sleep(max(0, start + i * CHUNK / SR - time.perf_counter()))
+            sent.append(time.perf_counter())
+            await ws.send(audio[pos:pos + CHUNK].tobytes())
+        await ws.send(json.dumps({'type': 'end'}))
+        await receiver
+    return latencies
+
+
+async def run(port, clients, seconds, realtime):
+    notes, audio = melody(seconds)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[client(port, notes, audio, realtime)
+                                     for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(results) * 1000, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--fast', action='store_true', help='Send chunks without pacing')
+    args = parser.parse_args()
+
+    port = start_server()
+    print(f"{'clients':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'chunks/s':>10} {'x realtime':>11}")
+    for clients in args.clients:
+        latency, elapsed = asyncio.run(run(port, clients, args.seconds, not args.fast))
+        audio_seconds = len(latency) * CHUNK / SR
+        print(f"{clients:>8} {np.percentile(latency, 50):>8.1f} {np.percentile(latency, 95):>8.1f} "
+              f"{np.percentile(latency, 99):>8.1f} {len(latency) / elapsed:>10.0f} "
+              f"{audio_seconds / elapsed:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark the vectorized pitch contour against the per-frame loop
+
+Usage: python benchmarks/bench_pitch.py [--minutes 4]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import librosa
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pitch import pitch_contour, midi_to_note_names
+
+
+def synthetic_melody(minutes, sr=22050, bpm=120):
+    """A sine melody cycling through an A major scale with short gaps"""
+    beat = 60 / bpm
+    t = np.arange(int(sr * beat)) / sr
+    envelope = (t < 0.9 * beat).astype(np.float32)
+    scale = [0, 2, 4, 5, 7, 9, 11, 12]
+    n_beats = int(minutes * 60 / beat)
+    notes = [0.5 * envelope * np.sin(2 * np.pi * 440 * 2 ** (scale[i % 8] / 12) * t)
+             for i in range(n_beats)]
+    return np.concatenate(notes).astype(np.float32)
+
+
+def loop_contour(pitches, magnitudes):
+    """Previous implementation of analyze_pitch, one frame at a time"""
+    pitch_values = []
+    for i in range(len(pitches[0])):
+        index = magnitudes[:, i].argmax()
+        pitch = pitches[index, i]
+        if pitch > 0:
+            pitch_values.append(librosa.hz_to_note(pitch))
+    plot_y = pitches[magnitudes.argmax(axis=0), range(pitches.shape[1])]
+    return pitch_values, plot_y
+
+
+def vectorized_contour(pitches, magnitudes, sr):
+    contour = pitch_contour(pitches, magnitudes, sr)
+    return midi_to_note_names(contour['midi'][contour['voiced']]).tolist(), contour['hz']
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=float, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sr = 22050
+    y = synthetic_melody(args.minutes, sr)
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
+    print(f"{args.minutes:g} min of audio, {pitches.shape[1]} frames")
+
+    loop_time, (loop_notes, _) = best_of(lambda: loop_contour(pitches, magnitudes), 1)
+    vec_time, (vec_notes, _) = best_of(lambda: vectorized_contour(pitches, magnitudes, sr), args.repeat)
+    assert loop_notes == vec_notes, "Vectorized contour differs from the loop"
+
+    print(f"loop:       {loop_time * 1000:9.1f} ms")
+    print(f"vectorized: {vec_time * 1000:9.1f} ms")
+    print(f"speedup:    {loop_time / vec_time:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Time and peak memory of chunked separation against audio-separator
+
+Each separation runs in a fresh interpreter, so the peak resident memory it
+reports is that of the one separation. Songs are synthetic stereo noise of
+the given durations, at the model's sample rate.
+
+Usage: python benchmarks/bench_separation.py [--durations 60,300] [--workers 1,4]
+       [--synthetic] [--output separation.json]
+
+--synthetic replaces the MDX-Net model by an ONNX graph of the same shape that
+only scales its input, to measure the pipeline itself without the model file.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+CHUNKED = """
+import resource, time
+from separation import ChunkedSeparator, MDX_MODELS
+start = time.perf_counter()
+separator = ChunkedSeparator({model!r}, **MDX_MODELS[{name!r}], workers={workers})
+separator.separate({song!r}, {out!r} + '/bgm.wav', {out!r} + '/vocal.wav')
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+AUDIO_SEPARATOR = """
+import resource, time
+from audio_separator.separator import Separator
+start = time.perf_counter()
+separator = Separator(output_dir={out!r}, model_file_dir={model_dir!r})
+separator.load_model(model_filename={name!r})
+separator.separate({song!r})
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def make_song(path, seconds, sr):
+    import numpy as np
+    import soundfile as sf
+    rng = np.random.default_rng(0)
+    with sf.SoundFile(str(path), 'w', samplerate=sr, channels=2, subtype='PCM_16') as f:
+        for _ in range(int(seconds)):
+            f.write(0.3 * rng.standard_normal((sr, 2)))
+
+
+def make_synthetic_model(path, dim_f):
+    """ONNX graph with the input and output of an MDX-Net model, scaling by 0.5"""
+    import onnx
+    from onnx import TensorProto, helper
+    shape = ['batch', 4, dim_f, 'frames']
+    graph = helper.make_graph(
+        [helper.make_node('Mul', ['input', 'half'], ['output'])], 'synthetic',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, shape)],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, shape)],
+        [helper.make_tensor('half', TensorProto.FLOAT, [], [0.5])])
+    onnx.save(helper.make_model(graph, ir_version=8, opset_imports=[helper.make_opsetid('', 13)]),
+              str(path))
+
+
+def run(code):
+    """(seconds, peak RSS in MB) printed by `code` in a fresh interpreter"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr else 'failed')
+        return None
+    seconds, rss_kb = result.stdout.strip().splitlines()[-1].split()
+    return float(seconds), int(rss_kb) / 1024
+
+
+def main():
+    sys.path.insert(0, str(BACKEND))
+    from app import SEPARATOR_MODEL, SEPARATOR_MODEL_DIR
+    from separation import MDX_MODELS, SAMPLE_RATE
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durations', default='60,300', help='song lengths in seconds')
+    parser.add_argument('--workers', default='1,4', help='chunked separation workers to try')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='use a stand-in model instead of ' + SEPARATOR_MODEL)
+    parser.add_argument('--output', default=None, help='also write the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        model = Path(SEPARATOR_MODEL_DIR) / SEPARATOR_MODEL
+        if args.synthetic:
+            model = Path(tmp) / SEPARATOR_MODEL
+            make_synthetic_model(model, MDX_MODELS[SEPARATOR_MODEL]['dim_f'])
+        elif not model.exists():
+            sys.exit(f"{model} not found: run a separation once to download it, or use --synthetic")
+
+        print(f"{'seconds':>8} {'method':>16} {'time s':>8} {'x realtime':>10} {'peak MB':>8}")
+        for seconds in map(int, args.durations.split(',')):
+            song = Path(tmp) / f'song_{seconds}.wav'
+            make_song(song, seconds, SAMPLE_RATE)
+            runs = {f'chunked x{w}': CHUNKED.format(model=str(model), name=SEPARATOR_MODEL,
+                                                    workers=int(w), song=str(song), out=tmp)
+                    for w in args.workers.split(',')}
+            if not args.synthetic:
+                runs['audio-separator'] = AUDIO_SEPARATOR.format(
+                    model_dir=str(model.parent), name=SEPARATOR_MODEL, song=str(song), out=tmp)
+            for method, code in runs.items():
+                measured = run(code)
+                if measured is None:
+                    continue
+                elapsed, peak_mb = measured
+                results.append({'seconds': seconds, 'method': method, 'time': elapsed,
+                                'peak_mb': peak_mb})
+                print(f"{seconds:>8} {method:>16} {elapsed:8.1f} "
+                      f"{seconds / elapsed:10.1f} {peak_mb:8.0f}")
+            song.unlink()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
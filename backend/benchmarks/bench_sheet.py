@@ -0,0 +1,60 @@
+"""Summary time of a transcribed song: music21 score vs note arrays
+
+Usage: python benchmarks/bench_sheet.py [--notes 2000]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from notes import estimate_key, estimate_meter, midi_note_arrays, score_notes
+
+
+def synthetic_midi(path, n_notes, tempo=120):
+    import pretty_midi
+    rng = np.random.default_rng(0)
+    starts = np.cumsum(rng.choice([0.25, 0.5, 1.0], n_notes)) * 60 / tempo
+    durations = rng.choice([0.25, 0.5, 1.0], n_notes) * 60 / tempo
+    midi = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    instrument = pretty_midi.Instrument(0)
+    instrument.notes = [pretty_midi.Note(90, int(p), float(s), float(s + d)) for s, d, p in
+                        zip(starts, durations, rng.choice([57, 59, 60, 62, 64, 65, 67, 69], n_notes))]
+    midi.instruments.append(instrument)
+    midi.write(str(path))
+
+
+def with_music21(path):
+    import music21
+    score = music21.converter.parse(path)
+    notes = [{'noteName': f"{n.pitch.step}{n.pitch.octave}", 'start': float(n.offset),
+              'duration': float(n.quarterLength)}
+             for n in score.flatten().notes if isinstance(n, music21.note.Note)]
+    next(score.recurse().getElementsByClass(music21.meter.TimeSignature), None)
+    return notes, score.analyze('key').tonic.name, score.metronomeMarkBoundaries()[0][2].number
+
+
+def with_arrays(path, tempo=120):
+    notes = midi_note_arrays(path)
+    return score_notes(notes, tempo), estimate_key(notes)[0], estimate_meter(notes, tempo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'notes.mid'
+        synthetic_midi(path, args.notes)
+        for name, summarize in [('music21', with_music21), ('arrays', with_arrays)]:
+            start = time.perf_counter()
+            notes, key, _ = summarize(str(path))
+            elapsed = time.perf_counter() - start
+            print(f"{name:>8}: {elapsed * 1000:8.1f} ms  {len(notes)} notes, key {key}")
+
+
+if __name__ == '__main__':
+    main()
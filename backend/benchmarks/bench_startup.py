@@ -0,0 +1,73 @@
+"""Import cost per backend module and time until the app serves requests
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+
+Usage: python benchmarks/bench_startup.py [--repeat 3] [--output startup.json]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+
+MODULES = ['flask', 'numpy', 'soundfile', 'librosa', 'music21', 'whisper', 'plotly',
+           'basic_pitch', 'pitch', 'waveform', 'notes', 'encoding', 'app']
+
+IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# Import the app and answer a first upload, as a freshly scaled worker would
+FIRST_REQUEST = """
+import io, time
+start = time.perf_counter()
+from app import app
+client = app.test_client()
+response = client.post('/api/upload', data={'file': (io.BytesIO(b'RIFF'), 'startup.wav')})
+assert response.status_code == 200
+print(time.perf_counter() - start)
+"""
+
+
+def run(code):
+    """Seconds printed by `code` in a fresh interpreter, None if it failed"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def best_of(code, repeat):
+    times = [t for t in (run(code) for _ in range(repeat)) if t is not None]
+    return min(times) if times else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='also write the results as JSON')
+    args = parser.parse_args()
+
+    results = {'imports': {}}
+    print(f"{'module':>12} {'import ms':>10}")
+    for module in MODULES:
+        seconds = best_of(IMPORT.format(module=module), args.repeat)
+        results['imports'][module] = seconds
+        print(f"{module:>12} {'not installed' if seconds is None else f'{seconds * 1000:10.1f}'}")
+
+    results['first_upload'] = best_of(FIRST_REQUEST, args.repeat)
+    print(f"{'first upload':>12} {results['first_upload'] * 1000:10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
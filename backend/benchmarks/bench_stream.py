@@ -0,0 +1,67 @@
+"""Peak memory of streaming pitch analysis for increasing durations
+
+Each duration is analyzed in a fresh process so peak RSS is not shared.
+
+Usage: python benchmarks/bench_stream.py [--minutes 1 10 30]
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+sys.path.insert(0, str(BACKEND / 'benchmarks'))
+
+
+def write_song(path, minutes):
+    """Write the synthetic melody a minute at a time"""
+    import soundfile as sf
+    from bench_pitch import synthetic_melody
+    minute = synthetic_melody(1)
+    with sf.SoundFile(path, 'w', samplerate=22050, channels=1) as f:
+        for _ in range(int(minutes)):
+            f.write(minute)
+
+
+def analyze(path, mode):
+    """Run one analysis and print its wall time and peak RSS"""
+    import librosa
+    from pitch import analyze_contour, stream_analysis
+    start = time.perf_counter()
+    if mode == 'stream':
+        for _ in stream_analysis(path):
+            pass
+    else:
+        y, sr = librosa.load(path, sr=None)
+        analyze_contour(y, sr)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.2f} {peak:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=int, nargs='+', default=[1, 10, 30])
+    args = parser.parse_args()
+
+    print(f"{'minutes':>8} {'mode':>8} {'seconds':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for minutes in args.minutes:
+            path = Path(tmp) / f'{minutes}.wav'
+            write_song(path, minutes)
+            for mode in ('full', 'stream'):
+                out = subprocess.run(
+                    [sys.executable, __file__, '--analyze', str(path), mode],
+                    capture_output=True, text=True, check=True).stdout.split()
+                print(f"{minutes:>8} {mode:>8} {float(out[0]):>8.2f} {float(out[1]):>8.0f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--analyze':
+        analyze(sys.argv[2], sys.argv[3])
+    else:
+        main()
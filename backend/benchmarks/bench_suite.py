@@ -0,0 +1,310 @@
+"""Per-stage time and peak memory of the analysis pipeline on synthetic songs
+
+Songs of each requested length, polyphony and tempo are synthesized from
+known notes, then every stage runs on them in order:
+
+    decode       read the WAV file at the analysis sample rate
+    beat_track   librosa.beat.beat_track
+    basic_pitch  basic-pitch note prediction (app.predict_notes)
+    music21      music21 parsing of the song's MIDI
+    score        music21 score built from the note arrays (notes_to_score)
+    musicxml     writing that score as MusicXML
+    key_map      sliding-window key map of the notes (maps.key_map)
+    piptrack     pitch contour (pitch.analyze_contour)
+    performance  scoring of the song's contour against itself (performance)
+    json         JSON encoding of the sheet and pitch results
+
+The stages after basic_pitch use the synthesized notes, so their cost does
+not change with the model's output. Time is the best of `--repeat` runs;
+peak memory is measured on one more run with tracemalloc, which sees the
+allocations of Python and NumPy but not of ONNX Runtime.
+
+Results are written to benchmarks/results/<commit>.json; pass an earlier
+file to --compare to list the stages that got slower since.
+
+Everything runs offline: basic-pitch's model ships with the package, and
+--stub-models replaces it with a stand-in that outputs the synthesized
+notes, to time note creation without inference.
+
+Usage: python benchmarks/bench_suite.py [--seconds 30,120] [--polyphony 1,3]
+       [--tempo 120] [--repeat 3] [--stages decode,json] [--stub-models]
+       [--output results.json] [--compare benchmarks/results/abc1234.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+
+BACKEND = Path(__file__).resolve().parent.parent
+RESULTS = BACKEND / 'benchmarks' / 'results'
+sys.path.insert(0, str(BACKEND))
+
+STAGES = ['decode', 'beat_track', 'basic_pitch', 'music21', 'score', 'musicxml',
+          'key_map', 'piptrack', 'performance', 'json']
+
+# A major, two octaves from A3
+SCALE = 57 + np.array([0, 2, 4, 5, 7, 9, 11, 12, 14, 16, 17, 19, 21, 23])
+
+
+def synthetic_song(seconds, polyphony=1, tempo=120, sr=22050, seed=0):
+    """Harmonic tones on an eighth-note grid, one line per voice
+
+    Each voice plays notes of 1 to 4 eighths with an occasional rest, an
+    octave apart from the previous voice. Returns the waveform and the note
+    arrays (as `notes.note_arrays`) of what was synthesized.
+    """
+    from notes import note_arrays
+    rng = np.random.default_rng(seed)
+    eighth = 30 / tempo
+    y = np.zeros(int(seconds * sr), dtype=np.float32)
+    events = []
+    for voice in range(polyphony):
+        slot = 0
+        while (slot + 1) * eighth < seconds:
+            length = int(rng.integers(1, 5))
+            if rng.random() > 0.1:
+                start, end = slot * eighth, min((slot + length) * eighth, seconds)
+                pitch = int(rng.choice(SCALE)) - 12 * voice
+                t = np.arange(int((end - start) * sr)) / sr
+                f = 440 * 2 ** ((pitch - 69) / 12)
+                tone = sum(np.sin(2 * np.pi * f * h * t) / h for h in (1, 2, 3))
+                envelope = np.minimum(t / 0.01, 1) * np.exp(-2 * t)
+                i = int(start * sr)
+                y[i:i + len(t)] += (0.3 / polyphony * tone * envelope).astype(np.float32)
+                events.append((start, end, pitch, 0.8, None))
+            slot += length
+    return y, note_arrays(events)
+
+
+class StubPitchModel:
+    """Stand-in for basic-pitch's model that outputs the synthesized notes
+
+    `predict` is called on consecutive windows as `app.predict_notes` reads
+    them; `reset` starts again from the beginning of the song.
+    """
+
+    def __init__(self, notes, sr):
+        from basic_pitch.constants import (ANNOT_N_FRAMES, AUDIO_N_SAMPLES, FFT_HOP,
+                                           N_FREQ_BINS_CONTOURS, N_FREQ_BINS_NOTES)
+        self.notes = notes
+        self.sr = sr
+        self.frames = ANNOT_N_FRAMES
+        self.hop = FFT_HOP
+        self.overlap = 30 * FFT_HOP
+        self.window_hop = AUDIO_N_SAMPLES - self.overlap
+        self.bins = N_FREQ_BINS_NOTES, N_FREQ_BINS_CONTOURS
+        self.reset()
+
+    def reset(self):
+        self.window = 0
+
+    def predict(self, audio):
+        start = self.window * self.window_hop - self.overlap // 2
+        times = (start + np.arange(self.frames) * self.hop) / self.sr
+        self.window += 1
+        active = ((self.notes['start'] <= times[:, None]) & (times[:, None] < self.notes['end']))
+        onset = np.abs(self.notes['start'] - times[:, None]) < self.hop / self.sr / 2
+        note = np.zeros((self.frames, self.bins[0]), dtype=np.float32)
+        onsets = np.zeros_like(note)
+        contour = np.zeros((self.frames, self.bins[1]), dtype=np.float32)
+        index = self.notes['pitch'].astype(np.int64) - 21
+        frame, which = np.nonzero(active)
+        note[frame, index[which]] = 0.9
+        contour[frame, 3 * index[which] + 1] = 0.9
+        frame, which = np.nonzero(onset)
+        onsets[frame, index[which]] = 0.9
+        return {'note': note[None], 'onset': onsets[None], 'contour': contour[None]}
+
+
+def measure(fn, repeat, memory=True, warmup=False):
+    """Result, best time in seconds and traced peak in MB of calling `fn`
+
+    `warmup` calls it once beforehand, for the imports and numba compilation
+    of a stage's first run.
+    """
+    if warmup:
+        fn()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+
+def run_song(seconds, polyphony, tempo, stages, repeat, stub_models, tmp, warmup=False):
+    """Time each of `stages` on one synthetic song"""
+    import librosa
+    import music21
+    import pretty_midi
+    import soundfile as sf
+    import app
+    from encoding import JSON, encode
+    from maps import key_map
+    from notes import estimate_key, notes_to_score, score_notes
+    from performance import score_performance
+    from pitch import analyze_contour
+    from waveform import decode
+
+    sr = app.SAMPLE_RATE
+    y, notes = synthetic_song(seconds, polyphony, tempo, sr)
+    audio_path = Path(tmp) / f'song_{seconds}_{polyphony}_{tempo}.wav'
+    sf.write(str(audio_path), y, sr)
+    midi_path = audio_path.with_suffix('.mid')
+    midi = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    midi.instruments.append(pretty_midi.Instrument(0))
+    midi.instruments[0].notes = [pretty_midi.Note(100, int(p), float(s), float(e)) for s, e, p in
+                                 zip(notes['start'], notes['end'], notes['pitch'])]
+    midi.write(str(midi_path))
+
+    if stub_models:
+        stub = StubPitchModel(notes, sr)
+        app.model_registry.register('basic-pitch', lambda: stub, size_mb=0)
+    model = app.model_registry.get('basic-pitch')
+
+    def predict():
+        if stub_models:
+            model.reset()
+        return app.predict_notes(y, midi_tempo=tempo)
+
+    tonic, mode, _ = estimate_key(notes)
+    contour = analyze_contour(y, sr)
+    score = notes_to_score(notes, tempo, tonic, mode)
+    sheet = {'tempo': tempo, 'notes': score_notes(notes, tempo, app.key_name(tonic, mode)),
+             'key': tonic, 'mode': mode}
+    run = {
+        'decode': lambda: decode(audio_path, sr=sr),
+        'beat_track': lambda: librosa.beat.beat_track(y=y, sr=sr),
+        'basic_pitch': predict,
+        'music21': lambda: music21.converter.parse(str(midi_path)),
+        'score': lambda: notes_to_score(notes, tempo, tonic, mode),
+        'musicxml': lambda: score.write('musicxml', Path(tmp) / 'score.musicxml'),
+        'key_map': lambda: key_map(notes),
+        'piptrack': lambda: analyze_contour(y, sr),
+        'performance': lambda: score_performance(contour, contour, notes, sr / 512),
+        'json': lambda: (encode(sheet, JSON), encode(contour, JSON)),
+    }
+
+    result = {'seconds': seconds, 'polyphony': polyphony, 'tempo': tempo,
+              'notes': len(notes['start']), 'stages': {}}
+    for name in stages:
+        _, elapsed, peak = measure(run[name], repeat, warmup=warmup)
+        result['stages'][name] = {
+            'seconds': round(elapsed, 4),
+            'peak_mb': None if peak is None else round(peak, 1),
+            'x_realtime': round(seconds / elapsed, 1) if elapsed else None,
+        }
+        print(f"{seconds:>7} {polyphony:>5} {tempo:>6} {name:>12} {elapsed * 1000:10.1f} "
+              f"{seconds / elapsed:10.1f} {peak:9.1f}")
+    return result
+
+
+def git_commit():
+    """Short hash of HEAD and whether the tree has changes, if in a git repo"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    cwd=BACKEND, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every stage since `baseline`; return the regressions"""
+    before = {(s['seconds'], s['polyphony'], s['tempo']): s['stages'] for s in baseline['songs']}
+    regressions = []
+    print(f"\nCompared with {baseline['commit']} ({baseline['date'][:10]}):")
+    for song in results['songs']:
+        old = before.get((song['seconds'], song['polyphony'], song['tempo']))
+        if old is None:
+            continue
+        for name, stage in song['stages'].items():
+            if name not in old or not old[name]['seconds']:
+                continue
+            ratio = stage['seconds'] / old[name]['seconds']
+            # Ignore noise on stages of a few milliseconds
+            slower = ratio > 1 + tolerance and stage['seconds'] - old[name]['seconds'] > 0.005
+            if slower:
+                regressions.append((song['seconds'], song['polyphony'], song['tempo'], name, ratio))
+            print(f"{song['seconds']:>7} {song['polyphony']:>5} {song['tempo']:>6} {name:>12} "
+                  f"{ratio:8.2f}x{'  SLOWER' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', default='30,120', help='song lengths in seconds')
+    parser.add_argument('--polyphony', default='1,3', help='simultaneous voices')
+    parser.add_argument('--tempo', default='120', help='tempos in bpm')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--stub-models', action='store_true',
+                        help='replace basic-pitch by a model that outputs the synthesized notes')
+    parser.add_argument('--output', default=None,
+                        help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown ratio reported as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    # The app keeps its uploads and cache relative to the backend directory
+    os.chdir(BACKEND)
+    commit, dirty = git_commit()
+    results = {
+        'commit': commit + ('-dirty' if dirty else ''),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        'stub_models': args.stub_models,
+        'repeat': args.repeat,
+        'songs': [],
+    }
+
+    print(f"{'seconds':>7} {'voices':>5} {'tempo':>6} {'stage':>12} {'time ms':>10} "
+          f"{'x realtime':>10} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in map(int, args.seconds.split(',')):
+            for polyphony in map(int, args.polyphony.split(',')):
+                for tempo in map(float, args.tempo.split(',')):
+                    results['songs'].append(run_song(seconds, polyphony, tempo, stages,
+                                                     args.repeat, args.stub_models, tmp,
+                                                     warmup=not results['songs']))
+
+    output = Path(args.output) if args.output else RESULTS / f"{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} stages slower by more than {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
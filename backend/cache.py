@@ -0,0 +1,247 @@
+"""Content-addressed cache for analysis outputs.
+
+Entries are keyed by the hash of the audio content together with the stage
+and every parameter that affects its output, so the same song uploaded under
+different names is analyzed once, and different songs with the same name
+never share results. Each entry is a directory that is written under a
+temporary name and renamed into place, so readers never see partial outputs.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: entries are only locked within a process
+    fcntl = None
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, memoized by path, size and mtime"""
+    stat = os.stat(path)
+    memo_key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+    with _hash_lock:
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def remember_hash(path, content_hash):
+    """Record the hash of a file computed while writing it"""
+    stat = os.stat(path)
+    with _hash_lock:
+        _hash_memo[(str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)] = content_hash
+
+
+def cache_key(content_hash, stage, **params):
+    """Key of the output of `stage` with `params` on the given content"""
+    spec = json.dumps({'hash': content_hash, 'stage': stage, **params},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """Size-bounded directory of cached analysis outputs
+
+    The size is tracked as entries are stored, and the directory is only
+    scanned when it crosses `max_size`; eviction then goes down to
+    `low_water` of it, so that the next scan is many writes away. Entries
+    used in the last `grace` seconds or locked are kept, as their readers
+    may not have opened them yet.
+    """
+
+    def __init__(self, root, max_size_mb=10240, low_water=0.9, grace=60):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = int(max_size_mb * 2**20)
+        self.low_water = low_water
+        self.grace = grace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._key_locks = {}
+        self._total = None  # Size at the last scan plus the entries stored since
+
+    def entry(self, key):
+        return self.root / key[:2] / key
+
+    def lookup(self, key):
+        """Return the entry directory of `key`, or None on a cache miss"""
+        path = self.entry(key)
+        if path.is_dir():
+            try:
+                os.utime(path)  # Mark as recently used
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return path
+        with self._lock:
+            self.misses += 1
+        return None
+
+    @contextmanager
+    def lock(self, key, blocking=True):
+        """Serialize computation of the same entry across threads and processes
+
+        A key's lock is only kept while it is held or waited for, so neither
+        the locks nor the lock files pile up with the keys ever seen. Without
+        `blocking`, yields whether the lock was taken instead of waiting.
+        """
+        with self._lock:
+            key_lock, users = self._key_locks.get(key, (threading.Lock(), 0))
+            self._key_locks[key] = (key_lock, users + 1)
+        try:
+            if not key_lock.acquire(blocking):
+                yield False
+                return
+            try:
+                if fcntl is None:
+                    yield True
+                else:
+                    with self._file_lock(key, blocking) as locked:
+                        yield locked
+            finally:
+                key_lock.release()
+        finally:
+            with self._lock:
+                key_lock, users = self._key_locks[key]
+                if users == 1:
+                    del self._key_locks[key]
+                else:
+                    self._key_locks[key] = (key_lock, users - 1)
+
+    @contextmanager
+    def _file_lock(self, key, blocking=True):
+        """flock of `.locks/<key>`, which is removed before it is released
+
+        A process that was waiting on the removed file then finds another
+        one at its path, or none, and locks that instead.
+        """
+        lock_dir = self.root / '.locks'
+        lock_dir.mkdir(exist_ok=True)
+        path = lock_dir / key
+        while True:
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                yield False
+                return
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        try:
+            yield True
+        finally:
+            path.unlink(missing_ok=True)
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    @contextmanager
+    def store(self, key):
+        """Yield a staging directory that is published as the entry of `key`"""
+        tmp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=self.root))
+        try:
+            yield tmp
+            path = self.entry(key)
+            path.parent.mkdir(exist_ok=True)
+            size = self._size(tmp)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another worker published the same entry first
+                if not path.is_dir():
+                    raise
+                logging.info(f"Cache entry {key} already exists")
+                size = 0
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+            full = self._total is None or self._total > self.max_size
+        if full:
+            self.evict()
+
+    def load_json(self, key, name='value.json'):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        with open(path / name) as f:
+            return json.load(f)
+
+    def save_json(self, key, value, name='value.json'):
+        with self.store(key) as tmp:
+            with open(tmp / name, 'w') as f:
+                json.dump(value, f)
+        return value
+
+    def _entries(self):
+        for shard in self.root.iterdir():
+            if shard.is_dir() and not shard.name.startswith('.'):
+                yield from (p for p in shard.iterdir() if p.is_dir())
+
+    @staticmethod
+    def _size(path):
+        return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+    def evict(self):
+        """Remove least recently used entries once over the size limit
+
+        The whole directory is scanned, as other processes store entries
+        too; entries are then removed down to `low_water` of the limit.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Another thread is evicting
+        try:
+            entries = []
+            for p in self._entries():
+                try:
+                    entries.append((p.stat().st_mtime, self._size(p), p))
+                except FileNotFoundError:
+                    pass  # Evicted by another process meanwhile
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_size:
+                recent = time.time() - self.grace
+                for mtime, size, path in sorted(entries, key=lambda e: e[0]):
+                    if total <= self.low_water * self.max_size or mtime > recent:
+                        break
+                    with self.lock(path.name, blocking=False) as locked:
+                        if not locked:
+                            continue  # Being computed or read
+                        shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    logging.info(f"Evicted cache entry {path.name}")
+            with self._lock:
+                self._total = total
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'max_size_mb': round(self.max_size / 2**20, 1)}
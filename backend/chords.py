@@ -0,0 +1,147 @@
+"""Chord recognition on the beat grid.
+
+The chroma of a song is averaged between consecutive beats and scored
+against the binary templates of every chord in one matrix product; Viterbi
+decoding over the beats then favours keeping a chord, so that passing
+notes do not flip it. Beats too quiet to hold a chord are 'N'.
+
+Chords are named as the frontend names keys, root letter from
+`PITCH_CLASSES` and a quality suffix: 'C', 'am' (A flat minor), 'G7',
+'Bdim'.
+"""
+import numpy as np
+from utils.music_scale import KEY_INDEX, PITCH_CLASSES, key_indices
+
+HOP_LENGTH = 2048
+N_FFT = 4096
+
+# Semitones of each chord quality from its root, and its name suffix
+CHORD_QUALITIES = {
+    'maj': ((0, 4, 7), ''),
+    'min': ((0, 3, 7), 'm'),
+    'dim': ((0, 3, 6), 'dim'),
+    '7': ((0, 4, 7, 10), '7'),
+}
+NO_CHORD = 'N'
+
+# Probability of keeping the chord from one beat to the next
+P_STAY = 0.7
+# Sharpness of the softmax turning template scores into probabilities
+SCORE_SCALE = 20.0
+# Beats this far below the loudest, in dB, hold no chord
+SILENCE_DB = 40.0
+
+# Roman numeral of each root, in semitones from the tonic, per mode
+ROMAN_DEGREES = {
+    'major': ['I', 'bII', 'II', 'bIII', 'III', 'IV', '#IV', 'V', 'bVI', 'VI', 'bVII', 'VII'],
+    'minor': ['I', 'bII', 'II', 'III', '#III', 'IV', '#IV', 'V', 'VI', '#VI', 'VII', '#VII'],
+}
+
+
+def _chord_templates():
+    """Names, (root, quality) and unit-norm chroma templates of all chords"""
+    names, chords, templates = [], [], []
+    for quality, (intervals, suffix) in CHORD_QUALITIES.items():
+        for root in range(12):
+            template = np.zeros(12)
+            template[(root + np.array(intervals)) % 12] = 1
+            names.append(PITCH_CLASSES[root] + suffix)
+            chords.append((root, quality))
+            templates.append(template / np.linalg.norm(template))
+    return names, chords, np.array(templates)
+
+CHORD_NAMES, CHORDS, CHORD_TEMPLATES = _chord_templates()
+CHORD_INDEX = {name: i for i, name in enumerate(CHORD_NAMES)}
+
+
+def beat_chroma(y, sr, beat_times):
+    """Chroma and loudness in dB of the segments between beats
+
+    Segments run from the start of the song to the first beat, between
+    consecutive beats and from the last beat to the end; their boundaries
+    in seconds are returned too.
+    """
+    import librosa
+    power = np.abs(librosa.stft(np.asarray(y), n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+    chroma = librosa.feature.chroma_stft(S=power, sr=sr, n_fft=N_FFT, norm=None)
+    energy = power.sum(axis=0)
+
+    n_frames = chroma.shape[1]
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    frames = librosa.time_to_frames(beat_times, sr=sr, hop_length=HOP_LENGTH)
+    inside = (frames >= 1) & (frames < n_frames)
+    frames, first = np.unique(frames[inside], return_index=True)
+    bounds = np.concatenate([[0], frames, [n_frames]])
+
+    # Mean over each segment, as sums of the cumulative sums at its bounds
+    def segment_mean(x):
+        total = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(x, axis=1)], axis=1)
+        return (total[:, bounds[1:]] - total[:, bounds[:-1]]) / np.diff(bounds)
+
+    chroma = segment_mean(chroma)
+    loudness = librosa.power_to_db(segment_mean(energy[np.newaxis])[0], ref=np.max)
+    times = np.concatenate([[0], beat_times[inside][first], [len(y) / sr]])
+    return chroma, loudness, times
+
+
+def chord_probabilities(chroma, loudness):
+    """Probability of each chord and of 'N' (last row) for each segment"""
+    norm = np.linalg.norm(chroma, axis=0)
+    scores = CHORD_TEMPLATES @ (chroma / np.where(norm > 0, norm, 1))
+    scores = np.exp(SCORE_SCALE * (scores - scores.max(axis=0)))
+    probabilities = scores / scores.sum(axis=0)
+    silent = (loudness < -SILENCE_DB) | (norm == 0)
+    probabilities = np.vstack([probabilities * ~silent, silent.astype(np.float64)])
+    return np.clip(probabilities, 1e-9, 1)
+
+
+def recognize_chords(chroma, loudness, p_stay=P_STAY):
+    """Index in `CHORD_NAMES` of the chord of each segment, len(CHORD_NAMES) for 'N'"""
+    import librosa
+    probabilities = chord_probabilities(chroma, loudness)
+    transition = librosa.sequence.transition_loop(len(probabilities), p_stay)
+    return librosa.sequence.viterbi(probabilities, transition)
+
+
+def chord_timeline(y, sr, beat_times, p_stay=P_STAY):
+    """Chords of a song as `{'start', 'end', 'chord'}` spans in seconds
+
+    Consecutive beats with the same chord are merged into one span.
+    """
+    if not len(y):
+        return []
+    chroma, loudness, times = beat_chroma(y, sr, beat_times)
+    states = recognize_chords(chroma, loudness, p_stay)
+    names = CHORD_NAMES + [NO_CHORD]
+    changes = np.flatnonzero(np.diff(states)) + 1
+    starts = np.concatenate([[0], changes])
+    ends = np.concatenate([changes, [len(states)]])
+    return [{'start': round(float(times[a]), 3), 'end': round(float(times[b]), 3),
+             'chord': names[states[a]]}
+            for a, b in zip(starts, ends) if times[b] > times[a]]
+
+
+def roman_numeral(chord, key):
+    """Roman numeral of a chord name in a key named as `KEY_NAMES`, e.g. 'vi'
+
+    `key` may also be the key's index in `KEY_NAMES`.
+    """
+    if chord not in CHORD_INDEX:
+        return NO_CHORD
+    root, quality = CHORDS[CHORD_INDEX[chord]]
+    k = KEY_INDEX[key] if isinstance(key, str) else int(key)
+    mode = 'minor' if k >= 12 else 'major'
+    numeral = ROMAN_DEGREES[mode][(root - k % 12) % 12]
+    if quality in ('min', 'dim'):
+        numeral = numeral.lower()
+    return numeral + {'dim': '°', '7': '7'}.get(quality, '')
+
+
+def roman_numerals(timeline, key):
+    """Chord timeline with the Roman numeral of each chord in `key`
+
+    With a key map (see `maps.key_map`), each chord is numbered in the key
+    it starts in.
+    """
+    keys = key_indices(key, [span['start'] for span in timeline])
+    return [{**span, 'roman': roman_numeral(span['chord'], k)} for span, k in zip(timeline, keys)]
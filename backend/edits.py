@@ -0,0 +1,154 @@
+"""Incremental analysis of edited songs.
+
+A trimmed or partly re-recorded song shares its beginning and its end with
+the version it was edited from. `find_edit` locates the changed region by
+comparing the decoded audio of both versions; only that region and a margin
+around it are analyzed again, and the analysis of the rest is spliced in
+from the previous version, shifted by the change in length.
+
+The analyses spliced this way are time-indexed arrays: the note arrays of
+`notes` and the onset strength envelope tempo is estimated from.
+"""
+import numpy as np
+
+HOP_LENGTH = 512
+
+# Envelope frames computed on each side of a block so that its own frames
+# match those of the whole song: the STFT window spans 4 frames, the onset
+# difference 1 more
+CONTEXT_FRAMES = 16
+# Range in dB below the loudest bin of the song that onset strength sees,
+# as `librosa.power_to_db`
+TOP_DB = 80.0
+
+
+def _common_length(a, b, limit, block_size, atol):
+    """Length of the common prefix of `a` and `b`, up to `limit` samples"""
+    for lo in range(0, limit, block_size):
+        hi = min(lo + block_size, limit)
+        differ = np.flatnonzero(np.abs(np.asarray(a[lo:hi]) - np.asarray(b[lo:hi])) > atol)
+        if len(differ):
+            return lo + int(differ[0])
+    return limit
+
+
+def find_edit(old, new, block_size=1 << 16, atol=1e-6):
+    """Changed region of a waveform as `(start, old_stop, new_stop)` samples
+
+    `new[:start]` is `old[:start]` and `new[new_stop:]` is `old[old_stop:]`,
+    with the unchanged beginning and end as long as possible. Both are
+    scanned a block at a time, so only the audio up to the edit is read.
+    """
+    n = min(len(old), len(new))
+    start = _common_length(old, new, n, block_size, atol)
+    end = _common_length(old[::-1], new[::-1], n - start, block_size, atol)
+    return start, len(old) - end, len(new) - end
+
+
+def splice_notes(base, fresh, start, stop, shift, edit_start=None):
+    """Note arrays of an edited song
+
+    Notes starting between `start` and `stop` seconds come from `fresh`, a
+    transcription of the new audio around that range. The others come from
+    `base`, the notes of the previous version; those after the range are
+    moved by `shift` seconds. Notes held from before into the edit, which
+    begins at `edit_start`, are cut there.
+    """
+    before = base['start'] < start
+    after = base['start'] >= stop - shift
+    inside = (fresh['start'] >= start) & (fresh['start'] < stop)
+
+    head = {k: v[before] for k, v in base.items()}
+    if edit_start is not None:
+        head['end'] = np.minimum(head['end'], np.maximum(edit_start, head['start']))
+    tail = {k: v[after] for k, v in base.items()}
+    tail['start'] = tail['start'] + shift
+    tail['end'] = tail['end'] + shift
+
+    notes = {k: np.concatenate([head[k], fresh[k][inside], tail[k]]).astype(base[k].dtype)
+             for k in base}
+    order = np.lexsort((notes['pitch'], notes['start']))
+    return {k: v[order] for k, v in notes.items()}
+
+
+def splice_frames(base, fresh, start, stop, shift):
+    """Frames `[start, stop)` of an edited song's envelope from `fresh`, the
+    others from `base`, those after the edit moved by `shift` frames"""
+    return np.concatenate([base[:start], fresh, base[max(stop - shift, 0):]])
+
+
+def _mel_db(segment, sr):
+    """Mel power spectrogram in dB of `librosa.onset.onset_strength`, unclamped"""
+    import librosa
+    S = librosa.feature.melspectrogram(y=np.asarray(segment), sr=sr, hop_length=HOP_LENGTH)
+    return librosa.power_to_db(S, top_db=None)
+
+
+def _blocks(n_frames, start, stop, block_frames):
+    """Frames `[lo, hi)` of each block and `[first, last)` with their context"""
+    for lo in range(start, stop, block_frames):
+        hi = min(lo + block_frames, stop)
+        yield lo, hi, max(lo - CONTEXT_FRAMES, 0), min(hi + CONTEXT_FRAMES, n_frames)
+
+
+def _segment(y, first, last, n_frames):
+    return y[first * HOP_LENGTH:] if last == n_frames else y[first * HOP_LENGTH:last * HOP_LENGTH]
+
+
+def mel_db_frames(y, sr, start=0, stop=None, block_frames=1 << 14):
+    """Loudest mel bin in dB of each frame `[start, stop)` of a waveform"""
+    n_frames = 1 + len(y) // HOP_LENGTH
+    stop = n_frames if stop is None else min(stop, n_frames)
+    blocks = [_mel_db(_segment(y, first, last, n_frames), sr).max(axis=0)[lo - first:hi - first]
+              for lo, hi, first, last in _blocks(n_frames, start, stop, block_frames)]
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+
+def mel_db_max(y, sr, block_frames=1 << 14):
+    """Loudest mel bin of a waveform in dB, which the onset envelope is clamped to"""
+    return float(mel_db_frames(y, sr, block_frames=block_frames).max(initial=0.0))
+
+
+def onset_envelope(y, sr, start=0, stop=None, block_frames=1 << 14, ref_db=None,
+                   return_frame_db=False):
+    """Onset strength frames `[start, stop)` of a waveform
+
+    Same frames as `librosa.onset.onset_strength(aggregate=np.median)`, the
+    envelope `librosa.beat.beat_track` estimates tempo from, computed a
+    block at a time so that `y` can be memory-mapped. As in librosa, the
+    spectrogram is clamped to `TOP_DB` below its loudest bin over the whole
+    song, `ref_db`; unless it is given (see `mel_db_max`), it takes another
+    pass over the song when the frames asked for are not all of it in one
+    block. Given `ref_db`, only the frames asked for are read.
+
+    With `return_frame_db`, the loudest bin of each frame (see
+    `mel_db_frames`) is returned too, from which the `ref_db` of an edit
+    of the song is found without reading all of it again.
+    """
+    import librosa
+    n_frames = 1 + len(y) // HOP_LENGTH
+    stop = n_frames if stop is None else min(stop, n_frames)
+    if ref_db is None and (start > 0 or stop < n_frames or n_frames > block_frames):
+        ref_db = mel_db_max(y, sr, block_frames)
+    blocks, frame_db = [], []
+    for lo, hi, first, last in _blocks(n_frames, start, stop, block_frames):
+        S = _mel_db(_segment(y, first, last, n_frames), sr)
+        frame_db.append(S.max(axis=0)[lo - first:hi - first])
+        S = np.maximum(S, (S.max() if ref_db is None else ref_db) - TOP_DB)
+        envelope = librosa.onset.onset_strength(S=S, sr=sr, hop_length=HOP_LENGTH,
+                                                aggregate=np.median)
+        blocks.append(envelope[lo - first:hi - first])
+    empty = np.zeros(0, dtype=np.float32)
+    envelope = np.concatenate(blocks) if blocks else empty
+    if return_frame_db:
+        return envelope, np.concatenate(frame_db) if frame_db else empty
+    return envelope
+
+
+def envelope_tempo(envelope, sr):
+    """Tempo in bpm of an onset envelope, as `librosa.beat.beat_track`"""
+    import librosa
+    if not envelope.any():
+        return 0.0
+    return float(librosa.feature.tempo(onset_envelope=envelope, sr=sr,
+                                       hop_length=HOP_LENGTH)[0])
@@ -0,0 +1,112 @@
+"""Compact encodings for array-heavy analysis results.
+
+Results are dicts mixing NumPy arrays with JSON-compatible values. Besides
+plain JSON they can be encoded as:
+
+- `application/vnd.songflowy.arrays`: a small JSON header followed by the
+  raw little-endian arrays, which browsers can view as typed arrays
+  without parsing:
+
+      b'SFA1' | uint32 header length | header | padding | array data
+
+  The header is {"meta": {...}, "arrays": {name: {"dtype", "shape",
+  "offset"}}}, with offsets relative to the data section and aligned to
+  8 bytes.
+
+- `application/msgpack`: MessagePack with each array as a map of its
+  dtype, shape and raw bytes.
+"""
+import json
+import struct
+import numpy as np
+
+JSON = 'application/json'
+ARRAYS = 'application/vnd.songflowy.arrays'
+MSGPACK = 'application/msgpack'
+MIMETYPES = [JSON, ARRAYS, MSGPACK]
+
+MAGIC = b'SFA1'
+ALIGN = 8
+
+
+def _little_endian(array):
+    array = np.ascontiguousarray(array)
+    if array.dtype == np.bool_:
+        array = array.astype(np.uint8)
+    return array.astype(array.dtype.newbyteorder('<'), copy=False)
+
+
+def to_json(data):
+    """JSON text of a result, with arrays as lists"""
+    return json.dumps({
+        k: v.tolist() if isinstance(v, np.ndarray) else v
+        for k, v in data.items()
+    })
+
+
+def encode_arrays(data):
+    """Encode a result in the SFA1 typed-array format"""
+    meta, arrays, chunks = {}, {}, []
+    offset = 0
+    for name, value in data.items():
+        if not isinstance(value, np.ndarray):
+            meta[name] = value
+            continue
+        array = _little_endian(value)
+        arrays[name] = {'dtype': array.dtype.name, 'shape': list(array.shape), 'offset': offset}
+        chunks.append(array.tobytes())
+        padding = -len(chunks[-1]) % ALIGN
+        chunks.append(b'\0' * padding)
+        offset += len(chunks[-2]) + padding
+
+    header = json.dumps({'meta': meta, 'arrays': arrays}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header, *chunks])
+
+
+def decode_arrays(buffer):
+    """Decode an SFA1 payload back into a dict of values and arrays"""
+    if buffer[:4] != MAGIC:
+        raise ValueError('Not an SFA1 payload')
+    (length,) = struct.unpack('<I', buffer[4:8])
+    header = json.loads(buffer[8:8 + length])
+    start = 8 + length
+    data = dict(header['meta'])
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype']).newbyteorder('<')
+        count = int(np.prod(spec['shape']))
+        data[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                   offset=start + spec['offset']).reshape(spec['shape'])
+    return data
+
+
+def encode_msgpack(data):
+    """Encode a result as MessagePack with arrays as raw bytes"""
+    import msgpack
+    packed = {}
+    for name, value in data.items():
+        if isinstance(value, np.ndarray):
+            array = _little_endian(value)
+            value = {'dtype': array.dtype.name, 'shape': list(array.shape),
+                     'data': array.tobytes()}
+        packed[name] = value
+    return msgpack.packb(packed)
+
+
+def decode_msgpack(buffer):
+    import msgpack
+    data = msgpack.unpackb(buffer)
+    for k, v in data.items():
+        if isinstance(v, dict) and v.keys() == {'dtype', 'shape', 'data'}:
+            data[k] = np.frombuffer(v['data'], dtype=np.dtype(v['dtype']).newbyteorder('<')
+                                    ).reshape(v['shape'])
+    return data
+
+
+def encode(data, mimetype):
+    """Encode a result in the given mimetype; returns bytes or str"""
+    if mimetype == ARRAYS:
+        return encode_arrays(data)
+    if mimetype == MSGPACK:
+        return encode_msgpack(data)
+    return to_json(data)
@@ -0,0 +1,197 @@
+"""Audio fingerprints to recognize a song in another encoding or trim.
+
+A song's fingerprint is the constellation of its spectrogram peaks: each
+peak is paired with the next few peaks after it, and the two frequencies
+and the frames between them are packed into one integer hash that a
+lossy codec, a different sample rate or a change of level leaves mostly
+intact. The hashes of every song are kept with the frame of their first
+peak in a SQLite index. The songs that share most hashes with a new upload,
+at the same difference of frames, hold the same audio, and that difference
+is where the upload starts in them, to the frame; `refine_offset` finds
+it to the sample from the waveforms.
+"""
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+N_FFT = 2048
+HOP_LENGTH = 512
+# Peaks above this bin (about 5.5 kHz at 22050 Hz) are left to the codecs
+MAX_BIN = 512
+# Neighbourhood, in bins and frames, a peak is the maximum of
+PEAK_BINS = 15
+PEAK_FRAMES = 11
+PEAKS_PER_SECOND = 30
+# Peaks after an anchor it is paired with, and the furthest one, in frames
+FAN_OUT = 5
+MAX_DELTA = 63
+
+# Landmarks that must agree on the offset of a match, and how many times
+# more than agree on any other song or offset, which only chance explains
+MIN_MATCHES = 20
+MIN_SALIENCE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE NOT NULL,
+    suffix TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS landmarks (
+    hash INTEGER NOT NULL,
+    song INTEGER NOT NULL,
+    frame INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS landmarks_hash ON landmarks (hash);
+"""
+
+
+def spectrogram_peaks(y, sr):
+    """Frames and bins of the strongest local maxima of a spectrogram
+
+    At most `PEAKS_PER_SECOND` peaks are kept in each second, so that quiet
+    passages are described as densely as loud ones.
+    """
+    import librosa
+    from scipy.ndimage import maximum_filter
+    if len(y) < N_FFT:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    S = librosa.amplitude_to_db(
+        np.abs(librosa.stft(np.asarray(y), n_fft=N_FFT, hop_length=HOP_LENGTH))[:MAX_BIN],
+        ref=np.max)
+    peaks = (S == maximum_filter(S, size=(PEAK_BINS, PEAK_FRAMES))) & (S > -80)
+    bins, frames = np.nonzero(peaks)
+
+    second = frames * HOP_LENGTH // sr
+    order = np.lexsort((-S[bins, frames], second))
+    _, first = np.unique(second[order], return_index=True)
+    rank = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)]))
+    keep = order[rank < PEAKS_PER_SECOND]
+    by_time = np.lexsort((bins[keep], frames[keep]))
+    return frames[keep][by_time], bins[keep][by_time]
+
+
+def landmarks(y, sr):
+    """`(hashes, frames)` of the peak pairs of a waveform
+
+    A hash packs the anchor's bin, the paired peak's bin and the frames
+    between them; its frame is the anchor's.
+    """
+    frames, bins = spectrogram_peaks(y, sr)
+    hashes, anchors = [], []
+    for k in range(1, FAN_OUT + 1):
+        delta = frames[k:] - frames[:-k]
+        pair = (delta > 0) & (delta <= MAX_DELTA)
+        hashes.append((bins[:-k][pair] << 15) | (bins[k:][pair] << 6) | delta[pair])
+        anchors.append(frames[:-k][pair])
+    return np.concatenate(hashes), np.concatenate(anchors)
+
+
+def refine_offset(y, reference, offset, excerpt=2 ** 16):
+    """Offset in samples of `y` in `reference`, from one within a frame
+
+    The middle `excerpt` samples of `y` are cross-correlated with
+    `reference` around `offset`; peaks only give it to a frame.
+    """
+    from scipy.signal import correlate
+    excerpt = min(excerpt, len(y))
+    start = (len(y) - excerpt) // 2
+    lo = max(start + offset - HOP_LENGTH, 0)
+    hi = min(start + offset + excerpt + HOP_LENGTH, len(reference))
+    if hi - lo < excerpt:
+        return offset
+    scores = correlate(np.asarray(reference[lo:hi]), np.asarray(y[start:start + excerpt]),
+                       mode='valid', method='fft')
+    return lo + int(np.argmax(scores)) - start
+
+
+@contextmanager
+def _connect(db_path):
+    """Connection that commits on success and is always closed"""
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class FingerprintIndex:
+    """Landmarks of every song seen, in SQLite"""
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.RLock()
+        self._created = False
+
+    def _connect(self):
+        """Connection to the index, whose tables are created on first use"""
+        with self._lock:
+            if not self._created:
+                with _connect(self.db_path) as conn:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                self._created = True
+        return _connect(self.db_path)
+
+    def __contains__(self, content_hash):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM songs WHERE hash = ?",
+                                (content_hash,)).fetchone() is not None
+
+    def add(self, content_hash, suffix, seconds, hashes, frames):
+        """Index the landmarks of a song; songs already indexed are kept"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO songs (hash, suffix, seconds) VALUES (?, ?, ?)",
+                (content_hash, suffix, float(seconds)))
+            if cursor.rowcount:
+                song = cursor.lastrowid
+                conn.executemany(
+                    "INSERT INTO landmarks (hash, song, frame) VALUES (?, ?, ?)",
+                    ((h, song, f) for h, f in zip(hashes.tolist(), frames.tolist())))
+
+    def lookup(self, hashes, frames, sr, exclude=None):
+        """Best match of a song's landmarks, or None
+
+        The match is a dict with the matched song's content `hash`, `suffix`
+        and `seconds`, the `offset` in seconds of the song's start in it,
+        and the number of landmarks that agree (`matches`). Offsets one
+        frame apart are counted together, as resampling can move a peak
+        by a frame.
+        """
+        if not len(hashes):
+            return None
+        with self._connect() as conn:
+            conn.execute("CREATE TEMP TABLE query (hash INTEGER, frame INTEGER)")
+            conn.executemany("INSERT INTO query VALUES (?, ?)",
+                             zip(hashes.tolist(), frames.tolist()))
+            rows = conn.execute(
+                "SELECT l.song, l.frame - q.frame AS delta, COUNT(*) FROM query q "
+                "JOIN landmarks l ON l.hash = q.hash "
+                "JOIN songs s ON s.id = l.song AND s.hash IS NOT ? "
+                "GROUP BY l.song, delta", (exclude,)).fetchall()
+            if not rows:
+                return None
+
+            exact = {(song, delta): count for song, delta, count in rows}
+            votes = {}
+            for (song, delta), count in exact.items():
+                for d in (delta - 1, delta, delta + 1):
+                    votes[song, d] = votes.get((song, d), 0) + count
+            (song, delta), count = max(votes.items(), key=lambda item: item[1])
+            chance = max((c for (s, d), c in votes.items()
+                          if s != song or abs(d - delta) > 2), default=0)
+            if count < max(MIN_MATCHES, MIN_SALIENCE * chance):
+                return None
+            # Of the three offsets counted, the one most landmarks agree on
+            delta = max((delta - 1, delta, delta + 1), key=lambda d: exact.get((song, d), 0))
+            content_hash, suffix, seconds = conn.execute(
+                "SELECT hash, suffix, seconds FROM songs WHERE id = ?", (song,)).fetchone()
+        logging.info(f"Fingerprint matches {content_hash} at {delta} frames ({count} landmarks)")
+        return {'hash': content_hash, 'suffix': suffix, 'seconds': seconds,
+                'offset': round(delta * HOP_LENGTH / sr, 4), 'matches': count}
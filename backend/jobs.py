@@ -0,0 +1,185 @@
+"""Background jobs for long-running analysis tasks.
+
+Jobs are recorded in a local SQLite database and executed by a pool of
+worker processes, so CPU-bound inference neither blocks request threads nor
+needs an external broker. Tasks report progress with `report_progress`, which
+writes straight to the database from the worker process.
+"""
+import json
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+import metrics
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+# (db_path, job_id) of the job running in this worker process
+_current_job = None
+
+
+@contextmanager
+def _connect(db_path):
+    """Connection that commits on success and is always closed"""
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _update(db_path, job_id, **fields):
+    fields['updated'] = time.time()
+    columns = ', '.join(f"{k} = ?" for k in fields)
+    with _connect(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def report_progress(progress, message=None):
+    """Report the progress (0 to 1) of the current job; no-op outside jobs"""
+    if _current_job is None:
+        return
+    db_path, job_id = _current_job
+    try:
+        _update(db_path, job_id, progress=float(progress), message=message)
+    except sqlite3.Error as e:
+        logging.warning(f"Could not report progress of job {job_id}: {e}")
+
+
+def in_job():
+    """Whether this process is a worker running a job"""
+    return _current_job is not None
+
+
+def _run_job(db_path, job_id, fn, args):
+    """Worker-side wrapper that records the status and result of a job
+
+    Returns the final status, the duration and the timing spans of the job,
+    which the server process adds to its metrics.
+    """
+    global _current_job
+    _current_job = (db_path, job_id)
+    _update(db_path, job_id, status=RUNNING)
+    start = time.perf_counter()
+    status = FAILED
+    try:
+        with metrics.collect() as spans:
+            result = fn(*args)
+    except Exception as e:
+        logging.error(f"Job {job_id} failed: {e}")
+        _update(db_path, job_id, status=FAILED, error=str(e),
+                message=traceback.format_exc(limit=5))
+    else:
+        _update(db_path, job_id, status=DONE, progress=1.0,
+                result=json.dumps(result))
+        status = DONE
+    finally:
+        _current_job = None
+    return status, time.perf_counter() - start, spans
+
+
+class JobQueue:
+    """Submit tasks to a process pool and track them in SQLite"""
+
+    def __init__(self, db_path, max_workers=None):
+        self.db_path = str(db_path)
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        with _connect(self.db_path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+
+    @property
+    def executor(self):
+        # Workers are spawned on first use rather than forked from a process
+        # that may already hold model threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def submit(self, kind, fn, *args):
+        """Queue `fn(*args)` and return the job id; `fn` must be picklable"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, now, now))
+
+        try:
+            future = self.executor.submit(_run_job, self.db_path, job_id, fn, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool
+            self.shutdown(wait=False)
+            future = self.executor.submit(_run_job, self.db_path, job_id, fn, args)
+        future.add_done_callback(lambda f: self._on_done(job_id, kind, f))
+        logging.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def _on_done(self, job_id, kind, future):
+        # Failures inside the task are recorded by the worker; this catches
+        # workers that died or arguments that could not be pickled.
+        e = future.exception()
+        if e is not None:
+            logging.error(f"Job {job_id} crashed: {e}")
+            _update(self.db_path, job_id, status=FAILED, error=str(e))
+            return
+        status, seconds, spans = future.result()
+        metrics.replay(spans)
+        with metrics.REGISTRY.lock:
+            metrics.REGISTRY['job_seconds'].observe(seconds, kind=kind, status=status)
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if it does not exist"""
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def wait(self, job_id, timeout=None, interval=0.1):
+        """Poll until the job has finished and return it"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in (DONE, FAILED):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+            time.sleep(interval)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,271 @@
+"""Real-time pitch scoring of sung input over WebSocket.
+
+A client opens a session by sending a JSON message with the target notes,
+as MIDI pitches with onsets and offsets in seconds, or the path of an
+uploaded song whose transcribed notes are the targets:
+
+    {"notes": [{"pitch": 69, "start": 0.5, "end": 1.0}, ...],
+     "sample_rate": 44100, "format": "float32"}
+    {"path": "uploads/vocal_song.wav", "sample_rate": 44100}
+
+and then streams microphone PCM as binary messages (mono, little-endian
+float32 or int16). After every chunk the server answers with the pitch of
+the new frames, and whenever a target note ends with whether it was hit
+and its mean deviation in cents. Sending {"type": "end"} closes the session
+with a summary. {"type": "sync", "time": t} realigns the session clock with
+the song position t (seconds). Malformed messages are answered with
+{"type": "error"} and otherwise ignored.
+
+Sessions run on an asyncio server; the DSP of each chunk is offloaded to a
+thread pool so many sessions can share one process:
+
+    python live.py --port 5001
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import librosa
+
+FMIN = librosa.note_to_hz('C2')
+FMAX = librosa.note_to_hz('C6')
+
+
+def target_arrays(notes):
+    """Start and end times (seconds) and MIDI pitches of notes, by start
+
+    `notes` are note arrays (see `notes.note_arrays`), or a list of dicts
+    with the same `start`, `end` and `pitch`.
+    """
+    if not isinstance(notes, dict):
+        notes = {k: [n[k] for n in notes] for k in ('start', 'end', 'pitch')}
+    starts = np.asarray(notes['start'], dtype=np.float64)
+    order = np.argsort(starts, kind='stable')
+    return (starts[order], np.asarray(notes['end'], dtype=np.float64)[order],
+            np.asarray(notes['pitch'], dtype=np.float64)[order])
+
+
+class LiveScorer:
+    """Incremental pitch tracking and note scoring of one singing session"""
+
+    def __init__(self, notes, sr=44100, frame_length=2048, hop_length=512,
+                 tolerance=50, octave_tolerant=True, min_rms=0.01, offset=0.0):
+        self.starts, self.ends, self.midi = target_arrays(notes)
+        self.sr = sr
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.tolerance = tolerance
+        self.octave_tolerant = octave_tolerant
+        self.min_rms = min_rms
+        self.offset = offset
+
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.position = 0  # Sample index of buffer[0] since the last sync
+
+        n = len(self.midi)
+        self.frames = np.zeros(n, dtype=np.int64)  # Frames during each note
+        self.hits = np.zeros(n, dtype=np.int64)  # Frames sung within tolerance
+        self.voiced = np.zeros(n, dtype=np.int64)  # Frames sung to this note
+        self.cents_sum = np.zeros(n)
+        self.max_duration = float((self.ends - self.starts).max()) if n else 0.0
+        self.by_end = np.argsort(self.ends, kind='stable')
+        self.reported = 0  # Notes of `by_end` already reported
+
+    def sync(self, time):
+        """Align the next sample received with song time `time`"""
+        self.offset = time
+        self.position = 0
+        self.buffer = self.buffer[:0]
+
+    def feed(self, samples):
+        """Consume a chunk of PCM and return the resulting events"""
+        self.buffer = np.concatenate([self.buffer, np.asarray(samples, dtype=np.float32)])
+        if len(self.buffer) < self.frame_length:
+            return []
+
+        n_frames = 1 + (len(self.buffer) - self.frame_length) // self.hop_length
+        segment = self.buffer[:self.frame_length + (n_frames - 1) * self.hop_length]
+        f0 = librosa.yin(segment, fmin=FMIN, fmax=FMAX, sr=self.sr,
+                         frame_length=self.frame_length, hop_length=self.hop_length,
+                         center=False)
+        frames = librosa.util.frame(segment, frame_length=self.frame_length,
+                                    hop_length=self.hop_length)
+        rms = np.sqrt(np.mean(frames ** 2, axis=0))
+        times = self.offset + (self.position + np.arange(n_frames) * self.hop_length
+                               + self.frame_length / 2) / self.sr
+
+        consumed = n_frames * self.hop_length
+        self.buffer = self.buffer[consumed:]
+        self.position += consumed
+
+        voiced = rms >= self.min_rms
+        sung = 69 + 12 * np.log2(f0 / 440.0)
+        target, cents = self._score(times, sung, voiced)
+
+        events = [{
+            'type': 'pitch',
+            'times': np.round(times, 3).tolist(),
+            'hz': np.where(voiced, np.round(f0, 1), 0).tolist(),
+            'target': target.tolist(),
+            'cents': cents.tolist(),
+        }]
+        events.extend(self._finished_notes(times[-1]))
+        return events
+
+    def _score(self, times, sung, voiced):
+        """Match frames to the closest active target note and accumulate"""
+        target = np.full(len(times), -1)
+        cents = np.zeros(len(times), dtype=np.int64)
+
+        # Only notes overlapping this chunk are candidates
+        lo = np.searchsorted(self.starts, times[0] - self.max_duration, side='left')
+        hi = np.searchsorted(self.starts, times[-1], side='right')
+        candidates = np.flatnonzero(self.ends[lo:hi] > times[0]) + lo
+        if len(candidates) == 0:
+            return target, cents
+
+        active = ((self.starts[candidates][None, :] <= times[:, None])
+                  & (times[:, None] < self.ends[candidates][None, :]))
+        self.frames[candidates] += active.sum(axis=0)
+
+        dev = 100 * (sung[:, None] - self.midi[candidates][None, :])
+        if self.octave_tolerant:
+            dev = (dev + 600) % 1200 - 600
+        distance = np.where(active, np.abs(dev), np.inf)
+        best = distance.argmin(axis=1)
+        matched = voiced & np.isfinite(distance[np.arange(len(times)), best])
+
+        rows = np.flatnonzero(matched)
+        notes = candidates[best[rows]]
+        frame_cents = dev[rows, best[rows]]
+        np.add.at(self.voiced, notes, 1)
+        np.add.at(self.cents_sum, notes, frame_cents)
+        np.add.at(self.hits, notes, np.abs(frame_cents) <= self.tolerance)
+
+        target[rows] = notes
+        cents[rows] = np.round(frame_cents)
+        return target, cents
+
+    def _note_result(self, i):
+        accuracy = self.hits[i] / self.frames[i] if self.frames[i] else 0.0
+        return {
+            'type': 'note',
+            'index': int(i),
+            'pitch': int(self.midi[i]),
+            'hit': bool(accuracy >= 0.5),
+            'accuracy': round(float(accuracy), 3),
+            'cents': round(float(self.cents_sum[i] / self.voiced[i]), 1) if self.voiced[i] else None,
+        }
+
+    def _finished_notes(self, time):
+        events = []
+        while self.reported < len(self.by_end) and self.ends[self.by_end[self.reported]] <= time:
+            events.append(self._note_result(self.by_end[self.reported]))
+            self.reported += 1
+        return events
+
+    def finish(self):
+        """Report the notes not finished yet and a summary of the session"""
+        events = self._finished_notes(np.inf)
+        scored = self.frames > 0
+        hits = int(sum(self.hits[i] >= 0.5 * self.frames[i] for i in np.flatnonzero(scored)))
+        events.append({
+            'type': 'summary',
+            'notes': int(scored.sum()),
+            'hits': hits,
+            'score': round(100 * hits / scored.sum(), 1) if scored.any() else 0.0,
+        })
+        return events
+
+
+def session_targets(init):
+    """Target notes of a session's opening message"""
+    if 'notes' in init:
+        return init['notes']
+    # Heavy; only needed when scoring against a file
+    from app import UPLOAD_FOLDER, predict_note_arrays
+    path = Path(init['path']).resolve()
+    if not path.is_relative_to(UPLOAD_FOLDER.resolve()) or not path.is_file():
+        raise ValueError(f"Not an uploaded file: {init['path']}")
+    return predict_note_arrays(path)
+
+
+def error(message):
+    return json.dumps({'type': 'error', 'error': message})
+
+
+async def handle_session(websocket, executor):
+    loop = asyncio.get_running_loop()
+    try:
+        init = json.loads(await websocket.recv())
+        notes = await loop.run_in_executor(executor, session_targets, init)
+        scorer = LiveScorer(
+            notes,
+            sr=int(init.get('sample_rate', 44100)),
+            tolerance=float(init.get('tolerance', 50)),
+            offset=float(init.get('offset', 0.0)),
+        )
+    except Exception as e:
+        await websocket.send(error(str(e)))
+        return
+
+    dtype = np.int16 if init.get('format') == 'int16' else np.float32
+    await websocket.send(json.dumps({'type': 'ready', 'notes': len(scorer.midi)}))
+
+    async for message in websocket:
+        if isinstance(message, bytes):
+            if len(message) % np.dtype(dtype).itemsize:
+                await websocket.send(error(f'Audio frame of {len(message)} bytes is not whole '
+                                           f'{np.dtype(dtype).name} samples'))
+                continue
+            pcm = np.frombuffer(message, dtype=dtype)
+            if dtype == np.int16:
+                pcm = pcm.astype(np.float32) / 32768
+            events = await loop.run_in_executor(executor, scorer.feed, pcm)
+        else:
+            try:
+                control = json.loads(message)
+                if control.get('type') == 'end':
+                    break
+                if control.get('type') == 'sync':
+                    scorer.sync(float(control['time']))
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                await websocket.send(error(f'Invalid control message: {e!r}'))
+            events = []
+        for event in events:
+            await websocket.send(json.dumps(event))
+
+    for event in scorer.finish():
+        await websocket.send(json.dumps(event))
+
+
+async def serve(host='0.0.0.0', port=5001, workers=None, ready=None):
+    """Run the scoring server until cancelled"""
+    from websockets.asyncio.server import serve as ws_serve
+
+    executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+    # Compile librosa's numba kernels before the first session needs them
+    LiveScorer([{'pitch': 69, 'start': 0.0, 'end': 0.5}]).feed(
+        np.zeros(4096, dtype=np.float32))
+
+    async with ws_serve(lambda ws: handle_session(ws, executor), host, port,
+                        compression=None) as server:
+        logging.info(f"Live scoring server listening on ws://{host}:{port}")
+        if ready is not None:
+            ready.set_result(server)
+        await asyncio.get_running_loop().create_future()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Real-time pitch scoring server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers))
@@ -0,0 +1,218 @@
+"""Lyrics transcription of vocal stems with word timestamps.
+
+The vocals are split at silences into chunks of at most one Whisper window,
+and the chunks are transcribed in parallel by a pool of worker processes,
+each holding its own model: Whisper installs its key/value cache hooks on
+the model while decoding, so one model cannot serve several threads. The
+segments and words of the chunks are moved back to song time and merged,
+and word starts are snapped to the note onsets of the sheet pipeline,
+which mark syllables more precisely than Whisper's attention alignment.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Level below the peak, in dB, under which the vocals count as silence
+TOP_DB = 40
+# Silence, in seconds, long enough to start a new chunk
+MAX_GAP = 2.0
+# Whisper's window; shorter chunks cost the same encoder pass
+MAX_CHUNK_SECONDS = 30.0
+# Distance, in seconds, from which word starts are snapped to note onsets
+SNAP_SECONDS = 0.15
+MIN_WORD_SECONDS = 0.05
+
+
+def speech_chunks(y, sr, top_db=TOP_DB, max_gap=MAX_GAP, max_seconds=MAX_CHUNK_SECONDS,
+                  hop_length=512):
+    """`(start, stop)` samples of the chunks of a vocal track to transcribe
+
+    Non-silent intervals closer than `max_gap` seconds are packed into
+    chunks of up to `max_seconds`; longer intervals are cut at their
+    quietest frame, so that chunks never start or end inside a word that
+    has a pause to cut at.
+    """
+    import librosa
+    if not len(y) or not np.any(y):
+        return []
+    intervals = librosa.effects.split(y, top_db=top_db, hop_length=hop_length)
+    max_len, gap = int(max_seconds * sr), int(max_gap * sr)
+
+    pieces = []
+    for start, stop in intervals:
+        while stop - start > max_len:
+            # Quietest frame of the second half of a window-long piece
+            lo = start + max_len // 2
+            rms = librosa.feature.rms(y=y[lo:start + max_len], hop_length=hop_length)[0]
+            cut = lo + int(np.argmin(rms)) * hop_length
+            pieces.append((start, cut))
+            start = cut
+        pieces.append((start, stop))
+
+    chunks = []
+    for start, stop in pieces:
+        if chunks and start - chunks[-1][1] <= gap and stop - chunks[-1][0] <= max_len:
+            chunks[-1] = (chunks[-1][0], stop)
+        else:
+            chunks.append((start, stop))
+    return [(int(start), int(stop)) for start, stop in chunks]
+
+
+def transcribe_chunk(model, audio, language=None):
+    """Segments and words of one chunk, as plain dicts with chunk times"""
+    result = model.transcribe(audio, language=language, word_timestamps=True,
+                              condition_on_previous_text=False, fp16=False, verbose=None)
+    return {
+        'language': result.get('language', language),
+        'segments': [{
+            'start': float(s['start']),
+            'end': float(s['end']),
+            'text': s['text'].strip(),
+            'words': [{'word': w['word'].strip(), 'start': float(w['start']),
+                       'end': float(w['end']), 'probability': float(w['probability'])}
+                      for w in s.get('words', [])],
+        } for s in result['segments']],
+    }
+
+
+class InlineTranscriber:
+    """Chunks transcribed one after the other by a model of this process
+
+    The caller must hold the model exclusively (see `ModelRegistry.use`).
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def map(self, audios, language=None, progress=None):
+        results = []
+        for audio in audios:
+            results.append(transcribe_chunk(self.model, audio, language))
+            if progress is not None:
+                progress(len(results) / len(audios))
+        return results
+
+
+# Model of a WhisperPool worker process
+_model = None
+
+
+def _init_worker(loader, name, threads):
+    global _model
+    # Before torch is imported, so that its thread pool is sized by it
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    _model = loader(name)
+
+
+def _transcribe_in_worker(audio, language):
+    return transcribe_chunk(_model, audio, language)
+
+
+def load_whisper_model(name):
+    import whisper
+    return whisper.load_model(name, device='cpu')
+
+
+class WhisperPool:
+    """Worker processes that each load Whisper `name` with `loader`
+
+    The cores are shared between the workers, so that chunks transcribed
+    at the same time do not compete for the same cores.
+    """
+
+    def __init__(self, name, workers=None, loader=load_whisper_model):
+        cores = os.cpu_count() or 1
+        self.workers = workers or cores
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(loader, name, max(1, cores // self.workers)),
+        )
+
+    def map(self, audios, language=None, progress=None):
+        """Results of `transcribe_chunk` on each of `audios`, in order"""
+        futures = {self.executor.submit(_transcribe_in_worker, audio, language): i
+                   for i, audio in enumerate(audios)}
+        results = [None] * len(audios)
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done / len(audios))
+        return results
+
+    def close(self):
+        """Stop the workers once the chunks already submitted are done"""
+        self.executor.shutdown(wait=False)
+
+
+def transcribe_lyrics(y, sr, transcriber, language=None, progress=None):
+    """Text, segments and words of a vocal track, in seconds from its start
+
+    Without a `language`, the first chunk is transcribed on its own and
+    the language Whisper detects in it is used for the others, so that all
+    chunks are decoded in the same language.
+    """
+    chunks = speech_chunks(y, sr)
+    audios = [np.ascontiguousarray(y[start:stop], dtype=np.float32) for start, stop in chunks]
+    logging.info(f"Transcribing {len(chunks)} chunks of vocals")
+
+    results = []
+    if audios and language is None:
+        results = transcriber.map(audios[:1])
+        language = results[0]['language']
+    first = len(results)
+
+    def report(fraction):
+        if progress is not None:
+            progress((first + fraction * (len(audios) - first)) / len(audios))
+
+    results += transcriber.map(audios[first:], language, progress=report)
+    return merge_chunks(chunks, results, sr, language)
+
+
+def merge_chunks(chunks, results, sr, language=None):
+    """Segments of all chunks in song time, with their words listed apart"""
+    segments, words = [], []
+    for (start, _), result in zip(chunks, results):
+        offset = start / sr
+        for segment in result['segments']:
+            for word in segment['words']:
+                words.append({**word, 'start': round(word['start'] + offset, 3),
+                              'end': round(word['end'] + offset, 3),
+                              'segment': len(segments)})
+            segments.append({'start': round(segment['start'] + offset, 3),
+                             'end': round(segment['end'] + offset, 3),
+                             'text': segment['text']})
+    return {
+        'text': ' '.join(s['text'] for s in segments if s['text']),
+        'language': language,
+        'segments': segments,
+        'words': words,
+    }
+
+
+def align_words(words, onsets, max_shift=SNAP_SECONDS):
+    """Words whose start is moved to the nearest note onset within `max_shift`
+
+    Starts stay in order and each word keeps at least `MIN_WORD_SECONDS`.
+    `aligned` tells which words were snapped.
+    """
+    if not words:
+        return []
+    starts = np.array([w['start'] for w in words])
+    ends = np.array([w['end'] for w in words])
+    onsets = np.sort(np.asarray(onsets, dtype=np.float64))
+    snapped = np.zeros(len(words), dtype=bool)
+    if len(onsets):
+        i = np.clip(np.searchsorted(onsets, starts), 1, max(len(onsets) - 1, 1))
+        before, after = onsets[i - 1], onsets[np.minimum(i, len(onsets) - 1)]
+        nearest = np.where(np.abs(after - starts) < np.abs(starts - before), after, before)
+        snapped = np.abs(nearest - starts) <= max_shift
+        starts = np.maximum.accumulate(np.where(snapped, nearest, starts))
+    ends = np.maximum(ends, starts + MIN_WORD_SECONDS)
+    return [{**w, 'start': round(float(s), 3), 'end': round(float(e), 3), 'aligned': bool(a)}
+            for w, s, e, a in zip(words, starts, ends, snapped)]
@@ -0,0 +1,130 @@
+"""Key and tempo maps of songs that modulate or drift.
+
+The key map scores the pitch classes sounding in overlapping windows
+against the Krumhansl-Kessler profiles, all windows in one matrix product,
+and decodes the window keys with Viterbi so that the key only changes
+where several windows agree. The tempo map follows a dynamic tempogram:
+the onset envelope's tempo is estimated frame by frame near the song's
+global tempo, beats are tracked at that varying tempo, and the map lists
+the spans of beats that keep the same tempo.
+
+Maps are lists of `{'start', 'end', ...}` spans in seconds.
+"""
+import numpy as np
+from notes import KEY_PROFILES, MAJOR_TONICS, MINOR_TONICS
+from utils.music_scale import KEY_NAMES
+
+# Windows of the key map, in seconds: about 8 bars, one every bar
+KEY_WINDOW = 16.0
+KEY_HOP = 2.0
+# Probability of keeping the key from one window to the next
+KEY_P_STAY = 0.98
+KEY_SCORE_SCALE = 10.0
+
+# Spread of the frame tempo around the global tempo, in octaves
+TEMPO_STD = 0.2
+# Beats over which the local tempo of the map is measured
+TEMPO_BEATS = 8
+# Relative change of the local tempo that starts a new span
+TEMPO_TOLERANCE = 0.03
+
+
+def sounding_time(notes, times):
+    """Seconds each pitch class has sounded before each time, `(len(times), 12)`
+
+    A note adds `min(t, end) - start` once started, so the total is a sum of
+    ramps read from the cumulative sums of sorted onsets and offsets.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    total = np.zeros((len(times), 12))
+    pitch_class = np.asarray(notes['pitch']) % 12
+    for p in range(12):
+        for edges, sign in ((notes['start'], 1), (notes['end'], -1)):
+            edges = np.sort(edges[pitch_class == p])
+            before = np.searchsorted(edges, times)
+            cumulative = np.concatenate([[0.0], np.cumsum(edges)])
+            total[:, p] += sign * (before * times - cumulative[before])
+    return total
+
+
+def window_key_scores(notes, starts, length=KEY_WINDOW):
+    """Correlation of the pitch classes of each window with the 24 keys"""
+    histograms = sounding_time(notes, starts + length) - sounding_time(notes, starts)
+    std = histograms.std(axis=1, keepdims=True)
+    histograms = (histograms - histograms.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1)
+    return histograms @ KEY_PROFILES.T / 12
+
+
+def key_map(notes, window=KEY_WINDOW, hop=KEY_HOP, p_stay=KEY_P_STAY):
+    """Keys of a song as `{'start', 'end', 'key', 'tonic', 'mode'}` spans
+
+    Each window votes for the keys of its centre; windows without notes
+    vote for none. `key` is named as `KEY_NAMES`, `tonic` as music21 does.
+    """
+    import librosa
+    if not len(notes['start']):
+        return []
+    end = float(notes['end'].max())
+    starts = np.arange(-window / 2, max(end - window / 2, 0) + hop, hop)
+    scores = window_key_scores(notes, starts, window)
+    probabilities = np.exp(KEY_SCORE_SCALE * (scores - scores.max(axis=1, keepdims=True)))
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    states = librosa.sequence.viterbi(
+        probabilities.T, librosa.sequence.transition_loop(24, p_stay))
+
+    # Key changes halfway between the centres of the windows that disagree
+    changes = np.flatnonzero(np.diff(states)) + 1
+    bounds = np.concatenate([[0.0], starts[changes] + (window - hop) / 2, [end]])
+    spans = []
+    for i, state in enumerate(states[np.concatenate([[0], changes])]):
+        minor = state >= 12
+        spans.append({
+            'start': round(float(bounds[i]), 3),
+            'end': round(float(bounds[i + 1]), 3),
+            'key': KEY_NAMES[state],
+            'tonic': (MINOR_TONICS if minor else MAJOR_TONICS)[state % 12],
+            'mode': 'minor' if minor else 'major',
+        })
+    return spans
+
+
+def tempo_curve(envelope, sr, tempo, hop_length=512, std=TEMPO_STD):
+    """Tempo in bpm of each frame of an onset envelope, near `tempo`
+
+    The prior keeps the estimate within a fraction of an octave of the
+    global tempo, so that drift is followed but octave errors are not.
+    """
+    import librosa
+    if not tempo or not envelope.any():
+        return np.full(len(envelope), float(tempo or 120.0))
+    return librosa.feature.tempo(onset_envelope=envelope, sr=sr, hop_length=hop_length,
+                                 start_bpm=tempo, std_bpm=std, aggregate=None)
+
+
+def tempo_map(beat_times, tolerance=TEMPO_TOLERANCE, n_beats=TEMPO_BEATS):
+    """Tempo of a beat track as `{'start', 'end', 'tempo'}` spans
+
+    The local tempo of each beat is measured over the `n_beats` around it,
+    which averages out the jitter of single beats; a span ends where it
+    strays more than `tolerance` from the span's mean.
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    if len(beat_times) < 2:
+        return []
+    n = min(n_beats, len(beat_times) - 1)
+    # Tempo over beats [i, i + n], for the beats around each window's centre
+    local = 60 * n / (beat_times[n:] - beat_times[:-n])
+    local = np.concatenate([np.full(n // 2, local[0]), local,
+                            np.full(len(beat_times) - len(local) - n // 2, local[-1])])
+
+    # Span means from running sums, so each beat is checked in constant time
+    sums = np.concatenate([[0.0], np.cumsum(local)])
+    spans, first = [], 0
+    for i in range(1, len(beat_times)):
+        mean = (sums[i] - sums[first]) / (i - first)
+        if abs(local[i] - mean) > tolerance * mean and i < len(beat_times) - 1:
+            spans.append((first, i, mean))
+            first = i
+    spans.append((first, len(beat_times) - 1, (sums[-1] - sums[first]) / (len(local) - first)))
+    return [{'start': round(float(beat_times[a]), 3), 'end': round(float(beat_times[b]), 3),
+             'tempo': round(float(t), 2)} for a, b, t in spans]
@@ -0,0 +1,250 @@
+"""Timing of pipeline stages, in Prometheus' text exposition format.
+
+Stages are timed with `span`, which records their duration, input size and
+cache outcome in the process-wide `REGISTRY`, rendered by `/metrics`.
+Spans are inclusive: a stage that runs others counts their time too.
+
+Background jobs run in worker processes, whose registries are never
+scraped; `collect` gathers the spans of a job so the server process can
+`replay` them into its own. The same collection gives a request its
+Server-Timing header.
+
+`StackSampler` is a sampling profiler for one thread, for requests that
+ask to be profiled.
+"""
+import collections
+import math
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PREFIX = 'songflowy_'
+
+# Seconds, from a cached lookup to the separation of a long song
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Bytes, from a short clip to an hour of decoded audio
+SIZE_BUCKETS = tuple(2 ** n for n in range(16, 32, 2))
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label values"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = PREFIX + name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[k]) for k in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labels, key)} {_number(value)}'
+
+
+class Gauge(Counter):
+    """Current value per label values, set when the metrics are rendered"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[tuple(str(labels[k]) for k in self.labels)] = value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name, self.help, self.labels = PREFIX + name, help, tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {}  # label values -> [count per bucket, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[k]) for k in self.labels)
+        counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self.values[key] = (counts, total + value)
+
+    def samples(self):
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _labels(self.labels + ('le',), key + (_number(bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, key)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labels, key)} {cumulative}'
+
+
+class Registry:
+    """Named metrics of one process, updated from any thread"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def add(self, metric):
+        self.metrics[metric.name[len(PREFIX):]] = metric
+        return metric
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REGISTRY.add(Histogram('request_seconds', 'Latency of HTTP requests until the response '
+                       'is returned', ('route', 'method', 'status')))
+REGISTRY.add(Histogram('stage_seconds', 'Duration of pipeline stages, including the '
+                       'stages they run', ('stage', 'cache')))
+REGISTRY.add(Histogram('stage_input_bytes', 'Size of the input of pipeline stages',
+                       ('stage',), SIZE_BUCKETS))
+REGISTRY.add(Counter('stage_errors_total', 'Pipeline stages that raised', ('stage',)))
+REGISTRY.add(Histogram('job_seconds', 'Duration of background jobs', ('kind', 'status')))
+
+_local = threading.local()
+
+
+class Span:
+    """Duration of a stage; the stage may set its `size` and `cache` outcome"""
+
+    def __init__(self, stage, size=None):
+        self.stage = stage
+        self.size = size
+        self.cache = None  # 'hit' or 'miss' for stages backed by the cache
+        self.seconds = 0.0
+        self.error = False
+
+    def record(self):
+        return self.stage, self.seconds, self.size, self.cache, self.error
+
+
+def observe(stage, seconds, size=None, cache=None, error=False, registry=None):
+    """Record a finished span in `registry` (the process-wide one by default)"""
+    registry = registry or REGISTRY
+    with registry.lock:
+        registry['stage_seconds'].observe(seconds, stage=stage, cache=cache or 'none')
+        if size is not None:
+            registry['stage_input_bytes'].observe(size, stage=stage)
+        if error:
+            registry['stage_errors_total'].inc(stage=stage)
+
+
+@contextmanager
+def span(stage, size=None):
+    """Time the block as `stage`, counting it as an error if it raises"""
+    s = Span(stage, size)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException:
+        s.error = True
+        raise
+    finally:
+        s.seconds = time.perf_counter() - start
+        observe(*s.record())
+        collected = getattr(_local, 'spans', None)
+        if collected is not None:
+            collected.append(s.record())
+
+
+@contextmanager
+def collect():
+    """Also gather the spans finished by this thread in the block into a list"""
+    previous = getattr(_local, 'spans', None)
+    _local.spans = spans = []
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
+        if previous is not None:
+            previous.extend(spans)
+
+
+def replay(spans, registry=None):
+    """Record spans gathered by `collect` in another process"""
+    for record in spans:
+        observe(*record, registry=registry)
+
+
+def server_timing(spans, limit=32):
+    """Server-Timing header value of a request's spans, in milliseconds"""
+    entries = []
+    for stage, seconds, _, cache, _ in spans[:limit]:
+        entry = f'{stage};dur={seconds * 1000:.1f}'
+        if cache:
+            entry += f';desc="{cache}"'
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+class StackSampler:
+    """Sampling profiler of one thread
+
+    A daemon thread reads the stack of `thread_id` every `interval` seconds;
+    `collapsed` returns the sampled stacks in the collapsed format of
+    flamegraph.pl and speedscope, one `outer;...;inner count` line each.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({Path(code.co_filename).name})')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
@@ -0,0 +1,156 @@
+"""Process-wide registry of loaded inference models.
+
+Models are registered by name with a loader function and loaded lazily on
+first use. Loaded models are shared by all request threads of the process
+and evicted in least-recently-used order once the memory budget is exceeded.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def model_nbytes(model):
+    """Best-effort estimate of the memory held by a loaded model"""
+    parameters = getattr(model, 'parameters', None)
+    if callable(parameters):  # torch modules (whisper)
+        try:
+            return sum(p.numel() * p.element_size() for p in parameters())
+        except Exception:
+            pass
+    return 0
+
+
+def close_model(model):
+    """Release what a model holds besides memory, e.g. worker processes"""
+    close = getattr(model, 'close', None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            logging.warning(f"Closing model {type(model).__name__} failed: {e}")
+
+
+class ModelRegistry:
+    """Thread-safe LRU cache of models keyed by name and loader parameters"""
+
+    def __init__(self, memory_budget_mb=4096):
+        self.memory_budget = int(memory_budget_mb * 2**20)
+        self._loaders = {}
+        self._models = OrderedDict()  # key -> (model, nbytes)
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self._use_locks = {}
+        self._stats = {}
+
+    def register(self, name, loader, size_mb=None):
+        """Register a loader; `size_mb` overrides the measured model size"""
+        with self._lock:
+            self._loaders[name] = (loader, size_mb)
+            self._stats.setdefault(name, {
+                'hits': 0, 'misses': 0, 'loads': 0,
+                'evictions': 0, 'load_seconds': 0.0,
+            })
+
+    def get(self, name, **params):
+        """Return the model `name`, loading it on first use"""
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+        key = (name, tuple(sorted(params.items())))
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._stats[name]['hits'] += 1
+                return self._models[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available,
+        # but make concurrent requests for the same model wait for one load.
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self._stats[name]['hits'] += 1
+                    return self._models[key][0]
+                self._stats[name]['misses'] += 1
+
+            loader, size_mb = self._loaders[name]
+            logging.info(f"Loading model {name} {params or ''}")
+            start = time.perf_counter()
+            model = loader(**params)
+            elapsed = time.perf_counter() - start
+            nbytes = int(size_mb * 2**20) if size_mb is not None else model_nbytes(model)
+            logging.info(f"Loaded model {name} in {elapsed:.2f}s ({nbytes / 2**20:.0f} MB)")
+
+            with self._lock:
+                stats = self._stats[name]
+                stats['loads'] += 1
+                stats['load_seconds'] += elapsed
+                self._models[key] = (model, nbytes)
+                self._evict(keep=key)
+            return model
+
+    @contextmanager
+    def use(self, name, **params):
+        """Hold a model exclusively, for models that are not reentrant"""
+        model = self.get(name, **params)
+        key = (name, tuple(sorted(params.items())))
+        with self._lock:
+            use_lock = self._use_locks.setdefault(key, threading.Lock())
+        with use_lock:
+            yield model
+
+    def _evict(self, keep):
+        """Drop least recently used models until within the memory budget"""
+        while self.memory_usage() > self.memory_budget and len(self._models) > 1:
+            key = next(k for k in self._models if k != keep)
+            close_model(self._models.pop(key)[0])
+            self._stats[key[0]]['evictions'] += 1
+            logging.info(f"Evicted model {key[0]} {dict(key[1]) or ''}")
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._models.values())
+
+    def clear(self):
+        with self._lock:
+            for model, _ in self._models.values():
+                close_model(model)
+            self._models.clear()
+
+    def warm_up(self, names, background=False):
+        """Load the given models now, or in a daemon thread if `background`"""
+        names = [n for n in names if n]
+        if not names:
+            return None
+
+        def _warm_up():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    logging.error(f"Warm-up of model {name} failed: {e}")
+
+        if not background:
+            return _warm_up()
+        thread = threading.Thread(target=_warm_up, name='model-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Per-model hit/miss counters, load times and resident models"""
+        with self._lock:
+            loaded = {}
+            for (name, params), (_, nbytes) in self._models.items():
+                loaded.setdefault(name, []).append({
+                    'params': dict(params), 'mb': round(nbytes / 2**20, 1)})
+            return {
+                'memory_budget_mb': round(self.memory_budget / 2**20, 1),
+                'memory_usage_mb': round(self.memory_usage() / 2**20, 1),
+                'models': {
+                    name: {**stats, 'loaded': loaded.get(name, [])}
+                    for name, stats in self._stats.items()
+                },
+            }
@@ -0,0 +1,269 @@
+"""Lightweight note-event analysis without music21.
+
+Notes are kept as parallel NumPy arrays (onset and offset in seconds, MIDI
+pitch, amplitude) read straight from basic-pitch's note events or a MIDI
+file. Key, meter and the per-note JSON of /api/sheet are computed from these
+arrays, so music21 is only needed to write MusicXML.
+"""
+import numpy as np
+from utils.color_scale import NOTE_HEX
+from utils.music_scale import KEY_NAMES, SCALE_DEGREES, key_indices
+
+# Krumhansl-Kessler key profiles, starting on the tonic
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# Tonic spellings as music21 names them
+MAJOR_TONICS = ['C', 'D-', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+MINOR_TONICS = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+# Letter of each pitch class in music21's default spelling (C#, E-, F#, G#, B-)
+PITCH_STEPS = np.array(['C', 'C', 'D', 'E', 'E', 'F', 'F', 'G', 'G', 'A', 'B', 'B'])
+
+
+def _key_matrix():
+    """24 x 12 z-scored profiles: 12 major keys then 12 minor keys"""
+    profiles = np.array([np.roll(p, tonic) for p in (MAJOR_PROFILE, MINOR_PROFILE)
+                         for tonic in range(12)])
+    return (profiles - profiles.mean(axis=1, keepdims=True)) / profiles.std(axis=1, keepdims=True)
+
+KEY_PROFILES = _key_matrix()
+
+# Note values in quarter notes: plain and dotted, then triplets
+NOTE_VALUES = np.array([4, 3, 2, 1.5, 1, 0.75, 0.5, 0.375, 0.25])
+TRIPLET_VALUES = np.array([4, 2, 1]) / 3
+
+
+def note_arrays(note_events):
+    """Arrays of basic-pitch note events `(start, end, pitch, amplitude, bends)`"""
+    events = sorted(note_events, key=lambda e: (e[0], e[2]))
+    return {
+        'start': np.array([e[0] for e in events], dtype=np.float64),
+        'end': np.array([e[1] for e in events], dtype=np.float64),
+        'pitch': np.array([e[2] for e in events], dtype=np.int16),
+        'amplitude': np.array([e[3] for e in events], dtype=np.float32),
+    }
+
+
+def midi_note_arrays(midi_path):
+    """Note arrays of all instruments in a MIDI file"""
+    import pretty_midi
+    midi = pretty_midi.PrettyMIDI(str(midi_path))
+    return note_arrays([(n.start, n.end, n.pitch, n.velocity / 127, None)
+                        for instrument in midi.instruments for n in instrument.notes])
+
+
+def save_note_arrays(path, notes):
+    np.savez(path, **notes)
+
+
+def load_note_arrays(path):
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def pitch_class_histogram(pitch, weights):
+    return np.bincount(np.asarray(pitch) % 12, weights=weights, minlength=12)
+
+
+def estimate_key(notes):
+    """Krumhansl-Schmuckler key of the notes, weighted by duration
+
+    Returns (tonic, mode, correlation) with the tonic spelled as music21
+    does, e.g. ('B-', 'major', 0.83).
+    """
+    histogram = pitch_class_histogram(notes['pitch'], notes['end'] - notes['start'])
+    if not histogram.any():
+        return 'C', 'major', 0.0
+    histogram = (histogram - histogram.mean()) / (histogram.std() or 1)
+    correlations = KEY_PROFILES @ histogram / 12
+    best = int(correlations.argmax())
+    tonic, minor = best % 12, best >= 12
+    name = MINOR_TONICS[tonic] if minor else MAJOR_TONICS[tonic]
+    return name, 'minor' if minor else 'major', float(correlations[best])
+
+
+def key_name(tonic, mode):
+    """Key of `estimate_key` as the frontend names it, e.g. 'b' or 'gm'"""
+    minor = mode == 'minor'
+    tonics = MINOR_TONICS if minor else MAJOR_TONICS
+    return KEY_NAMES[12 * minor + tonics.index(tonic)]
+
+
+def estimate_meter(notes, tempo):
+    """Guess 3/4 or 4/4 from the accents of note onsets on the beat grid"""
+    beats = np.round(notes['start'] * tempo / 60).astype(np.int64)
+    if len(beats) == 0 or beats.max() < 12:
+        return 4, 4
+    strength = np.bincount(beats, weights=notes['amplitude'] * (notes['end'] - notes['start']))
+
+    def accent(beats_per_bar):
+        # Strongest phase of the bar relative to the average beat
+        bars = len(strength) // beats_per_bar
+        folded = strength[:bars * beats_per_bar].reshape(bars, beats_per_bar).mean(axis=0)
+        return folded.max() / (folded.mean() or 1)
+
+    # Prefer 4/4 unless a triple grouping is clearly more accented
+    return (3, 4) if accent(3) > 1.1 * accent(4) else (4, 4)
+
+
+def beat_positions(times, beat_times, tempo):
+    """Positions in beats of times in seconds, following a beat track
+
+    Tracked beats fall on whole numbers, counted from the start of the song
+    at `tempo`; times before the first or after the last tracked beat are
+    extrapolated at `tempo`. Without a beat track the grid is `tempo` alone.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    to_beats = tempo / 60
+    if beat_times is None or len(beat_times) < 2:
+        return times * to_beats
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    index = np.round(beat_times[0] * to_beats) + np.arange(len(beat_times))
+    positions = np.interp(times, beat_times, index)
+    before, after = times < beat_times[0], times > beat_times[-1]
+    positions[before] = index[0] + (times[before] - beat_times[0]) * to_beats
+    positions[after] = index[-1] + (times[after] - beat_times[-1]) * to_beats
+    return np.maximum(positions, 0)
+
+
+def quantize_notes(start, end, divisors=(4, 3)):
+    """Snap note onsets and durations, in beats, to note values on the grid
+
+    Each beat is divided by the one of `divisors` that fits the onsets in it
+    best, so straight and triplet rhythms do not mix within a beat. Each
+    duration is then the plain, dotted or triplet value that brings the end
+    of the note closest to its actual end, triplet values only in beats
+    divided in three; notes longer than a whole are rounded to beats.
+    Returns the quantized onsets and durations.
+    """
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    if not len(start):
+        return start.copy(), start.copy()
+
+    beat = np.floor(start)
+    fraction = start - beat
+    snapped = np.stack([np.round(fraction * d) / d for d in divisors])
+    error = np.abs(snapped - fraction)
+    which = (beat - beat.min()).astype(np.int64)
+    per_beat = np.stack([np.bincount(which, weights=e) for e in error])
+    best = per_beat.argmin(axis=0)[which]
+    onset = beat + snapped[best, np.arange(len(start))]
+
+    values = np.concatenate([NOTE_VALUES, TRIPLET_VALUES])
+    triplet = np.arange(len(values)) >= len(NOTE_VALUES)
+    on_triplet_grid = np.asarray(divisors)[best] % 3 == 0
+    target = end - onset
+    cost = np.abs(values - target[:, None])
+    cost[~on_triplet_grid[:, None] & triplet] = np.inf
+    duration = values[cost.argmin(axis=1)]
+    long = target > NOTE_VALUES[0] + 0.5
+    duration[long] = np.round(target[long])
+    return onset, duration
+
+
+def note_names(pitch):
+    """Two-character names (step and octave) as /api/sheet reports them"""
+    pitch = np.asarray(pitch)
+    return np.char.add(PITCH_STEPS[pitch % 12], (pitch // 12 - 1).astype(str))
+
+
+def score_notes(notes, tempo, key=None, beat_times=None):
+    """The per-note dicts of /api/sheet, in quarter notes from the start
+
+    Onsets and durations are quantized together on the grid of the song's
+    `beat_times` (seconds) if given, else of its tempo. With the song's
+    `key` (see `key_name`), or its key map (see `maps.key_map`), each note
+    also has its scale degree (1-7, 0 outside the scale) in the key it
+    starts in, and its color.
+    """
+    start, duration = quantize_notes(beat_positions(notes['start'], beat_times, tempo),
+                                     beat_positions(notes['end'], beat_times, tempo))
+    columns = {'noteName': note_names(notes['pitch']), 'start': start, 'duration': duration}
+    if key is not None:
+        pitch_class = notes['pitch'] % 12
+        columns['degree'] = SCALE_DEGREES[key_indices(key, notes['start']), pitch_class]
+        columns['color'] = NOTE_HEX[pitch_class]
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(c.tolist() for c in columns.values()))]
+
+
+def note_columns(notes, tempo, key=None, beat_times=None):
+    """The notes of `score_notes` as typed columns for binary responses
+
+    Pitches are the MIDI numbers of the note arrays, as the two-character
+    names of `score_notes` do not tell sharps from naturals.
+    """
+    start, duration = quantize_notes(beat_positions(notes['start'], beat_times, tempo),
+                                     beat_positions(notes['end'], beat_times, tempo))
+    pitch = np.asarray(notes['pitch'])
+    degree = (SCALE_DEGREES[key_indices(key, notes['start']), pitch % 12] if key is not None
+              else np.zeros(len(pitch)))
+    return {
+        'notes_start': start.astype(np.float32),
+        'notes_duration': duration.astype(np.float32),
+        'notes_midi': pitch.astype(np.int16),
+        'notes_degree': degree.astype(np.int8),
+    }
+
+
+def map_offsets(spans, beat_times, tempo, beats_per_bar):
+    """Offsets in quarter notes of the spans of a map, moved to the nearest bar
+
+    Spans after the first are dropped where they land on the same bar as
+    the one before; the first always starts the score.
+    """
+    starts = beat_positions([span['start'] for span in spans], beat_times, tempo)
+    bars = np.round(starts / beats_per_bar) * beats_per_bar
+    bars[0] = 0
+    keep = np.r_[True, np.diff(bars) > 0]
+    return [(float(offset), span) for offset, span, k in zip(bars, spans, keep) if k]
+
+
+def notes_to_score(notes, tempo, tonic='C', mode='major', time_signature=(4, 4),
+                   beat_times=None, key_map=None, tempo_map=None):
+    """music21 score of note arrays, quantized as `score_notes`
+
+    Built as music21 imports MIDI (notes with the same onset and duration
+    as chords, voices only where notes start together but end apart), but
+    from notes already on the grid, so its own quantization is skipped.
+    With a `key_map` or `tempo_map` (see `maps`), key signatures and
+    metronome marks change at the bar nearest each span's start.
+    """
+    import music21
+    start, duration = quantize_notes(beat_positions(notes['start'], beat_times, tempo),
+                                     beat_positions(notes['end'], beat_times, tempo))
+    order = np.lexsort((notes['pitch'], duration, start))
+    start, duration, pitch = start[order], duration[order], notes['pitch'][order]
+    first = np.flatnonzero(np.r_[True, (np.diff(start) != 0) | (np.diff(duration) != 0)])
+
+    part = music21.stream.Part()
+    for offset, length, pitches in zip(start[first].tolist(), duration[first].tolist(),
+                                       np.split(pitch, first[1:])):
+        if len(pitches) == 1:
+            element = music21.note.Note(int(pitches[0]), quarterLength=length)
+        else:
+            element = music21.chord.Chord(pitches.tolist(), quarterLength=length)
+        part.coreInsert(offset, element)
+    part.coreElementsChanged()
+    part.insert(0, music21.meter.TimeSignature('{}/{}'.format(*time_signature)))
+    beats_per_bar = time_signature[0] * 4 / time_signature[1]
+    if key_map:
+        for offset, span in map_offsets(key_map, beat_times, tempo, beats_per_bar):
+            part.insert(offset, music21.key.Key(span['tonic'], span['mode']))
+    else:
+        part.insert(0, music21.key.Key(tonic, mode))
+    if tempo_map:
+        for offset, span in map_offsets(tempo_map, beat_times, tempo, beats_per_bar):
+            part.insert(offset, music21.tempo.MetronomeMark(number=round(span['tempo'], 2)))
+    else:
+        part.insert(0, music21.tempo.MetronomeMark(number=round(tempo, 2)))
+
+    part.makeMeasures(inPlace=True)
+    if (np.diff(start[first]) == 0).any():
+        for measure in part.getElementsByClass(music21.stream.Measure):
+            measure.makeVoices(inPlace=True, fillGaps=False)
+    part.makeTies(inPlace=True)
+    part.makeRests(inPlace=True, fillGaps=True, timeRangeFromBarDuration=True)
+    return music21.stream.Score([part])
@@ -0,0 +1,249 @@
+"""Scoring of a sung take against the vocals of a reference song.
+
+The pitch contours of the take and of the reference are aligned with
+dynamic time warping restricted to a band around the diagonal, so that
+time and memory grow with the length of the song times the band's width
+instead of with its square. Each note of the reference then reads the
+take's frames aligned to it: how far their pitch is from the note, and
+how early or late the take reaches it.
+
+Pitches are compared within an octave, so that a take sung an octave
+below or above the reference scores as well as one in its register.
+"""
+import numpy as np
+from pitch import hz_to_midi
+
+# Frames of either contour further than this from the diagonal, in
+# seconds, are never aligned
+BAND_SECONDS = 8.0
+# Contour frames per frame of the alignment; the errors of each note are
+# still read from every frame of the take
+ALIGN_STEP = 2
+# Frames quieter than this fraction of the loudest are unvoiced
+MIN_CONFIDENCE = 0.05
+# Pitch distance, in semitones, from which aligning two voiced frames
+# costs 1, and the cost of aligning a voiced frame with an unvoiced one:
+# less, so that a note the take leaves out is aligned with its silence
+# rather than with the neighbouring notes
+MAX_SEMITONES = 3.0
+VOICING_COST = 0.5
+# Fraction of the take's frames aligned to a note that must be voiced for
+# the note to count as sung
+MIN_VOICED = 0.5
+# Distance, in semitones, within which the reference's contour must follow
+# a note for it to be part of the melody
+MELODY_SEMITONES = 0.5
+
+# Errors at which a note's pitch score (cents) and timing score (seconds)
+# fall to zero, and the weight of pitch in the overall score
+PITCH_TOLERANCE = 100.0
+TIMING_TOLERANCE = 0.25
+PITCH_WEIGHT = 0.6
+
+
+def contour_pitch(contour, min_confidence=MIN_CONFIDENCE):
+    """Fractional MIDI pitch of each frame of a contour, NaN where unvoiced"""
+    voiced = contour['voiced'] & (contour['confidence'] >= min_confidence)
+    return np.where(voiced, hz_to_midi(contour['hz']), np.nan).astype(np.float32)
+
+
+def octave_difference(a, b):
+    """Semitones from `b` up to `a`, within half an octave either way"""
+    d = a - b
+    return d - 12 * np.round(d / 12)
+
+
+def decimate(pitch, step=ALIGN_STEP):
+    """Every `step`-th frame of a pitch sequence, or the next voiced one"""
+    frames = pitch[:len(pitch) // step * step].reshape(-1, step)
+    first = np.argmax(~np.isnan(frames), axis=1)
+    return frames[np.arange(len(frames)), first]
+
+
+def band_starts(n, m, width):
+    """First column of the band of each of `n` rows, around the diagonal to (n, m)"""
+    centre = np.round(np.arange(n) * (m - 1) / max(n - 1, 1)).astype(np.int64)
+    return np.clip(centre - width, 0, max(m - 2 * width - 1, 0))
+
+
+def frame_costs(x, y, starts, width):
+    """Cost of aligning each frame of `x` with the frames of `y` in its band"""
+    columns = starts[:, None] + np.arange(2 * width + 1)
+    b = y[np.minimum(columns, len(y) - 1)]
+    cost = np.minimum(np.abs(octave_difference(x[:, None], b)), MAX_SEMITONES) / MAX_SEMITONES
+    # NaN where either frame is unvoiced: free if both are
+    unvoiced = np.isnan(cost)
+    cost[unvoiced] = VOICING_COST * (np.isnan(x)[:, None] ^ np.isnan(b))[unvoiced]
+    cost[columns >= len(y)] = np.inf
+    return cost
+
+
+def banded_dtw(x, y, width):
+    """Warping path between pitch sequences `x` and `y` within `width` frames
+
+    Returns the `(i, j)` frames of the path, from the first frames of both
+    to their last. Only the cells of the band are kept, with the step that
+    reached each of them, and each row is filled at once: moving along a
+    row accumulates its costs, so the best way into each cell is a running
+    minimum over the row.
+    """
+    n, m = len(x), len(y)
+    width = min(width, m)
+    starts = band_starts(n, m, width)
+    costs = frame_costs(x, y, starts, width)
+    band = costs.shape[1]
+    steps = np.zeros((n, band), dtype=np.int8)  # 0 diagonal, 1 from above, 2 from the left
+
+    # The previous row at [1, band + 1), infinite around it: the cells above
+    # and above-left of each cell are then slices, whatever the band moved
+    shifts = np.diff(starts, prepend=starts[0])
+    previous = np.full(band + shifts.max() + 2, np.inf)
+    previous[0] = 0.0  # Diagonal of the first cell, before both sequences start
+    finite = np.isfinite(costs)
+    totals = np.cumsum(np.where(finite, costs, 0), axis=1)
+    for i in range(n):
+        shift, cost, total = shifts[i], costs[i], totals[i]
+        diagonal = previous[shift:shift + band]
+        above = previous[shift + 1:shift + band + 1]
+        into = np.minimum(diagonal, above) + cost
+        step = (diagonal > above).astype(np.int8)
+
+        # Along the row: D[j] = min(into[j], D[j - 1] + cost[j])
+        with np.errstate(invalid='ignore'):
+            best = np.minimum.accumulate(into - total) + total
+        left = best < into
+        steps[i] = np.where(left, 2, step)
+        previous[1:band + 1] = np.where(finite[i], np.minimum(best, into), np.inf)
+        previous[0] = previous[band + 1] = np.inf
+
+    # Back from the last cell of both sequences
+    path = []
+    i, j = n - 1, m - 1
+    while i >= 0 and j >= 0:
+        path.append((i, j))
+        step = steps[i, j - starts[i]]
+        if step == 0:
+            i, j = i - 1, j - 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    path.reverse()
+    return np.array(path, dtype=np.int64).reshape(-1, 2)
+
+
+def note_spans(notes, fps, step=1):
+    """First and last frames, rounded to `step`, of each note"""
+    first = (np.floor(notes['start'] * fps / step) * step).astype(np.int64)
+    last = np.maximum(np.ceil(notes['end'] * fps).astype(np.int64), first + 1)
+    return first, last
+
+
+def melody_notes(notes, reference_pitch, fps):
+    """The notes that the reference's contour follows
+
+    Transcriptions of a voice also have notes on its harmonics, which a
+    take is not expected to sing.
+    """
+    first, last = note_spans(notes, fps)
+    keep = np.zeros(len(first), dtype=bool)
+    for k, (lo, hi) in enumerate(zip(first, last)):
+        heard = reference_pitch[lo:hi]
+        heard = heard[~np.isnan(heard)]
+        keep[k] = len(heard) and abs(np.median(octave_difference(heard, notes['pitch'][k]))
+                                     ) <= MELODY_SEMITONES
+    return {k: v[keep] for k, v in notes.items()}
+
+
+def note_errors(notes, path, take_pitch, fps, step=ALIGN_STEP):
+    """Pitch error (cents) and onset time in the take (seconds) of each note
+
+    `path` is in frames of `step` contour frames. A note's frames in the
+    take are those aligned to its frames in the reference; its pitch error
+    is the median, within an octave, over the voiced ones, NaN unless at
+    least `MIN_VOICED` of them are. Its onset is the last take frame aligned
+    to its first frame: the take frames before are those the take waited on.
+    """
+    ref_frames, take_frames = path[:, 0] * step, path[:, 1] * step
+    start, end = note_spans(notes, fps, step)
+    first = np.clip(np.searchsorted(ref_frames, start, side='right') - 1, 0, len(path) - 1)
+    last = np.maximum(np.searchsorted(ref_frames, end, side='left'), first + 1)
+    onsets = take_frames[first] / fps
+
+    errors = np.full(len(first), np.nan)
+    for k, (lo, hi) in enumerate(zip(take_frames[first], take_frames[last - 1] + step)):
+        sung = take_pitch[lo:hi]
+        sung = sung[~np.isnan(sung)]
+        if len(sung) and len(sung) >= MIN_VOICED * (hi - lo):
+            errors[k] = 100 * np.median(octave_difference(sung, notes['pitch'][k]))
+    return errors, onsets
+
+
+def fit_lags(times, lags):
+    """Slope and intercept of the lags of a take's notes against their times
+
+    Fitted twice, the second time without the notes further than
+    `TIMING_TOLERANCE` from the first line, which the alignment most
+    likely got wrong.
+    """
+    if len(times) < 2 or np.ptp(times) == 0:
+        return 0.0, float(np.median(lags)) if len(lags) else 0.0
+    drift, offset = np.polyfit(times, lags, 1)
+    close = np.abs(lags - (offset + drift * times)) <= TIMING_TOLERANCE
+    if close.sum() >= 2 and np.ptp(times[close]) > 0:
+        drift, offset = np.polyfit(times[close], lags[close], 1)
+    return float(drift), float(offset)
+
+
+def score_performance(take_contour, reference_contour, notes, fps, band_seconds=BAND_SECONDS):
+    """Per-note pitch and timing errors of a take, and its overall score
+
+    `notes` are the reference's vocal notes (see `notes.note_arrays`), of
+    which only the melody is scored (see `melody_notes`).
+
+    The lag of the take's notes behind the reference's is fitted with a
+    line: the `offset` of the take's start and its `tempo_ratio` to the
+    reference. Timing errors are the lags left, so that starting the
+    recording late or singing steadily slower does not count against
+    every note, but rushing or dragging single notes does.
+
+    The score is 0-100: each note scores its pitch and timing, linearly
+    down to zero at `PITCH_TOLERANCE` cents and `TIMING_TOLERANCE`
+    seconds, and notes the take does not sing score 0.
+    """
+    take, reference = contour_pitch(take_contour), contour_pitch(reference_contour)
+    notes = melody_notes(notes, reference, fps)
+    if not len(take) or not len(reference) or not len(notes['start']):
+        return {'score': 0.0, 'offset': 0.0, 'tempo_ratio': 1.0, 'pitch_accuracy': 0.0,
+                'timing_accuracy': 0.0, 'notes': []}
+    path = banded_dtw(decimate(reference), decimate(take), int(band_seconds * fps / ALIGN_STEP))
+    errors, onsets = note_errors(notes, path, take, fps)
+
+    lags = onsets - notes['start']
+    sung = ~np.isnan(errors)
+    drift, offset = fit_lags(notes['start'][sung], lags[sung])
+    timing = lags - (offset + drift * notes['start'])
+    pitch_errors = np.abs(np.nan_to_num(errors))
+    pitch_score = np.where(sung, np.maximum(0, 1 - pitch_errors / PITCH_TOLERANCE), 0)
+    timing_score = np.where(sung, np.maximum(0, 1 - np.abs(timing) / TIMING_TOLERANCE), 0)
+    score = PITCH_WEIGHT * pitch_score + (1 - PITCH_WEIGHT) * timing_score
+
+    return {
+        'score': round(100 * float(score.mean()), 1),
+        'offset': round(offset, 3),
+        'tempo_ratio': round(1 + drift, 4),
+        # Sung notes within half the tolerances
+        'pitch_accuracy': round(float(np.mean(sung & (np.abs(np.nan_to_num(errors))
+                                                      <= PITCH_TOLERANCE / 2))), 3),
+        'timing_accuracy': round(float(np.mean(sung & (np.abs(timing)
+                                                       <= TIMING_TOLERANCE / 2))), 3),
+        'notes': [{
+            'start': round(float(s), 3),
+            'end': round(float(e), 3),
+            'pitch': int(p),
+            'sung': bool(v),
+            'pitch_error': round(float(c), 1) if v else None,
+            'timing_error': round(float(t), 3) if v else None,
+        } for s, e, p, v, c, t in zip(notes['start'], notes['end'], notes['pitch'], sung,
+                                      errors, timing)],
+    }
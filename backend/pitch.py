@@ -0,0 +1,188 @@
+"""Vectorized pitch contour extraction.
+
+The contour is computed for all frames at once from `librosa.piptrack`
+output and returned as compact typed arrays instead of per-frame Python
+objects. Note names are looked up from a precomputed table.
+
+Long recordings can be analyzed block by block with `stream_analysis`,
+which keeps memory bounded regardless of duration.
+"""
+import numpy as np
+import librosa
+import soundfile as sf
+
+# Note name of every MIDI number, as returned by librosa.hz_to_note
+NOTE_NAMES = np.array(librosa.midi_to_note(np.arange(128)))
+
+
+def hz_to_midi(hz):
+    """Fractional MIDI numbers of frequencies; NaN where hz <= 0"""
+    hz = np.asarray(hz, dtype=np.float32)
+    midi = np.full(hz.shape, np.nan, dtype=np.float32)
+    voiced = hz > 0
+    midi[voiced] = 69 + 12 * np.log2(hz[voiced] / 440.0)
+    return midi
+
+
+def midi_to_note_names(midi):
+    """Note names of integer MIDI numbers"""
+    return NOTE_NAMES[np.clip(midi, 0, 127)]
+
+
+def pitch_contour(pitches, magnitudes, sr, hop_length=512, min_confidence=0.0):
+    """Predominant pitch of each frame of a piptrack result
+
+    Returns a dict of arrays, one value per frame:
+        times: frame times in seconds (float32)
+        hz: frequency of the strongest bin, 0 if unvoiced (float32)
+        midi: nearest MIDI number, -1 if unvoiced (int16)
+        cents: deviation from the nearest MIDI note (int16)
+        confidence: magnitude relative to the loudest frame (float32)
+        voiced: whether the frame has a pitch (bool)
+    """
+    frames = np.arange(pitches.shape[1])
+    index = magnitudes.argmax(axis=0)
+    hz = pitches[index, frames].astype(np.float32)
+    magnitude = magnitudes[index, frames].astype(np.float32)
+
+    peak = magnitude.max() if magnitude.size else 0
+    confidence = magnitude / peak if peak > 0 else np.zeros_like(magnitude)
+    voiced = (hz > 0) & (confidence >= min_confidence)
+    hz[~voiced] = 0
+
+    midi_float = hz_to_midi(hz)
+    midi = np.where(voiced, np.round(np.nan_to_num(midi_float)), -1).astype(np.int16)
+    cents = np.where(voiced, np.round(100 * (np.nan_to_num(midi_float) - midi)), 0).astype(np.int16)
+
+    return {
+        'times': librosa.frames_to_time(frames, sr=sr, hop_length=hop_length).astype(np.float32),
+        'hz': hz,
+        'midi': midi,
+        'cents': cents,
+        'confidence': confidence,
+        'voiced': voiced,
+    }
+
+
+def analyze_contour(y, sr, hop_length=512, min_confidence=0.0):
+    """Pitch contour of a waveform"""
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr, hop_length=hop_length)
+    return pitch_contour(pitches, magnitudes, sr, hop_length, min_confidence)
+
+
+class OnsetTracker:
+    """Incremental onset detection and tempo estimation
+
+    Mirrors `librosa.onset.onset_detect` and `librosa.feature.tempo`, but
+    consumes the onset envelope block by block and only keeps the last
+    `tempo_window` seconds of it.
+    """
+
+    def __init__(self, sr, hop_length=512, tempo_window=8.0):
+        self.sr = sr
+        self.hop_length = hop_length
+        fps = sr / hop_length
+        self.pre_max = int(0.03 * fps)
+        self.post_max = int(0.00 * fps) + 1
+        self.pre_avg = int(0.10 * fps)
+        self.post_avg = int(0.10 * fps) + 1
+        self.wait = int(0.03 * fps)
+        self.window = int(tempo_window * fps)
+        self.envelope = np.zeros(0, dtype=np.float32)
+        self.start = 0  # Frame index of envelope[0]
+        self.peak = 0.0
+        self.emitted = -1  # Last frame emitted as an onset
+
+    def update(self, envelope, final=False):
+        """Add envelope frames; return (onset frames, local tempo in bpm)"""
+        self.envelope = np.concatenate([self.envelope, envelope])
+        self.peak = max(self.peak, float(envelope.max(initial=0)))
+        end = self.start + len(self.envelope)
+
+        onsets = []
+        if self.peak > 0 and len(self.envelope) > self.pre_avg + self.post_avg:
+            peaks = librosa.util.peak_pick(
+                self.envelope / self.peak, pre_max=self.pre_max, post_max=self.post_max,
+                pre_avg=self.pre_avg, post_avg=self.post_avg, delta=0.07, wait=self.wait)
+            # Peaks near the end may still be beaten by frames not seen yet
+            limit = end if final else end - self.post_avg - self.post_max
+            onsets = [self.start + p for p in peaks
+                      if self.emitted < self.start + p < limit
+                      and self.start + p > self.emitted + self.wait]
+            if onsets:
+                self.emitted = onsets[-1]
+
+        tempo = None
+        if len(self.envelope) >= self.window // 2:
+            tempo = float(librosa.feature.tempo(
+                onset_envelope=self.envelope[-self.window:], sr=self.sr,
+                hop_length=self.hop_length)[0])
+
+        # Keep enough context for peak picking and the tempo window
+        keep = max(self.window, self.pre_avg + self.post_avg + self.pre_max)
+        if len(self.envelope) > keep:
+            self.start += len(self.envelope) - keep
+            self.envelope = self.envelope[-keep:]
+        return np.asarray(onsets, dtype=np.int64), tempo
+
+
+def stream_analysis(path, block_frames=512, frame_length=2048, hop_length=512,
+                    min_confidence=0.0):
+    """Analyze an audio file block by block without loading it whole
+
+    Yields one dict per block with the pitch contour arrays of
+    `pitch_contour` for its frames (confidence is relative to the block),
+    the `onsets` (seconds) detected so far and a local `tempo` estimate
+    (bpm) over the last few seconds. The final dict also has the global
+    `song_tempo`, the median of the local estimates.
+    """
+    sr = librosa.get_samplerate(str(path))
+    n_samples = sf.info(str(path)).frames
+    blocks = librosa.stream(str(path), block_length=block_frames,
+                            frame_length=frame_length, hop_length=hop_length,
+                            fill_value=0)
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=frame_length)
+    tracker = OnsetTracker(sr, hop_length)
+    previous_mel = None
+    tempo_votes = []
+    frame_offset = 0
+
+    for block in blocks:
+        S = np.abs(librosa.stft(block, n_fft=frame_length, hop_length=hop_length,
+                                center=False))
+        pitches, magnitudes = librosa.piptrack(S=S, sr=sr, n_fft=frame_length,
+                                               hop_length=hop_length)
+        result = pitch_contour(pitches, magnitudes, sr, hop_length, min_confidence)
+
+        # Frames are not centered, so each covers [t * hop, t * hop + n_fft)
+        frames = frame_offset + np.arange(S.shape[1])
+        result['times'] = ((frames * hop_length + frame_length // 2) / sr).astype(np.float32)
+
+        # The last block is padded with silence past the end of the file
+        inside = frames * hop_length + frame_length // 2 <= n_samples
+        if not inside.all():
+            result = {k: v[inside] for k, v in result.items()}
+
+        # Onset strength as in librosa.onset.onset_strength, carrying the
+        # last mel frame over so the first difference spans the boundary
+        mel = librosa.power_to_db(mel_basis @ S**2)
+        if previous_mel is None:
+            previous_mel = mel[:, :1]
+        envelope = np.maximum(0, np.diff(np.hstack([previous_mel, mel]), axis=1)).mean(axis=0)
+        previous_mel = mel[:, -1:]
+
+        onsets, tempo = tracker.update(envelope.astype(np.float32))
+        if tempo is not None:
+            tempo_votes.append(tempo)
+        result['onsets'] = (onsets * hop_length + frame_length // 2) / sr
+        result['tempo'] = tempo
+        frame_offset += S.shape[1]
+        yield result
+
+    # Flush onsets held back at the end of the last block
+    onsets, _ = tracker.update(np.zeros(0, dtype=np.float32), final=True)
+    yield {
+        'onsets': (onsets * hop_length + frame_length // 2) / sr,
+        'tempo': None,
+        'song_tempo': float(np.median(tempo_votes)) if tempo_votes else None,
+    }
@@ -0,0 +1,168 @@
+"""Resumable chunked uploads.
+
+A tus-like protocol for large recordings:
+
+    POST  /api/uploads              {"filename": ..., "length": n} -> upload id
+    PATCH /api/uploads/<id>         Upload-Offset: k, body = bytes k.. of the file
+    HEAD  /api/uploads/<id>         Upload-Offset of the bytes received so far
+    POST  /api/uploads/<id>/finalize
+
+Chunks are appended to a partial file in the upload directory as they
+arrive, never buffered whole, and the SHA-256 of the content is updated
+with each chunk. After a dropped connection the client asks for the offset
+and continues from there. The hasher lives in memory; if the process was
+restarted in between, the bytes already on disk are hashed again once.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 20
+
+
+class UploadNotFound(KeyError):
+    pass
+
+
+class OffsetMismatch(ValueError):
+    def __init__(self, expected):
+        super().__init__(f"Upload is at offset {expected}")
+        self.expected = expected
+
+
+class IncompleteUpload(ValueError):
+    pass
+
+
+def copy_hashing(stream, out, digest, limit=None, chunk_size=CHUNK_SIZE):
+    """Copy a stream to a file while updating `digest`; return bytes copied"""
+    copied = 0
+    while limit is None or copied < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - copied)
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        out.write(chunk)
+        digest.update(chunk)
+        copied += len(chunk)
+    return copied
+
+
+class UploadStore:
+    """Partial uploads in `root/.partial`, published into `root` when complete"""
+
+    def __init__(self, root, max_age_hours=24):
+        self.root = Path(root)
+        self.partial = self.root / '.partial'
+        self.partial.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age_hours * 3600
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+        self._hashers = {}  # upload id -> (offset, sha256 of the bytes before it)
+
+    def _paths(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadNotFound(upload_id)
+        return self.partial / f'{upload_id}.part', self.partial / f'{upload_id}.json'
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+
+    def create(self, filename, length):
+        """Start an upload of `length` bytes to be saved as `filename`"""
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._paths(upload_id)
+        data_path.touch()
+        with open(meta_path, 'w') as f:
+            json.dump({'filename': filename, 'length': int(length),
+                       'created': time.time()}, f)
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return upload_id
+
+    def status(self, upload_id):
+        """Filename, length and current offset of an upload"""
+        data_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        meta['offset'] = data_path.stat().st_size
+        return meta
+
+    def _hasher(self, upload_id, data_path, offset):
+        """SHA-256 of the first `offset` bytes, rehashed from disk if needed"""
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(data_path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        logging.info(f"Rehashed {offset} bytes of upload {upload_id}")
+        return digest
+
+    def append(self, upload_id, offset, stream):
+        """Append the body of a PATCH at `offset`; return the new offset
+
+        Raises OffsetMismatch unless `offset` is where the upload stands,
+        so chunks are neither lost nor written twice after a retry.
+        """
+        with self._upload_lock(upload_id):
+            meta = self.status(upload_id)
+            if offset != meta['offset']:
+                raise OffsetMismatch(meta['offset'])
+            data_path, _ = self._paths(upload_id)
+            digest = self._hasher(upload_id, data_path, offset)
+            try:
+                with open(data_path, 'ab') as out:
+                    while offset < meta['length']:
+                        chunk = stream.read(min(CHUNK_SIZE, meta['length'] - offset))
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+            finally:
+                # Keep the hash of what was written even if the connection
+                # dropped mid-request; a mismatch with the file size later
+                # just means rehashing from disk
+                self._hashers[upload_id] = (offset, digest)
+            return offset
+
+    def finalize(self, upload_id, destination):
+        """Move a complete upload to `destination`; return its SHA-256"""
+        with self._upload_lock(upload_id):
+            meta = self.status(upload_id)
+            if meta['offset'] != meta['length']:
+                raise IncompleteUpload(
+                    f"Received {meta['offset']} of {meta['length']} bytes")
+            data_path, meta_path = self._paths(upload_id)
+            content_hash = self._hasher(upload_id, data_path, meta['offset']).hexdigest()
+            os.replace(data_path, destination)
+            meta_path.unlink()
+            self._hashers.pop(upload_id, None)
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+        return content_hash
+
+    def expire(self):
+        """Remove partial uploads that received no data for `max_age` seconds"""
+        cutoff = time.time() - self.max_age
+        for meta_path in self.partial.glob('*.json'):
+            data_path = meta_path.with_suffix('.part')
+            try:
+                if data_path.stat().st_mtime < cutoff:
+                    data_path.unlink()
+                    meta_path.unlink()
+                    self._hashers.pop(meta_path.stem, None)
+                    logging.info(f"Expired upload {meta_path.stem}")
+            except FileNotFoundError:
+                pass
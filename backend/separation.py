@@ -0,0 +1,328 @@
+"""Chunked MDX-Net source separation with overlap-add.
+
+Mirrors the MDX architecture of audio-separator (STFT of each segment, ONNX
+model on the spectrogram, inverse STFT, windowed overlap-add of overlapping
+segments) but streams the song through it:
+
+- segments are read from the file as they are needed, and output is written
+  as soon as no later segment overlaps it, so memory is bounded by a few
+  segments whatever the length of the song;
+- batches of segments run on a thread pool (ONNX Runtime releases the GIL),
+  with configurable intra-op and inter-op threads per inference;
+- the second "match mix" pass of audio-separator, whose result is unused
+  unless stems are inverted in the spectrogram, is skipped.
+
+As in audio-separator, the mix is peak-normalized, the vocal stem is the
+mix minus the instrumental, and each stem is peak-normalized when written.
+Files soundfile cannot read, or at another sample rate than the model's,
+are first decoded and resampled a block at a time into a temporary file,
+with the resampler librosa uses.
+"""
+import logging
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 44100
+
+# Peak bounds audio-separator normalizes the mix and the stems to
+MAX_PEAK = 0.9
+MIN_PEAK = 0.6
+
+# Parameters of the MDX-Net models we run, from audio-separator's model data
+MDX_MODELS = {
+    'UVR-MDX-NET-Inst_HQ_3.onnx': {'n_fft': 6144, 'dim_f': 3072, 'dim_t': 256, 'compensate': 1.022},
+}
+
+# Output subtype of lossless formats; compressed formats use their default
+PCM_FORMATS = {'WAV', 'FLAC', 'AIFF'}
+
+
+def normalize_gain(peak, max_peak=MAX_PEAK, min_peak=MIN_PEAK):
+    """Gain that brings a signal's peak within [min_peak, max_peak]"""
+    if peak > max_peak:
+        return max_peak / peak
+    if 0 < peak < min_peak:
+        return min_peak / peak
+    return 1.0
+
+
+def can_write(suffix):
+    """Whether soundfile can write stems in the format of this extension"""
+    return suffix.strip('.').upper() in sf.available_formats()
+
+
+def hann_window(n):
+    """Periodic Hann window, as torch.hann_window"""
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n) / n)).astype(np.float32)
+
+
+def stft(x, n_fft, hop_length, window):
+    """STFT of (..., samples) as torch.stft(center=True): (..., bins, frames)"""
+    pad = n_fft // 2
+    x = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad, pad)], mode='reflect')
+    frames = np.lib.stride_tricks.sliding_window_view(x, n_fft, axis=-1)[..., ::hop_length, :]
+    return np.fft.rfft(frames * window, axis=-1).swapaxes(-1, -2)
+
+
+def istft(spec, n_fft, hop_length, window, length):
+    """Inverse of `stft`, as torch.istft(center=True)"""
+    frames = np.fft.irfft(spec.swapaxes(-1, -2), n=n_fft, axis=-1).astype(np.float32) * window
+    n_frames = frames.shape[-2]
+    total = n_fft + hop_length * (n_frames - 1)
+    out = np.zeros(frames.shape[:-2] + (total,), dtype=np.float32)
+    envelope = np.zeros(total, dtype=np.float32)
+    for i in range(n_frames):
+        out[..., i * hop_length:i * hop_length + n_fft] += frames[..., i, :]
+        envelope[i * hop_length:i * hop_length + n_fft] += window ** 2
+    pad = n_fft // 2
+    envelope = np.where(envelope > 1e-11, envelope, 1)
+    return (out / envelope)[..., pad:pad + length]
+
+
+def audio_blocks(path, block_size=1 << 18):
+    """Sample rate, channels and (samples, channels) float32 blocks of a file
+
+    Files soundfile cannot read are decoded with audioread, as librosa does.
+    """
+    try:
+        file = sf.SoundFile(str(path))
+    except (RuntimeError, sf.LibsndfileError):
+        import audioread
+        from librosa.util import buf_to_float
+        decoder = audioread.audio_open(str(path))
+
+        def decoded():
+            with decoder:
+                for buf in decoder:
+                    yield buf_to_float(buf, dtype=np.float32).reshape(-1, decoder.channels)
+        return decoder.samplerate, decoder.channels, decoded()
+
+    def read():
+        with file:
+            yield from file.blocks(blocksize=block_size, dtype='float32', always_2d=True)
+    return file.samplerate, file.channels, read()
+
+
+def resample_to_file(path, out_path, sr, block_size=1 << 18):
+    """Write an audio file at `sr` as float RF64, a block at a time
+
+    Resampled with soxr as `librosa.load` would, to as many samples.
+    """
+    import soxr
+    in_sr, channels, blocks = audio_blocks(path, block_size)
+    stream = soxr.ResampleStream(in_sr, sr, channels, dtype='float32', quality='soxr_hq')
+    read = written = 0
+    with sf.SoundFile(str(out_path), 'w', samplerate=sr, channels=channels,
+                      format='RF64', subtype='FLOAT') as out:
+        for block in blocks:
+            read += len(block)
+            if in_sr != sr:
+                block = stream.resample_chunk(block)
+            out.write(block)
+            written += len(block)
+        if in_sr != sr:
+            block = stream.resample_chunk(np.zeros((0, channels), np.float32), last=True)
+            out.write(block)
+            written += len(block)
+            out.write(np.zeros((max(int(np.ceil(read * sr / in_sr)) - written, 0), channels),
+                               np.float32))
+
+
+class MixReader:
+    """Normalized stereo mix at the model's rate, read a range at a time
+
+    Indices are those of the padded mixture: `lead` zeros, the song, then
+    zeros up to any length.
+    """
+
+    def __init__(self, path, lead, sr=SAMPLE_RATE, block_size=1 << 18):
+        self.lead = lead
+        self.resampled = None
+        self.file = self._open(path, sr)
+        if self.file is None:
+            # Compressed formats soundfile lacks, or another sample rate
+            fd, self.resampled = tempfile.mkstemp(prefix='.mix-', suffix='.raw.wav')
+            os.close(fd)
+            try:
+                resample_to_file(path, self.resampled, sr, block_size)
+                self.file = sf.SoundFile(self.resampled)
+            except Exception:
+                self.close()
+                raise
+        self.length = self.file.frames
+        peak = max((np.abs(b).max(initial=0) for b in
+                    self.file.blocks(blocksize=block_size, always_2d=True)), default=0)
+        if not peak:
+            self.close()
+            raise ValueError(f"Audio file {path} is empty or not valid")
+        self.gain = normalize_gain(float(peak))
+
+    @staticmethod
+    def _open(path, sr):
+        """The file opened with soundfile if it can be read as is, else None"""
+        try:
+            file = sf.SoundFile(str(path))
+        except (RuntimeError, sf.LibsndfileError):
+            return None
+        if file.samplerate != sr:
+            file.close()
+            return None
+        return file
+
+    @staticmethod
+    def _stereo(audio):
+        """(channels, samples) as two channels: mono is duplicated"""
+        return np.repeat(audio, 2, axis=0) if audio.shape[0] == 1 else audio[:2]
+
+    def read(self, start, stop):
+        out = np.zeros((2, stop - start), dtype=np.float32)
+        lo, hi = max(start - self.lead, 0), min(stop - self.lead, self.length)
+        if hi > lo:
+            self.file.seek(lo)
+            part = self._stereo(self.file.read(hi - lo, dtype='float32', always_2d=True).T)
+            out[:, lo + self.lead - start:hi + self.lead - start] = part * self.gain
+        return out
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.resampled is not None:
+            os.unlink(self.resampled)
+            self.resampled = None
+
+
+class ChunkedSeparator:
+    """Separate songs into instrumental and vocal stems with an MDX-Net model"""
+
+    def __init__(self, model_path, n_fft, dim_f, dim_t, compensate=1.0, hop_length=1024,
+                 overlap=0.25, batch_size=1, workers=None, intra_op_threads=None,
+                 inter_op_threads=None, sr=SAMPLE_RATE):
+        import onnxruntime as ort
+
+        self.n_fft = n_fft
+        self.dim_f = dim_f
+        self.dim_t = dim_t
+        self.compensate = compensate
+        self.hop_length = hop_length
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.sr = sr
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 1) // 2))
+        self.trim = n_fft // 2
+        self.chunk_size = hop_length * (dim_t - 1)
+        self.gen_size = self.chunk_size - 2 * self.trim
+        self.window = hann_window(n_fft)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.log_severity_level = 3
+        self.session = ort.InferenceSession(str(model_path), sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run_model(self, segments):
+        """Instrumental of a (batch, 2, chunk_size) array of mix segments"""
+        batch = len(segments)
+        spec = stft(segments, self.n_fft, self.hop_length, self.window)[:, :, :self.dim_f]
+        spec = np.stack([spec.real, spec.imag], axis=2).reshape(batch, 4, self.dim_f, -1)
+        spec[:, :, :3, :] = 0  # audio-separator drops the lowest bins
+        pred = self.session.run(None, {self.input_name: spec.astype(np.float32)})[0]
+
+        n_bins = self.n_fft // 2 + 1
+        pred = np.pad(pred, [(0, 0), (0, 0), (0, n_bins - self.dim_f), (0, 0)])
+        pred = pred.reshape(batch, 2, 2, n_bins, -1)
+        return istft(pred[:, :, 0] + 1j * pred[:, :, 1], self.n_fft, self.hop_length,
+                     self.window, self.chunk_size)
+
+    def separate(self, input_path, instrumental_path, vocal_path, progress=None):
+        """Write the instrumental and vocal stems of a song
+
+        `progress(fraction)` is called as segments finish.
+        """
+        reader = MixReader(input_path, self.trim, self.sr)
+        n = reader.length
+        total = self.trim + n + self.gen_size + self.trim - n % self.gen_size
+        step = max(1, int((1 - self.overlap) * self.chunk_size))
+        starts = list(range(0, total, step))
+        batches = [starts[i:i + self.batch_size] for i in range(0, len(starts), self.batch_size)]
+
+        stems = {'instrumental': Path(instrumental_path), 'vocal': Path(vocal_path)}
+        raw = {k: p.with_name(f'.{p.name}.raw.wav') for k, p in stems.items()}
+        peaks = dict.fromkeys(stems, 0.0)
+        writers = {k: sf.SoundFile(str(p), 'w', samplerate=self.sr, channels=2,
+                                   format='RF64', subtype='FLOAT') for k, p in raw.items()}
+
+        # Overlap-add buffer over mixture samples [base, base + chunk_size)
+        base = 0
+        acc = np.zeros((2, self.chunk_size), dtype=np.float32)
+        weight = np.zeros(self.chunk_size, dtype=np.float32)
+
+        def flush(stop):
+            """Write the finished mixture samples [base, stop) of both stems"""
+            nonlocal base, acc, weight
+            count = stop - base
+            lo, hi = max(base, self.trim), min(stop, self.trim + n)
+            if hi > lo:
+                part = slice(lo - base, hi - base)
+                instrumental = acc[:, part] / np.where(weight[part] > 0, weight[part], 1)
+                instrumental *= self.compensate
+                vocal = reader.read(lo, hi) - instrumental
+                for name, stem in (('instrumental', instrumental), ('vocal', vocal)):
+                    writers[name].write(stem.T)
+                    peaks[name] = max(peaks[name], float(np.abs(stem).max(initial=0)))
+            acc = np.concatenate([acc[:, count:], np.zeros((2, count), dtype=np.float32)], axis=1)
+            weight = np.concatenate([weight[count:], np.zeros(count, dtype=np.float32)])
+            base = stop
+
+        def add(start, output):
+            size = min(self.chunk_size, total - start)
+            if start > base:
+                flush(start)
+            window = np.hanning(size).astype(np.float32) if self.overlap else np.ones(size, np.float32)
+            acc[:, :size] += output[:, :size] * window
+            weight[:size] += window
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                for i, batch in enumerate(batches):
+                    segments = np.stack([reader.read(s, s + self.chunk_size) for s in batch])
+                    pending.append((batch, pool.submit(self.run_model, segments)))
+                    # Keep every worker busy without reading ahead unboundedly
+                    while len(pending) > 2 * self.workers or (pending and i == len(batches) - 1):
+                        done, future = pending.popleft()
+                        for start, output in zip(done, future.result()):
+                            add(start, output)
+                        if progress is not None:
+                            progress(min(1.0, (done[-1] + step) / total))
+            flush(total)
+        finally:
+            reader.close()
+            for writer in writers.values():
+                writer.close()
+
+        try:
+            for name, path in stems.items():
+                self._write_normalized(raw[name], path, normalize_gain(peaks[name]))
+        finally:
+            for path in raw.values():
+                path.unlink(missing_ok=True)
+        logging.info(f"Separated {input_path} in {len(starts)} segments")
+        return [str(stems['instrumental']), str(stems['vocal'])]
+
+    def _write_normalized(self, raw_path, path, gain, block_size=1 << 18):
+        major = path.suffix.strip('.').upper()
+        subtype = 'PCM_16' if major in PCM_FORMATS else None
+        with sf.SoundFile(str(raw_path)) as src, sf.SoundFile(
+            str(path), 'w', samplerate=self.sr, channels=2, format=major, subtype=subtype
+        ) as dst:
+            for block in src.blocks(blocksize=block_size, dtype='float32'):
+                dst.write(np.clip(block * gain, -1, 1))
@@ -74,9 +74,27 @@ def test_file(test_audio_params):
     return test_file_path
 
 @pytest.fixture
-def client():
-    """Fixture for Flask test client"""
-    return app.test_client()
+def client(tmp_path, monkeypatch):
+    """Fixture for Flask test client, saving uploads and analyses in tmp_path"""
+    import app as backend
+    from cache import AnalysisCache
+    from fingerprint import FingerprintIndex
+    from jobs import JobQueue
+    from resumable import UploadStore
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    # Job workers are spawned processes that read the folder from the environment
+    monkeypatch.setenv('SONGFLOWY_UPLOAD_FOLDER', str(uploads))
+    monkeypatch.setattr(backend, 'UPLOAD_FOLDER', uploads)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(uploads))
+    monkeypatch.setattr(backend, 'analysis_cache', AnalysisCache(uploads / 'cache'))
+    monkeypatch.setattr(backend, 'fingerprint_index',
+                        FingerprintIndex(uploads / 'fingerprints.sqlite3'))
+    monkeypatch.setattr(backend, 'upload_store', UploadStore(uploads))
+    job_queue = JobQueue(uploads / 'jobs.sqlite3', max_workers=1)
+    monkeypatch.setattr(backend, 'job_queue', job_queue)
+    yield app.test_client()
+    job_queue.shutdown()
 
 @pytest.fixture
 def upload_response(client, test_file):
@@ -177,6 +195,149 @@ def test_sheet_music_generation(test_file):
     score.write('musicxml', xml_path)
     print(f"Sheet music saved to: {xml_path}")
 
+def test_sheet_summary(client, test_file):
+    """Test the sheet summary, with MusicXML only when requested"""
+    data = client.post('/api/sheet', data={'path': test_file}).get_json()
+    assert data['notes'] and len(data['notes'][0]['noteName']) == 2
+    assert data['mode'] in ('major', 'minor')
+    assert data['chords'] and {'start', 'end', 'chord', 'roman'} <= set(data['chords'][0])
+    assert data['key_map'] and {'start', 'end', 'key', 'tonic', 'mode'} <= set(data['key_map'][0])
+    assert data['beats'] == sorted(data['beats'])
+    assert all(s['tempo'] > 0 for s in data['tempo_map'])
+    assert 'musicxml' not in data
+
+    data = client.post('/api/sheet', data={'path': test_file, 'musicxml': '1'}).get_json()
+    assert os.path.exists(data['musicxml'])
+
+def test_score_export(client, test_file):
+    """Test exports are cached and revalidated with their ETag"""
+    response = client.get('/api/export', query_string={'path': test_file})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/vnd.recordare.musicxml+xml'
+    assert b'<score-partwise' in response.data
+    etag = response.headers['ETag']
+
+    response = client.get('/api/export', query_string={'path': test_file},
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get('/api/export', query_string={'path': test_file, 'format': 'midi'})
+    assert response.data[:4] == b'MThd'
+    assert response.headers['ETag'] != etag
+
+    response = client.get('/api/export', query_string={'path': test_file, 'format': 'pdf'})
+    assert response.status_code == 400
+
+def test_batch_validation(client, test_file):
+    """Test batch requests are validated before a job is queued"""
+    assert client.post('/api/batch', json={}).status_code == 400
+    response = client.post('/api/batch', json={'paths': [test_file], 'stages': ['lyrics']})
+    assert response.status_code == 400
+    assert client.post('/api/batch', json={'manifest': 'missing.txt'}).status_code == 404
+    for name in ('/etc/passwd', '../../etc/passwd', '.'):
+        assert client.post('/api/batch', json={'manifest': name}).status_code == 400
+        response = client.post('/api/batch', json={'paths': [test_file], 'output': name})
+        assert response.status_code == 400
+    for workers in ('4', 0, -1, 1.5, True):
+        response = client.post('/api/batch', json={'paths': [test_file], 'workers': workers})
+        assert response.status_code == 400
+
+def test_app_import_defers_analysis_modules():
+    """Test importing the app does not load the analysis libraries"""
+    import subprocess
+    import sys
+    code = ("import sys, app; "
+            "print(sorted(m for m in ('torch', 'whisper', 'music21', 'plotly') if m in sys.modules))")
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=backend,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+def test_resumable_upload(client, test_file):
+    """Test a chunked upload is hashed on the fly and published on finalize"""
+    import hashlib
+    with open(test_file, 'rb') as f:
+        data = f.read()
+    response = client.post('/api/uploads', json={'filename': 'chunked.wav', 'length': len(data)})
+    assert response.status_code == 201
+    location = response.headers['Location']
+
+    half = len(data) // 2
+    response = client.patch(location, data=data[:half], headers={'Upload-Offset': '0'})
+    assert response.status_code == 204
+    assert client.head(location).headers['Upload-Offset'] == str(half)
+
+    response = client.patch(location, data=data[:half], headers={'Upload-Offset': '0'})
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == half
+
+    client.patch(location, data=data[half:], headers={'Upload-Offset': str(half)})
+    result = client.post(f'{location}/finalize').get_json()
+    assert result['hash'] == hashlib.sha256(data).hexdigest()
+    with open(result['path'], 'rb') as f:
+        assert f.read() == data
+    assert client.head(location).status_code == 404
+
+def test_serve_file_ranges_and_caching(client, test_file):
+    """Test uploads are served by byte range and cached by content hash"""
+    import hashlib
+    import shutil
+    shutil.copy(test_file, app.config['UPLOAD_FOLDER'])
+    with open(test_file, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    url = '/uploads/test_audio.wav'
+
+    response = client.get(url)
+    assert response.headers['ETag'] == f'"{content_hash}"'
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == data[100:200]
+
+    response = client.get(url, headers={'If-None-Match': f'"{content_hash}"'})
+    assert response.status_code == 304
+
+    response = client.get(url, query_string={'v': content_hash})
+    assert 'immutable' in response.headers['Cache-Control']
+
+    assert client.get('/uploads/missing.wav').status_code == 404
+    assert client.get(url, query_string={'format': 'flac'}).status_code == 400
+
+def test_serve_file_transcoded(client, test_file):
+    """Test a compressed transcode is produced once and served like the original"""
+    import shutil
+    shutil.copy(test_file, app.config['UPLOAD_FOLDER'])
+    response = client.get('/uploads/test_audio.wav', query_string={'format': 'ogg'})
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/ogg'
+    assert response.data[:4] == b'OggS'
+    assert len(response.data) < os.path.getsize(test_file)
+
+    again = client.get('/uploads/test_audio.wav', query_string={'format': 'ogg'},
+                       headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+def test_linked_stems_reuse_stored_hashes(tmp_path, test_file):
+    """Test stems linked from the cache are not hashed again to be served"""
+    from app import link_stems, separation_result
+    from cache import file_hash
+    for stem in ('vocal', 'bgm'):
+        (tmp_path / f'{stem}.wav').write_bytes(stem.encode())
+    (tmp_path / 'hashes.json').write_text('{"vocal": "v" , "bgm": "b"}')
+
+    link_stems(tmp_path, test_file)
+    result = separation_result(test_file)
+    try:
+        assert file_hash(result['vocal']) == 'v'
+        assert result['urls']['vocal'] == '/uploads/vocal_test_audio.wav?v=v'
+        assert result['urls']['instrumental'].endswith('?v=b')
+    finally:
+        # The stems are placeholders that later analyses must not pick up
+        os.remove(result['vocal'])
+        os.remove(result['instrumental'])
+
 def test_error_handling_no_file(client):
     """Test error handling when no file is provided"""
     response = client.post('/api/upload')
@@ -193,3 +354,202 @@ def test_error_handling_empty_file(client):
     data = response.get_json()
     assert response.status_code == 400
     assert 'error' in data
+
+def test_unknown_job_status(client):
+    """Test status and result endpoints of a job that does not exist"""
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/result').status_code == 404
+
+def test_metrics_and_server_timing(client, test_file, tmp_path, monkeypatch):
+    """Test stage spans in Server-Timing and /metrics, and profiled requests"""
+    import app
+    assert 'X-Profile' not in client.get('/api/models', headers={'X-Profile': '1'}).headers
+    monkeypatch.setattr(app, 'PROFILE_REQUESTS', True)
+    monkeypatch.setattr(app, 'PROFILE_FOLDER', tmp_path / 'profiles')
+    monkeypatch.setattr(app, 'PROFILE_KEEP', 2)
+
+    response = client.post('/api/sheet', data={'path': test_file},
+                           headers={'X-Profile': '1'})
+    timing = response.headers['Server-Timing']
+    assert 'midi;dur=' in timing and 'encode;dur=' in timing
+    # Cached analyses may finish before the first sample
+    assert (tmp_path / 'profiles' / response.headers['X-Profile']).is_file()
+    names = {client.get('/api/models', headers={'X-Profile': '1'}).headers['X-Profile']
+             for _ in range(3)}
+    assert len(names) == 3
+    assert len(list((tmp_path / 'profiles').iterdir())) == 2
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'songflowy_request_seconds_count{route="/api/sheet",method="POST",status="200"}' in text
+    assert 'songflowy_stage_seconds_bucket{stage="midi",cache=' in text
+    assert 'songflowy_cache_lookups{result="hit"}' in text
+
+def test_pitch_analysis_binary_response(client, test_file):
+    """Test negotiating typed arrays for /api/analyze_pitch"""
+    from encoding import ARRAYS, decode_arrays
+
+    response = client.post('/api/analyze_pitch', data={'path': test_file},
+                           headers={'Accept': ARRAYS})
+    assert response.status_code == 200
+    assert response.mimetype == ARRAYS
+    data = decode_arrays(response.data)
+    assert 'plot' not in data
+    assert len(data['times']) == len(data['midi']) == len(data['cents'])
+    assert 69 in data['midi']
+
+    response = client.post('/api/analyze_pitch', data={'path': test_file})
+    assert response.mimetype == 'application/json'
+    assert 'plot' in response.get_json()
+
+def test_sheet_reanalyzes_edited_region(client, test_file, tmp_path, monkeypatch):
+    """Test only the edited region of a song is transcribed again"""
+    import app
+    from cache import AnalysisCache
+    monkeypatch.setattr(app, 'analysis_cache', AnalysisCache(tmp_path / 'cache'))
+    y, sr = sf.read(test_file)
+    song = np.tile(y, 8)
+    base, edited = 'uploads/edit_base.wav', 'uploads/edit_edited.wav'
+    sf.write(base, song, sr)
+    sf.write(edited, np.concatenate([song[:10 * sr], song[11 * sr:]]), sr)
+    try:
+        before = client.post('/api/sheet', data={'path': base}).get_json()
+
+        transcribed = []
+        predict_notes = app.predict_notes
+        def record(y, **kwargs):
+            transcribed.append(len(y) / sr)
+            return predict_notes(y, **kwargs)
+        monkeypatch.setattr(app, 'predict_notes', record)
+
+        after = client.post('/api/sheet', data={'path': edited, 'base': base}).get_json()
+        assert len(transcribed) == 1 and transcribed[0] < 10
+        assert after['tempo'] == pytest.approx(before['tempo'], rel=0.05)
+
+        notes = app.predict_note_arrays(edited)
+        base_notes = app.predict_note_arrays(base)
+        early = base_notes['start'] < 7
+        np.testing.assert_array_equal(notes['start'][:early.sum()], base_notes['start'][early])
+
+        response = client.post('/api/sheet', data={'path': edited, 'base': 'uploads/missing.wav'})
+        assert response.status_code == 404
+    finally:
+        os.remove(base)
+        os.remove(edited)
+
+def test_upload_adopts_analysis_of_trimmed_duplicate(client, tmp_path):
+    """Test a trimmed re-encode of an analyzed song reuses its notes, shifted"""
+    import app
+    from tests.test_fingerprint import melody
+    sr = 22050
+    y = melody(30, 0)
+    original, trimmed = tmp_path / 'original.wav', tmp_path / 'trimmed.flac'
+    sf.write(original, y, sr)
+    sf.write(trimmed, y[5 * sr:25 * sr], sr)
+
+    with open(original, 'rb') as f:
+        data = client.post('/api/upload', data={'file': (f, 'fp_original.wav')}).get_json()
+    assert app.job_queue.wait(data['duplicate_job'], timeout=120)['result'] is None
+    source = data['path']
+    client.post('/api/sheet', data={'path': source})
+    with open(trimmed, 'rb') as f:
+        data = client.post('/api/upload', data={'file': (f, 'fp_trimmed.flac')}).get_json()
+    job = app.job_queue.wait(data['duplicate_job'], timeout=120)
+    assert job['result']['offset'] == 5
+    assert job['result']['stages'] == ['tempo', 'sheet']
+    assert {'tempo', 'sheet'} <= set(app.analyzed_stages(data['path']))
+
+    notes = app.predict_note_arrays(data['path'])
+    source = app.predict_note_arrays(source)
+    inside = (source['start'] > 5.5) & (source['end'] < 24.5)
+    np.testing.assert_allclose(notes['start'][(notes['start'] > 0.5) & (notes['end'] < 19.5)],
+                               source['start'][inside] - 5, atol=1e-6)
+
+def test_adopt_stems_cut_from_the_matched_song(client, tmp_path):
+    """Test the stems of a duplicate are cut from the cached stems at its offset"""
+    import json
+    import app
+    from cache import file_hash
+    sr = 8000
+    song = np.random.default_rng(0).uniform(-0.5, 0.5, (10 * sr, 2))
+    source = app.UPLOAD_FOLDER / 'stems_source.wav'
+    sf.write(source, song, sr, subtype='FLOAT')
+    match = {'hash': file_hash(source), 'suffix': '.wav', 'offset': 2.0, 'seconds': 10.0}
+    with app.analysis_cache.store(app.separation_key(source)) as tmp:
+        for stem, gain in (('vocal', 0.5), ('bgm', 0.25)):
+            sf.write(tmp / f'{stem}.wav', gain * song, sr, subtype='FLOAT')
+        (tmp / 'hashes.json').write_text(json.dumps({'vocal': 'v', 'bgm': 'b'}))
+
+    upload = app.UPLOAD_FOLDER / 'stems_upload.wav'
+    sf.write(upload, song[2 * sr:6 * sr], sr, subtype='FLOAT')
+    assert app.adopt_stems(upload, match, 4.0)
+    assert not app.adopt_stems(upload, match, 4.0)
+    assert not app.adopt_stems(upload.with_suffix('.mp4'), match, 4.0)
+
+    entry = app.analysis_cache.entry(app.separation_key(upload))
+    for stem, gain in (('vocal', 0.5), ('bgm', 0.25)):
+        y, _ = sf.read(entry / f'{stem}.wav', always_2d=True)
+        np.testing.assert_allclose(y, gain * song[2 * sr:6 * sr], atol=1e-4)
+    with open(entry / 'hashes.json') as f:
+        assert json.load(f)['vocal'] == file_hash(entry / 'vocal.wav')
+
+def test_score_take_against_reference(client, tmp_path, monkeypatch):
+    """Test a take is scored per note of the reference, reusing its contour"""
+    import app
+    from cache import AnalysisCache
+    from tests.test_performance import sing
+    monkeypatch.setattr(app, 'analysis_cache', AnalysisCache(tmp_path / 'cache'))
+    rng = np.random.default_rng(1)
+    pitches, durations = rng.integers(60, 72, 24), rng.choice([0.5, 0.75], 24)
+    reference, take = 'uploads/score_reference.wav', 'uploads/score_take.wav'
+    sf.write(reference, sing(pitches, durations)[0], 22050)
+    sf.write(take, sing(pitches, durations, lead=0.3)[0], 22050)
+    try:
+        app.song_pitch_contour(reference)
+        data = client.post('/api/score', data={'path': take, 'reference': reference}).get_json()
+        assert 0 < data['score'] <= 100 and data['reference'] == reference
+        assert data['offset'] == pytest.approx(0.3, abs=0.05)
+        assert data['notes'] and {'pitch_error', 'timing_error', 'sung'} <= set(data['notes'][0])
+        assert app.analysis_cache.hits > 0
+
+        assert client.post('/api/score', data={'path': take}).status_code == 400
+        response = client.post('/api/score', data={'path': take, 'reference': 'uploads/none.wav'})
+        assert response.status_code == 404
+    finally:
+        os.remove(reference)
+        os.remove(take)
+
+def test_transcribe_vocals_aligned_to_notes(client, test_file, tmp_path, monkeypatch):
+    """Test lyrics of a vocal stem are cached and their words snapped to notes"""
+    import shutil
+    import app
+    from cache import AnalysisCache
+    from models import ModelRegistry
+
+    class FakeWhisper:
+        calls = 0
+
+        def transcribe(self, audio, language=None, **kwargs):
+            FakeWhisper.calls += 1
+            return {'language': language, 'segments': [{
+                'start': 0.0, 'end': 1.0, 'text': ' la',
+                'words': [{'word': ' la', 'start': 0.07, 'end': 0.4, 'probability': 0.9}]}]}
+
+    registry = ModelRegistry()
+    registry.register('whisper', FakeWhisper)
+    registry.register('basic-pitch', app.load_basic_pitch)
+    monkeypatch.setattr(app, 'model_registry', registry)
+    monkeypatch.setattr(app, 'analysis_cache', AnalysisCache(tmp_path / 'cache'))
+    monkeypatch.setattr(app, 'WHISPER_WORKERS', 0)
+    vocal = 'uploads/vocal_lyrics_test.wav'
+    shutil.copyfile(test_file, vocal)
+    try:
+        data = client.post('/api/transcribe', data={'path': vocal, 'language': 'en'}).get_json()
+        assert data['language'] == 'en' and data['text'] == 'la'
+        onsets = app.predict_note_arrays(vocal)['start']
+        word = data['words'][0]
+        assert word['aligned'] and word['start'] in np.round(onsets, 3)
+
+        client.post('/api/transcribe', data={'path': vocal, 'language': 'en'})
+        assert FakeWhisper.calls == 1
+    finally:
+        os.remove(vocal)
@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pytest
+import soundfile as sf
+from batch import is_done, load_index, read_manifest, run_batch
+
+
+@pytest.fixture(scope="module")
+def songs(tmp_path_factory):
+    """Two short tones and a manifest listing them and a missing file"""
+    root = tmp_path_factory.mktemp('library')
+    sr = 22050
+    t = np.arange(sr) / sr
+    paths = []
+    for i, freq in enumerate((440.0, 330.0)):
+        path = root / f'song{i}.wav'
+        sf.write(path, 0.5 * np.sin(2 * np.pi * freq * t), sr)
+        paths.append(str(path))
+    manifest = root / 'songs.txt'
+    manifest.write_text('\n'.join(['# library', *paths, str(root / 'missing.wav')]) + '\n')
+    return root, paths, manifest
+
+def test_read_manifest(songs):
+    root, paths, manifest = songs
+    assert read_manifest(manifest) == paths + [str(root / 'missing.wav')]
+    assert read_manifest(root) == paths
+
+def test_load_index_skips_truncated_lines(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text(json.dumps({'path': 'a.wav', 'status': 'failed'}) + '\n'
+                      + json.dumps({'path': 'a.wav', 'status': 'done'}) + '\n'
+                      + '{"path": "b.wa')
+    assert load_index(output) == {'a.wav': {'path': 'a.wav', 'status': 'done'}}
+
+def test_batch_resumes(songs, tmp_path):
+    """Songs with a successful record are skipped on the next run"""
+    _, paths, manifest = songs
+    output = tmp_path / 'results.jsonl'
+    rates = []
+    summary = run_batch(read_manifest(manifest), output, stages=['pitch'], workers=1,
+                        progress=lambda done, total, rate: rates.append(rate))
+    assert summary['analyzed'] == 2 and summary['failed'] == 0
+    assert len(summary['missing']) == 1
+    assert len(rates) == 2 and summary['songs_per_minute'] > 0
+
+    index = load_index(output)
+    assert index[paths[0]]['pitch_median'] == 69
+    assert index[paths[1]]['pitch_median'] == 64
+    assert all(is_done(index[p], p, ['pitch']) for p in paths)
+    assert not is_done(index[paths[0]], paths[0], ['pitch', 'sheet'])
+
+    summary = run_batch(paths, output, stages=['pitch'], workers=1)
+    assert summary['analyzed'] == 0 and summary['skipped'] == 2
+    assert len(output.read_text().splitlines()) == 2
+
+def test_batch_rejects_unknown_stages(tmp_path):
+    with pytest.raises(ValueError):
+        run_batch([], tmp_path / 'results.jsonl', stages=['lyrics'])
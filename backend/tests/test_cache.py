@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import time
+import pytest
+from cache import AnalysisCache, cache_key, file_hash
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnalysisCache(tmp_path / 'cache', max_size_mb=1)
+
+def test_file_hash_ignores_filename(tmp_path):
+    """The same content under two names hashes the same"""
+    a, b, c = tmp_path / 'a.wav', tmp_path / 'b.wav', tmp_path / 'c.wav'
+    a.write_bytes(b'song')
+    b.write_bytes(b'song')
+    c.write_bytes(b'other song')
+    assert file_hash(a) == file_hash(b)
+    assert file_hash(a) != file_hash(c)
+
+def test_file_hash_detects_changes(tmp_path):
+    path = tmp_path / 'a.wav'
+    path.write_bytes(b'song')
+    before = file_hash(path)
+    path.write_bytes(b'edited song')
+    assert file_hash(path) != before
+
+def test_cache_key_includes_parameters():
+    key = cache_key('abc', 'midi', onset_threshold=0.7)
+    assert key == cache_key('abc', 'midi', onset_threshold=0.7)
+    assert key != cache_key('abc', 'midi', onset_threshold=0.5)
+    assert key != cache_key('abc', 'tempo', onset_threshold=0.7)
+
+def test_store_and_lookup(cache):
+    assert cache.lookup('ab12') is None
+    with cache.store('ab12') as tmp:
+        (tmp / 'notes.mid').write_bytes(b'midi')
+    entry = cache.lookup('ab12')
+    assert (entry / 'notes.mid').read_bytes() == b'midi'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_failed_store_publishes_nothing(cache):
+    """Outputs are only visible once they have been completely written"""
+    with pytest.raises(RuntimeError):
+        with cache.store('ab12') as tmp:
+            (tmp / 'notes.mid').write_bytes(b'partial')
+            raise RuntimeError('inference failed')
+    assert cache.lookup('ab12') is None
+    assert not any(p.name.startswith('.tmp-') for p in cache.root.iterdir())
+
+def test_json_values(cache):
+    assert cache.load_json('cd34') is None
+    cache.save_json('cd34', 120.0)
+    assert cache.load_json('cd34') == 120.0
+
+def test_lru_eviction(cache):
+    """Least recently used entries are removed once over the size limit"""
+    for i, key in enumerate(['aa01', 'bb02', 'cc03']):
+        with cache.store(key) as tmp:
+            (tmp / 'data').write_bytes(b'x' * 400_000)
+        os.utime(cache.entry(key), (i, i))
+    cache.evict()
+    assert cache.lookup('aa01') is None
+    assert cache.lookup('bb02') is not None
+    assert cache.lookup('cc03') is not None
+
+def test_eviction_keeps_locked_and_recent_entries(cache):
+    """Entries being read or just used are not removed under their readers"""
+    for i, key in enumerate(['aa01', 'bb02', 'cc03']):
+        with cache.store(key) as tmp:
+            (tmp / 'data').write_bytes(b'x' * 300_000)
+        os.utime(cache.entry(key), (i, i))
+    os.utime(cache.entry('bb02'))
+    cache.max_size = 500_000
+    with cache.lock('aa01'):
+        cache.evict()
+    assert not cache.entry('cc03').exists()
+    assert cache.entry('aa01').exists() and cache.entry('bb02').exists()
+    cache.evict()
+    assert not cache.entry('aa01').exists() and cache.entry('bb02').exists()
+
+def test_stores_scan_only_over_the_limit(cache, monkeypatch):
+    """The directory is scanned once, then again only when the limit is crossed"""
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: scans.append(1) or entries())
+    for key in ['aa01', 'bb02']:
+        with cache.store(key) as tmp:
+            (tmp / 'data').write_bytes(b'x' * 400_000)
+    assert len(scans) == 1
+    with cache.store('cc03') as tmp:
+        (tmp / 'data').write_bytes(b'x' * 400_000)
+    assert len(scans) == 2
+
+def compute_once(root, key, log):
+    """Write an entry unless another process already has, logging each write"""
+    cache = AnalysisCache(root)
+    with cache.lock(key):
+        if cache.lookup(key) is None:
+            with open(log, 'a') as f:
+                f.write('write\n')
+            time.sleep(0.2)
+            cache.save_json(key, 1)
+
+@pytest.mark.skipif(os.name != 'posix', reason='entries are locked across processes on POSIX')
+def test_lock_across_processes(cache, tmp_path):
+    """Concurrent workers compute an entry once"""
+    ctx = multiprocessing.get_context('spawn')
+    log = tmp_path / 'writes.log'
+    workers = [ctx.Process(target=compute_once, args=(cache.root, 'ee05', log))
+               for _ in range(3)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert log.read_text() == 'write\n'
+
+def test_locks_are_released_with_their_files(cache):
+    """Locks of keys nobody holds are not kept, in memory or on disk"""
+    with cache.lock('ff06'):
+        with cache.lock('ff07'):
+            pass
+    assert cache._key_locks == {}
+    assert not (cache.root / '.locks' / 'ff06').exists()
+    assert not (cache.root / '.locks' / 'ff07').exists()
@@ -0,0 +1,42 @@
+import numpy as np
+from chords import CHORD_NAMES, chord_timeline, roman_numeral, roman_numerals
+
+SR = 22050
+
+
+def progression(chords, beat=0.5, beats_per_chord=4):
+    """Harmonic tones of each chord's MIDI notes, repeated on every beat"""
+    n = int(beat * SR)
+    t = np.arange(n) / SR
+    blocks = []
+    for pitches in chords:
+        f = 440 * 2 ** ((np.array(pitches)[:, None] - 69) / 12)
+        tone = sum(np.sin(2 * np.pi * f * h * t) / h for h in (1, 2, 3)).sum(axis=0)
+        blocks.extend([tone * np.exp(-2 * t)] * beats_per_chord)
+    y = np.concatenate([np.zeros(SR)] + blocks + [np.zeros(SR)])
+    return (y / np.abs(y).max()).astype(np.float32)
+
+def test_chord_timeline():
+    """I-vi-IV-V7 in C, one chord per bar, with silence around"""
+    y = progression([[48, 60, 64, 67], [45, 57, 60, 64], [41, 53, 57, 60], [43, 55, 59, 62, 65]])
+    beats = np.arange(1, 10, 0.5)
+    timeline = roman_numerals(chord_timeline(y, SR, beats), 'C')
+    assert [s['chord'] for s in timeline] == ['N', 'C', 'Am', 'F', 'G7', 'N']
+    assert [s['roman'] for s in timeline[1:5]] == ['I', 'vi', 'IV', 'V7']
+    assert [s['start'] for s in timeline[:5]] == [0.0, 1.0, 3.0, 5.0, 7.0]
+    assert timeline[-1]['end'] == len(y) / SR
+
+def test_chord_timeline_without_beats():
+    y = progression([[57, 60, 64]])
+    assert [s['chord'] for s in chord_timeline(y, SR, [])] == ['Am']
+    assert chord_timeline(np.zeros(0, np.float32), SR, []) == []
+
+def test_roman_numerals():
+    assert roman_numeral('G7', 'C') == 'V7'
+    assert roman_numeral('Bdim', 'C') == 'vii°'
+    assert roman_numeral('b', 'C') == 'bVII'
+    assert roman_numeral('C', 'Am') == 'III'
+    assert roman_numeral('E', 'Am') == 'V'
+    assert roman_numeral('gm', 'gm') == 'i'
+    assert roman_numeral('N', 'C') == 'N'
+    assert len(set(CHORD_NAMES)) == len(CHORD_NAMES) == 48
@@ -0,0 +1,86 @@
+import numpy as np
+import librosa
+from edits import (find_edit, mel_db_frames, mel_db_max, onset_envelope, splice_frames,
+                   splice_notes)
+
+
+def make_notes(starts, pitches):
+    starts = np.asarray(starts, dtype=np.float64)
+    return {
+        'start': starts,
+        'end': starts + 0.5,
+        'pitch': np.asarray(pitches, dtype=np.int16),
+        'amplitude': np.full(len(starts), 0.8, dtype=np.float32),
+    }
+
+def test_find_edit_replacement():
+    old = np.arange(1000, dtype=np.float32)
+    new = old.copy()
+    new[300:320] = -1
+    assert find_edit(old, new, block_size=64) == (300, 320, 320)
+
+def test_find_edit_trim_and_insert():
+    old = np.random.default_rng(0).standard_normal(1000).astype(np.float32)
+    trimmed = np.concatenate([old[:400], old[500:]])
+    assert find_edit(old, trimmed, block_size=64) == (400, 500, 400)
+    inserted = np.concatenate([old[:400], np.ones(30, np.float32), old[400:]])
+    assert find_edit(old, inserted, block_size=64) == (400, 400, 430)
+
+def test_find_edit_unchanged():
+    old = np.random.default_rng(0).standard_normal(100).astype(np.float32)
+    start, old_stop, new_stop = find_edit(old, old.copy())
+    assert start == old_stop == new_stop
+
+def test_splice_notes_shifts_notes_after_the_edit():
+    """Notes around the edit are replaced; later ones move with the trim"""
+    base = make_notes([0.0, 1.0, 4.0, 8.0], [60, 62, 64, 65])
+    fresh = make_notes([1.2, 3.0, 5.5, 7.0], [70, 71, 72, 73])
+    notes = splice_notes(base, fresh, start=1.0, stop=6.0, shift=-2.0)
+    np.testing.assert_allclose(notes['start'], [0.0, 1.2, 3.0, 5.5, 6.0])
+    assert notes['pitch'].tolist() == [60, 70, 71, 72, 65]
+    assert notes['pitch'].dtype == np.int16
+
+def test_splice_notes_cuts_notes_held_into_the_edit():
+    base = make_notes([0.0], [60])
+    base['end'][:] = 3.0
+    notes = splice_notes(base, make_notes([], []), start=1.0, stop=4.0, shift=0.0,
+                         edit_start=2.0)
+    assert notes['end'].tolist() == [2.0]
+
+def test_splice_frames():
+    base = np.arange(10)
+    spliced = splice_frames(base, np.array([-1, -1]), 3, 5, shift=-2)
+    assert spliced.tolist() == [0, 1, 2, -1, -1, 7, 8, 9]
+
+def test_onset_envelope_in_blocks():
+    """Block by block, or only some frames, the envelope is librosa's"""
+    sr = 22050
+    y = 0.1 * np.random.default_rng(0).standard_normal(5 * sr).astype(np.float32)
+    y[::sr // 2] += 1
+    expected = librosa.onset.onset_strength(y=y, sr=sr, hop_length=512, aggregate=np.median)
+    np.testing.assert_allclose(onset_envelope(y, sr, block_frames=50), expected, atol=1e-5)
+    np.testing.assert_allclose(onset_envelope(y, sr, 60, 120), expected[60:120], atol=1e-5)
+
+def test_onset_envelope_clamped_to_the_whole_song():
+    """Quiet blocks are clamped to the song's loudest bin, not their own"""
+    sr = 22050
+    y = 1e-4 * np.random.default_rng(1).standard_normal(5 * sr).astype(np.float32)
+    y[::sr // 4] += 1e-3
+    y[3 * sr:] *= 1e4
+    expected = librosa.onset.onset_strength(y=y, sr=sr, hop_length=512, aggregate=np.median)
+    np.testing.assert_allclose(onset_envelope(y, sr, block_frames=50), expected, atol=1e-4)
+    np.testing.assert_allclose(onset_envelope(y, sr, 10, 60), expected[10:60], atol=1e-4)
+
+def test_frame_db_gives_the_whole_song_ref():
+    """Spliced frame maxima give the edited song's ref_db without reading all of it"""
+    sr = 22050
+    y = 0.1 * np.random.default_rng(2).standard_normal(5 * sr).astype(np.float32)
+    y[sr:2 * sr] *= 10
+    envelope, frame_db = onset_envelope(y, sr, block_frames=50, return_frame_db=True)
+    np.testing.assert_allclose(frame_db, mel_db_frames(y, sr), atol=1e-4)
+    assert np.isclose(frame_db.max(), mel_db_max(y, sr))
+    edited = y.copy()
+    edited[3 * sr:4 * sr] *= 100
+    lo, hi = 3 * sr // 512, 4 * sr // 512 + 1
+    spliced = splice_frames(frame_db, mel_db_frames(edited, sr, lo, hi), lo, hi, shift=0)
+    assert np.isclose(spliced.max(), mel_db_max(edited, sr))
@@ -0,0 +1,45 @@
+import json
+import numpy as np
+import pytest
+from encoding import (ARRAYS, JSON, MSGPACK, decode_arrays, decode_msgpack, encode,
+                      encode_arrays)
+
+
+@pytest.fixture
+def result():
+    return {
+        'tempo': 120.0,
+        'key': 'A',
+        'times': np.linspace(0, 1, 5, dtype=np.float32),
+        'midi': np.array([69, -1, 71, 72, 73], dtype=np.int16),
+        'voiced': np.array([True, False, True, True, True]),
+        'grid': np.arange(6, dtype=np.float64).reshape(2, 3),
+    }
+
+def test_arrays_round_trip(result):
+    decoded = decode_arrays(encode(result, ARRAYS))
+    assert decoded['tempo'] == 120.0
+    assert decoded['key'] == 'A'
+    for name in ('times', 'midi', 'grid'):
+        assert decoded[name].dtype == result[name].dtype
+        np.testing.assert_array_equal(decoded[name], result[name])
+    np.testing.assert_array_equal(decoded['voiced'], result['voiced'].astype(np.uint8))
+
+def test_arrays_are_aligned(result):
+    """Arrays start on 8-byte boundaries so browsers can map typed arrays"""
+    payload = encode_arrays(result)
+    header_length = int.from_bytes(payload[4:8], 'little')
+    assert (8 + header_length) % 8 == 0
+    header = json.loads(payload[8:8 + header_length])
+    assert all(spec['offset'] % 8 == 0 for spec in header['arrays'].values())
+
+def test_msgpack_round_trip(result):
+    decoded = decode_msgpack(encode(result, MSGPACK))
+    assert decoded['key'] == 'A'
+    np.testing.assert_array_equal(decoded['midi'], result['midi'])
+    np.testing.assert_array_equal(decoded['grid'], result['grid'])
+
+def test_json(result):
+    decoded = json.loads(encode(result, JSON))
+    assert decoded['midi'] == [69, -1, 71, 72, 73]
+    assert decoded['grid'] == [[0, 1, 2], [3, 4, 5]]
@@ -0,0 +1,47 @@
+import numpy as np
+import librosa
+import pytest
+from fingerprint import HOP_LENGTH, FingerprintIndex, landmarks
+
+SR = 22050
+
+
+def melody(seconds, seed, note=0.25):
+    """Random notes with a few harmonics, each `note` seconds long"""
+    rng = np.random.default_rng(seed)
+    n = int(note * SR)
+    t = np.arange(n) / SR
+    blocks = []
+    for pitch in rng.integers(48, 84, int(seconds / note)):
+        f = 440 * 2 ** ((pitch - 69) / 12)
+        blocks.append(sum(np.sin(2 * np.pi * f * h * t) / h for h in (1, 2, 3)) * np.exp(-4 * t))
+    return (np.concatenate(blocks) / 3).astype(np.float32)
+
+@pytest.fixture
+def index(tmp_path):
+    index = FingerprintIndex(tmp_path / 'fingerprints.sqlite3')
+    for name, seed in (('song', 0), ('other', 1)):
+        index.add(name, '.wav', 60.0, *landmarks(melody(60, seed), SR))
+    return index
+
+def test_trimmed_and_resampled_song_matches(index):
+    y = melody(60, 0)[int(12.5 * SR):int(40 * SR)]
+    y = librosa.resample(librosa.resample(y, orig_sr=SR, target_sr=16000), orig_sr=16000,
+                         target_sr=SR) * 0.5
+    y += np.random.default_rng(2).normal(0, 0.005, len(y)).astype(np.float32)
+    match = index.lookup(*landmarks(y, SR), SR)
+    assert match['hash'] == 'song' and match['suffix'] == '.wav' and match['seconds'] == 60
+    assert match['offset'] == pytest.approx(12.5, abs=HOP_LENGTH / SR)
+
+def test_unrelated_and_excluded_songs_do_not_match(index):
+    assert index.lookup(*landmarks(melody(30, 3), SR), SR) is None
+    assert index.lookup(*landmarks(melody(60, 0), SR), SR, exclude='song') is None
+    assert index.lookup(np.zeros(0, np.int64), np.zeros(0, np.int64), SR) is None
+
+def test_songs_are_indexed_once(index):
+    assert 'song' in index and 'missing' not in index
+    hashes, frames = landmarks(melody(60, 0), SR)
+    index.add('song', '.mp3', 1.0, hashes, frames)
+    match = index.lookup(hashes, frames, SR)
+    assert match['offset'] == 0 and match['suffix'] == '.wav'
+    assert match['matches'] >= len(hashes)
@@ -0,0 +1,65 @@
+import time
+import pytest
+import metrics
+from jobs import JobQueue, in_job, report_progress, DONE, FAILED
+
+
+def add_task(a, b):
+    report_progress(0.5, 'Adding')
+    return {'sum': a + b}
+
+def failing_task():
+    raise ValueError('bad input')
+
+def timed_task():
+    with metrics.span('timed_stage'):
+        return 1
+
+
+@pytest.fixture(scope="module")
+def queue(tmp_path_factory):
+    """Job queue with a single worker process"""
+    queue = JobQueue(tmp_path_factory.mktemp('jobs') / 'jobs.sqlite3', max_workers=1)
+    yield queue
+    queue.shutdown()
+
+def test_job_result(queue):
+    """A submitted job runs in a worker and stores its result"""
+    job_id = queue.submit('add', add_task, 1, 2)
+    job = queue.wait(job_id, timeout=60)
+    assert job['kind'] == 'add'
+    assert job['status'] == DONE
+    assert job['progress'] == 1.0
+    assert job['result'] == {'sum': 3}
+
+def test_job_failure(queue):
+    """Exceptions raised by the task mark the job as failed"""
+    job_id = queue.submit('fail', failing_task)
+    job = queue.wait(job_id, timeout=60)
+    assert job['status'] == FAILED
+    assert job['error'] == 'bad input'
+    assert job['result'] is None
+
+def test_job_spans_reach_server_metrics(queue):
+    """Spans recorded in the worker are replayed into this process's metrics"""
+    job_id = queue.submit('timed', timed_task)
+    assert queue.wait(job_id, timeout=60)['status'] == DONE
+    for _ in range(50):
+        text = metrics.REGISTRY.render()
+        if 'stage="timed_stage"' in text:
+            break
+        time.sleep(0.1)
+    assert 'songflowy_stage_seconds_count{stage="timed_stage",cache="none"} 1' in text
+    assert 'songflowy_job_seconds_count{kind="timed",status="done"} 1' in text
+
+def test_in_job(queue):
+    """Tasks can tell they run in a job worker"""
+    assert queue.wait(queue.submit('in_job', in_job), timeout=60)['result'] is True
+    assert not in_job()
+
+def test_unknown_job(queue):
+    assert queue.get('missing') is None
+
+def test_report_progress_outside_job():
+    """Tasks can also run synchronously, where progress is ignored"""
+    assert add_task(2, 2) == {'sum': 4}
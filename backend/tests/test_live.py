@@ -0,0 +1,100 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+from live import LiveScorer, serve
+
+SR = 16000
+
+# One second of A4, then one of C#5
+NOTES = [
+    {'pitch': 69, 'start': 0.0, 'end': 1.0},
+    {'pitch': 73, 'start': 1.0, 'end': 2.0},
+]
+
+def sing(freqs, seconds=1.0):
+    t = np.arange(int(SR * seconds)) / SR
+    return np.concatenate([0.3 * np.sin(2 * np.pi * f * t) for f in freqs]).astype(np.float32)
+
+def run_session(scorer, audio, chunk=320):
+    events = []
+    for start in range(0, len(audio), chunk):
+        events += scorer.feed(audio[start:start + chunk])
+    return events + scorer.finish()
+
+def test_hits_in_tune_singing():
+    scorer = LiveScorer(NOTES, sr=SR)
+    events = run_session(scorer, sing([440.0, 554.37]))
+    notes = [e for e in events if e['type'] == 'note']
+    assert [n['pitch'] for n in notes] == [69, 73]
+    assert all(n['hit'] for n in notes)
+    assert all(abs(n['cents']) < 20 for n in notes)
+    assert events[-1] == {'type': 'summary', 'notes': 2, 'hits': 2, 'score': 100.0}
+
+def test_misses_and_deviation():
+    """A semitone flat on the second note is a miss with -100 cents"""
+    scorer = LiveScorer(NOTES, sr=SR)
+    events = run_session(scorer, sing([440.0, 523.25]))
+    first, second = [e for e in events if e['type'] == 'note']
+    assert first['hit']
+    assert not second['hit']
+    assert second['cents'] == pytest.approx(-100, abs=20)
+    assert events[-1]['score'] == 50.0
+
+def test_octave_tolerance():
+    scorer = LiveScorer(NOTES, sr=SR, octave_tolerant=False)
+    events = run_session(scorer, sing([220.0, 277.18]))
+    assert events[-1]['hits'] == 0
+
+    scorer = LiveScorer(NOTES, sr=SR)
+    events = run_session(scorer, sing([220.0, 277.18]))
+    assert events[-1]['hits'] == 2
+
+def test_notes_reported_as_they_end():
+    """A note's result is pushed with the first chunk past its end"""
+    scorer = LiveScorer(NOTES, sr=SR)
+    audio = sing([440.0, 554.37])
+    events = scorer.feed(audio[:int(1.2 * SR)])
+    assert [e['pitch'] for e in events if e['type'] == 'note'] == [69]
+
+def test_note_arrays_as_targets():
+    """Targets may be the note arrays of a transcription, in seconds"""
+    from notes import note_arrays
+    notes = note_arrays([(1.0, 2.0, 73, 1.0, None), (0.0, 1.0, 69, 1.0, None)])
+    events = run_session(LiveScorer(notes, sr=SR), sing([440.0, 554.37]))
+    assert [e['pitch'] for e in events if e['type'] == 'note'] == [69, 73]
+    assert events[-1]['hits'] == 2
+
+def test_websocket_session():
+    """End-to-end session over the WebSocket server"""
+    from websockets.asyncio.client import connect
+
+    async def session():
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        server_task = asyncio.create_task(serve('127.0.0.1', 0, workers=2, ready=ready))
+        server = await ready
+        port = next(iter(server.sockets)).getsockname()[1]
+        try:
+            async with connect(f'ws://127.0.0.1:{port}') as ws:
+                await ws.send(json.dumps({'path': '/etc/passwd'}))
+                assert json.loads(await ws.recv())['type'] == 'error'
+            async with connect(f'ws://127.0.0.1:{port}') as ws:
+                await ws.send(json.dumps({'notes': NOTES, 'sample_rate': SR}))
+                assert json.loads(await ws.recv()) == {'type': 'ready', 'notes': 2}
+                await ws.send(b'\x00' * 7)
+                assert json.loads(await ws.recv())['type'] == 'error'
+                for control in ('{not json', json.dumps({'type': 'sync'}), '[]'):
+                    await ws.send(control)
+                    assert json.loads(await ws.recv())['type'] == 'error'
+                audio = sing([440.0, 554.37])
+                for start in range(0, len(audio), 1600):
+                    await ws.send(audio[start:start + 1600].tobytes())
+                await ws.send(json.dumps({'type': 'end'}))
+                return [json.loads(m) async for m in ws]
+        finally:
+            server_task.cancel()
+
+    events = asyncio.run(session())
+    assert events[-1]['type'] == 'summary'
+    assert events[-1]['hits'] == 2
@@ -0,0 +1,74 @@
+import numpy as np
+from lyrics import InlineTranscriber, WhisperPool, align_words, speech_chunks, transcribe_lyrics
+
+SR = 16000
+
+
+class FakeWhisper:
+    """Two words per chunk, half a second in; detects French"""
+
+    def transcribe(self, audio, language=None, **kwargs):
+        assert kwargs['word_timestamps']
+        end = len(audio) / SR
+        return {'language': language or 'fr', 'segments': [{
+            'start': 0.0, 'end': end, 'text': ' la la',
+            'words': [{'word': ' la', 'start': 0.5, 'end': 0.8, 'probability': 0.9},
+                      {'word': ' la', 'start': 0.8, 'end': 1.0, 'probability': 0.9}],
+        }]}
+
+def fake_loader(name):
+    return FakeWhisper()
+
+def phrases(spans, seconds):
+    """Tones over the given (start, stop) seconds, silence elsewhere"""
+    y = np.zeros(int(seconds * SR), dtype=np.float32)
+    for start, stop in spans:
+        t = np.arange(int((stop - start) * SR)) / SR
+        y[int(start * SR):int(start * SR) + len(t)] = 0.3 * np.sin(2 * np.pi * 220 * t)
+    return y
+
+def test_speech_chunks_split_at_silences():
+    y = phrases([(1, 4), (4.5, 8), (15, 20)], 25)
+    chunks = [(start / SR, stop / SR) for start, stop in speech_chunks(y, SR)]
+    assert len(chunks) == 2
+    assert abs(chunks[0][0] - 1) < 0.1 and abs(chunks[0][1] - 8) < 0.1
+    assert abs(chunks[1][0] - 15) < 0.1 and abs(chunks[1][1] - 20) < 0.1
+
+def test_speech_chunks_cut_long_phrases():
+    y = phrases([(0, 70)], 70)
+    chunks = speech_chunks(y, SR, max_seconds=30)
+    assert len(chunks) == 3
+    assert all(stop - start <= 30 * SR for start, stop in chunks)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert speech_chunks(np.zeros(SR, dtype=np.float32), SR) == []
+
+def test_transcribe_lyrics_merges_chunks_in_song_time():
+    y = phrases([(1, 4), (15, 20)], 25)
+    progress = []
+    lyrics = transcribe_lyrics(y, SR, InlineTranscriber(FakeWhisper()), progress=progress.append)
+    assert lyrics['language'] == 'fr'
+    assert lyrics['text'] == 'la la la la'
+    assert [w['segment'] for w in lyrics['words']] == [0, 0, 1, 1]
+    starts = [w['start'] for w in lyrics['words']]
+    np.testing.assert_allclose(starts, [1.5, 1.8, 15.5, 15.8], atol=0.1)
+    assert progress[-1] == 1.0
+
+def test_whisper_pool():
+    """Chunks transcribed by worker processes come back in order"""
+    pool = WhisperPool('fake', workers=2, loader=fake_loader)
+    try:
+        y = phrases([(1, 4), (15, 20), (30, 33)], 35)
+        lyrics = transcribe_lyrics(y, SR, pool, language='en')
+    finally:
+        pool.close()
+    assert lyrics['language'] == 'en'
+    assert [round(s['start']) for s in lyrics['segments']] == [1, 15, 30]
+
+def test_align_words_snaps_to_onsets():
+    words = [{'word': w, 'start': s, 'end': s + 0.3} for w, s in
+             [('a', 1.0), ('b', 1.52), ('c', 3.0)]]
+    aligned = align_words(words, onsets=[0.9, 1.45, 1.5, 5.0])
+    assert [w['start'] for w in aligned] == [0.9, 1.5, 3.0]
+    assert [w['aligned'] for w in aligned] == [True, True, False]
+    assert align_words(words, onsets=[])[0]['start'] == 1.0
+    assert align_words([], onsets=[1.0]) == []
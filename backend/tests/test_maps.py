@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from chords import roman_numerals
+from maps import key_map, sounding_time, tempo_curve, tempo_map
+from notes import note_arrays, notes_to_score, score_notes
+from utils.music_scale import key_indices
+
+C_MAJOR = [60, 62, 64, 65, 67, 69, 71, 72]
+A_MAJOR = [57, 59, 61, 62, 64, 66, 68, 69]
+
+
+def modulating_notes(seconds=60.0, step=0.5):
+    """A C major scale for `seconds`, then an A major scale as long"""
+    events, t = [], 0.0
+    for scale in (C_MAJOR, A_MAJOR):
+        for i in range(int(seconds / step)):
+            events.append((t, t + step * 0.8, scale[i % len(scale)], 1.0, None))
+            t += step
+    return note_arrays(events)
+
+def test_sounding_time():
+    notes = note_arrays([(0.0, 1.0, 60, 1.0, None), (0.5, 2.0, 72, 1.0, None),
+                         (1.0, 1.5, 64, 1.0, None)])
+    total = sounding_time(notes, [0.0, 0.75, 3.0])
+    assert total[:, 0].tolist() == [0.0, 1.0, 2.5]
+    assert total[:, 4].tolist() == [0.0, 0.0, 0.5]
+    assert total[:, [1, 2, 3, 5, 6, 7, 8, 9, 10, 11]].sum() == 0
+
+def test_key_map_follows_a_modulation():
+    spans = key_map(modulating_notes())
+    assert [(s['key'], s['tonic'], s['mode']) for s in spans] == [
+        ('C', 'C', 'major'), ('A', 'A', 'major')]
+    assert spans[0]['start'] == 0 and spans[-1]['end'] == pytest.approx(119.9)
+    assert spans[1]['start'] == pytest.approx(60, abs=4)
+    assert key_map(note_arrays([])) == []
+
+def test_key_indices():
+    spans = [{'start': 0.0, 'key': 'C'}, {'start': 60.0, 'key': 'Am'}]
+    assert key_indices(spans, [0.0, 59.9, 60.0, 500.0]).tolist() == [0, 0, 21, 21]
+    assert key_indices('E', [1.0, 2.0]).tolist() == [4, 4]
+
+def test_degrees_and_numerals_in_the_key_of_their_time():
+    notes = note_arrays([(1.0, 1.5, 61, 1.0, None), (61.0, 61.5, 61, 1.0, None)])
+    spans = [{'start': 0.0, 'key': 'C'}, {'start': 60.0, 'key': 'A'}]
+    assert [n['degree'] for n in score_notes(notes, 120, spans)] == [0, 3]
+    chords = [{'start': 1.0, 'end': 2.0, 'chord': 'E'}, {'start': 61.0, 'end': 62.0, 'chord': 'E'}]
+    assert [c['roman'] for c in roman_numerals(chords, spans)] == ['III', 'V']
+
+def test_tempo_map_of_an_accelerando():
+    rng = np.random.default_rng(0)
+    intervals = np.concatenate([np.full(64, 0.5), np.linspace(0.5, 0.4, 64), np.full(64, 0.4)])
+    beats = np.cumsum(intervals + rng.normal(0, 0.005, len(intervals)))
+    spans = tempo_map(beats)
+    assert spans[0]['tempo'] == pytest.approx(120, rel=0.01)
+    assert spans[-1]['tempo'] == pytest.approx(150, rel=0.02)
+    assert spans[0]['start'] == pytest.approx(beats[0], abs=1e-3)
+    assert spans[-1]['end'] == pytest.approx(beats[-1], abs=1e-3)
+    assert all(a['end'] == b['start'] for a, b in zip(spans, spans[1:]))
+
+    steady = tempo_map(np.arange(1, 60, 0.5) + rng.normal(0, 0.005, 118))
+    assert len(steady) == 1 and steady[0]['tempo'] == pytest.approx(120, rel=0.01)
+    assert tempo_map([1.0]) == []
+
+def test_tempo_curve_without_onsets():
+    assert tempo_curve(np.zeros(10), 22050, 100).tolist() == [100.0] * 10
+
+def test_notes_to_score_with_maps():
+    notes = modulating_notes(seconds=16.0)
+    keys = [{'start': 0.0, 'key': 'C', 'tonic': 'C', 'mode': 'major'},
+            {'start': 15.9, 'key': 'A', 'tonic': 'A', 'mode': 'major'}]
+    tempi = [{'start': 0.0, 'tempo': 120.0}, {'start': 8.1, 'tempo': 132.0}]
+    score = notes_to_score(notes, 120, key_map=keys, tempo_map=tempi).flatten()
+    assert [(k.offset, k.tonic.name) for k in score.getElementsByClass('Key')] == [
+        (0.0, 'C'), (32.0, 'A')]
+    assert [(m.offset, m.number) for m in score.getElementsByClass('MetronomeMark')] == [
+        (0.0, 120.0), (16.0, 132.0)]
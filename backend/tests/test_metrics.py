@@ -0,0 +1,80 @@
+import threading
+import time
+import pytest
+import metrics
+from metrics import Counter, Histogram, Registry, StackSampler, collect, replay, span
+
+
+def stage_registry():
+    registry = Registry()
+    registry.add(Histogram('stage_seconds', 'Test', ('stage', 'cache')))
+    registry.add(Histogram('stage_input_bytes', 'Test', ('stage',)))
+    registry.add(Counter('stage_errors_total', 'Test', ('stage',)))
+    return registry
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Empty process-wide registry for the spans of a test"""
+    registry = stage_registry()
+    monkeypatch.setattr(metrics, 'REGISTRY', registry)
+    return registry
+
+def test_histogram_exposition():
+    registry = Registry()
+    histogram = registry.add(Histogram('test_seconds', 'Test', ('stage',), buckets=(0.1, 1)))
+    histogram.observe(0.05, stage='a')
+    histogram.observe(0.5, stage='a')
+    histogram.observe(5, stage='a')
+    text = registry.render()
+    assert '# TYPE songflowy_test_seconds histogram' in text
+    assert 'songflowy_test_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'songflowy_test_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'songflowy_test_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'songflowy_test_seconds_sum{stage="a"} 5.55' in text
+    assert 'songflowy_test_seconds_count{stage="a"} 3' in text
+
+def test_counter_escapes_labels():
+    registry = Registry()
+    registry.add(Counter('test_total', 'Test', ('path',))).inc(path='a"b')
+    assert 'songflowy_test_total{path="a\\"b"} 1' in registry.render()
+
+def test_span_records_cache_size_and_errors(registry):
+    with span('decode', size=1000) as s:
+        s.cache = 'miss'
+    with pytest.raises(ValueError):
+        with span('decode'):
+            raise ValueError
+    text = registry.render()
+    assert 'songflowy_stage_seconds_count{stage="decode",cache="miss"} 1' in text
+    assert 'songflowy_stage_seconds_count{stage="decode",cache="none"} 1' in text
+    assert 'songflowy_stage_input_bytes_count{stage="decode"} 1' in text
+    assert 'songflowy_stage_errors_total{stage="decode"} 1' in text
+
+def test_collect_and_replay(registry):
+    """Spans gathered in one registry (a job worker) replay into another"""
+    with collect() as outer:
+        with collect() as spans:
+            with span('midi') as s:
+                s.cache = 'hit'
+        with span('encode'):
+            pass
+    assert [record[0] for record in spans] == ['midi']
+    assert [record[0] for record in outer] == ['midi', 'encode']
+    assert metrics.server_timing(spans).startswith('midi;dur=')
+
+    server = stage_registry()
+    replay(spans, registry=server)
+    assert 'songflowy_stage_seconds_count{stage="midi",cache="hit"} 1' in server.render()
+
+def test_stack_sampler():
+    def busy_wait():
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            pass
+
+    thread = threading.Thread(target=busy_wait)
+    thread.start()
+    sampler = StackSampler(thread.ident, interval=0.002).start()
+    thread.join()
+    sampler.stop()
+    assert 'busy_wait (test_metrics.py)' in sampler.collapsed()
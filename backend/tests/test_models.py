@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from models import ModelRegistry
+
+
+@pytest.fixture
+def registry():
+    """Registry with two fake models of 10 MB each and a 15 MB budget"""
+    registry = ModelRegistry(memory_budget_mb=15)
+    registry.register('a', lambda scale=1: {'model': 'a', 'scale': scale}, size_mb=10)
+    registry.register('b', lambda: {'model': 'b'}, size_mb=10)
+    return registry
+
+def test_model_is_loaded_once(registry):
+    """Repeated lookups return the same instance and count as hits"""
+    first = registry.get('a')
+    assert registry.get('a') is first
+
+    stats = registry.stats()['models']['a']
+    assert stats['loads'] == 1
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+def test_loader_params_are_part_of_the_key(registry):
+    """Models loaded with different parameters are cached separately"""
+    assert registry.get('a', scale=2)['scale'] == 2
+    assert registry.get('a')['scale'] == 1
+    assert registry.stats()['models']['a']['loads'] == 2
+
+def test_lru_eviction_over_budget(registry):
+    """Loading past the memory budget evicts the least recently used model"""
+    registry.get('a')
+    registry.get('b')
+
+    stats = registry.stats()
+    assert stats['memory_usage_mb'] == 10
+    assert stats['models']['a']['evictions'] == 1
+    assert stats['models']['a']['loaded'] == []
+    assert len(stats['models']['b']['loaded']) == 1
+
+def test_evicted_models_are_closed():
+    """Models holding workers are closed when evicted, not when collected"""
+    class Pool:
+        closed = 0
+
+        def close(self):
+            Pool.closed += 1
+
+    registry = ModelRegistry(memory_budget_mb=15)
+    registry.register('pool', Pool, size_mb=10)
+    registry.register('b', lambda: {'model': 'b'}, size_mb=10)
+    registry.get('pool')
+    registry.get('b')
+    assert Pool.closed == 1
+    registry.get('pool')
+    registry.clear()
+    assert Pool.closed == 2
+
+def test_unknown_model(registry):
+    with pytest.raises(KeyError):
+        registry.get('missing')
+
+def test_concurrent_requests_share_one_load():
+    """Threads asking for a model that is still loading wait for that load"""
+    registry = ModelRegistry()
+
+    def slow_loader():
+        time.sleep(0.1)
+        return object()
+
+    registry.register('slow', slow_loader, size_mb=1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('slow')))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(m) for m in results}) == 1
+    assert registry.stats()['models']['slow']['loads'] == 1
+
+def test_warm_up(registry):
+    registry.warm_up(['b', ''])
+    assert registry.stats()['models']['b']['loads'] == 1
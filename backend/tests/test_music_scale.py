@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from utils.color_scale import NOTE_RGB, get_note_colors, note_colors, note_hex
+from utils.music_scale import (KEY_MASKS, KEY_NAMES, all_keys, get_key_scale, in_scale,
+                               keys_containing, pitch_class_mask, scale_degrees)
+
+
+def test_key_scales():
+    assert get_key_scale('C') == ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+    assert get_key_scale('b') == ['b', 'C', 'D', 'e', 'F', 'G', 'A']
+    assert get_key_scale('gm') == ['g', 'a', 'A', 'B', 'd', 'D', 'E']
+    assert sorted(all_keys) == sorted(KEY_NAMES)
+
+def test_key_masks_have_seven_pitch_classes():
+    assert [bin(m).count('1') for m in KEY_MASKS] == [7] * 24
+    assert KEY_MASKS[KEY_NAMES.index('C')] == KEY_MASKS[KEY_NAMES.index('Am')]
+
+def test_pitch_class_masks():
+    assert pitch_class_mask([60, 72, 64]) == 0b10001
+    assert pitch_class_mask([]) == 0
+    assert keys_containing([60, 64, 67, 71]) == ['C', 'G', 'Em', 'Am']
+    assert keys_containing(range(12)) == []
+
+def test_scale_degrees_of_note_arrays():
+    pitch = np.array([57, 59, 60, 61, 62, 64, 65, 67, 81])
+    assert scale_degrees(pitch, 'Am').tolist() == [1, 2, 3, 0, 4, 5, 6, 7, 1]
+    assert in_scale(pitch, 'C').tolist() == [True, True, True, False, True, True, True, True, True]
+
+def test_note_colors():
+    assert note_hex([60, 67, 70]).tolist() == ['#0000FF', '#FF0000', '#FF00FF']
+    assert note_colors([48, 60]).tolist() == [[0, 0, 255], [0, 0, 255]]
+    assert dict(get_note_colors())['g'] == (255, 128, 0)
+    assert NOTE_RGB.shape == (12, 3)
+
+def test_rgb_to_wavelength_batched():
+    pytest.importorskip('colour')
+    from utils.color_scale import rgb_to_wavelength
+    rgb = NOTE_RGB.astype(int)
+    batched = rgb_to_wavelength(rgb[:, 0], rgb[:, 1], rgb[:, 2])
+    assert batched.shape == (12,)
+    assert batched[7] == rgb_to_wavelength(255, 0, 0)
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+import music21
+from notes import (beat_positions, estimate_key, estimate_meter, key_name, load_note_arrays,
+                   midi_note_arrays, note_arrays, note_columns, note_names, notes_to_score,
+                   quantize_notes, save_note_arrays, score_notes)
+
+
+def scale_notes(tonic_midi, intervals, beats=1.0, tempo=120, amplitudes=None):
+    """One note per interval, each `beats` long"""
+    seconds = beats * 60 / tempo
+    return note_arrays([
+        (i * seconds, (i + 1) * seconds, tonic_midi + step,
+         1.0 if amplitudes is None else amplitudes[i % len(amplitudes)], None)
+        for i, step in enumerate(intervals)
+    ])
+
+MAJOR = [0, 2, 4, 5, 7, 9, 11, 12, 7, 4, 0, 7, 0]
+MINOR = [0, 2, 3, 5, 7, 8, 10, 12, 7, 3, 0, 7, 0]
+
+@pytest.mark.parametrize('tonic_midi,intervals,tonic,mode', [
+    (60, MAJOR, 'C', 'major'),
+    (70, MAJOR, 'B-', 'major'),
+    (66, MAJOR, 'F#', 'major'),
+    (57, MINOR, 'A', 'minor'),
+    (61, MINOR, 'C#', 'minor'),
+])
+def test_estimate_key(tonic_midi, intervals, tonic, mode):
+    assert estimate_key(scale_notes(tonic_midi, intervals))[:2] == (tonic, mode)
+
+def test_estimate_key_without_notes():
+    assert estimate_key(note_arrays([]))[:2] == ('C', 'major')
+
+def test_estimate_meter():
+    waltz = scale_notes(60, [0, 4, 7] * 8, amplitudes=[1.0, 0.3, 0.3])
+    march = scale_notes(60, [0, 4, 7, 4] * 6, amplitudes=[1.0, 0.3, 0.6, 0.3])
+    assert estimate_meter(waltz, 120) == (3, 4)
+    assert estimate_meter(march, 120) == (4, 4)
+
+def test_quantize_notes_tuplets_and_dotted_values():
+    start, duration = quantize_notes([0.02, 1.0, 1.34, 1.66, 2.0, 2.26, 3.0],
+                                     [1.49, 1.3, 1.64, 2.0, 2.24, 2.5, 4.55])
+    assert start.tolist() == pytest.approx([0, 1, 4 / 3, 5 / 3, 2, 2.25, 3])
+    assert duration.tolist() == pytest.approx([1.5, 1 / 3, 1 / 3, 1 / 3, 0.25, 0.25, 1.5])
+
+def test_quantize_notes_one_grid_per_beat():
+    """Onsets of a beat share a subdivision; triplet values need the triplet grid"""
+    start, duration = quantize_notes([0.0, 0.3, 0.5, 0.75], [0.3, 0.5, 0.75, 1.0])
+    assert start.tolist() == [0.0, 0.25, 0.5, 0.75]
+    assert 1 / 3 not in duration.tolist()
+    assert quantize_notes([], [])[0].size == 0
+
+def test_beat_positions_follow_the_beat_track():
+    """Tracked beats land on whole beats even when the tempo drifts"""
+    beat_times = [0.5, 1.0, 1.6, 2.1]
+    assert beat_positions(beat_times, beat_times, 120).tolist() == [1, 2, 3, 4]
+    assert beat_positions([1.3, 0.25, 2.35], beat_times, 120).tolist() == pytest.approx([2.5, 0.5, 4.5])
+    assert beat_positions([1.0], None, 90).tolist() == [1.5]
+
+def test_score_notes_on_the_beat_track():
+    notes = note_arrays([(0.52, 0.98, 60, 1.0, None), (1.61, 2.1, 62, 1.0, None)])
+    beats = score_notes(notes, 120, beat_times=[0.5, 1.0, 1.6, 2.1])
+    assert [(n['start'], n['duration']) for n in beats] == [(1.0, 1.0), (3.0, 1.0)]
+
+def test_note_columns_keep_sharps():
+    """Binary columns carry the MIDI pitch, which the note names round down"""
+    from encoding import ARRAYS, decode_arrays, encode
+    notes = scale_notes(61, [0, 2, 5], beats=0.5, tempo=100)
+    columns = decode_arrays(encode(note_columns(notes, 100, 'd'), ARRAYS))
+    assert columns['notes_midi'].tolist() == [61, 63, 66]
+    assert [n['noteName'] for n in score_notes(notes, 100)] == ['C4', 'E4', 'F4']
+    dicts = score_notes(notes, 100, 'd')
+    np.testing.assert_array_equal(columns['notes_start'], [n['start'] for n in dicts])
+    np.testing.assert_array_equal(columns['notes_duration'], [n['duration'] for n in dicts])
+    assert columns['notes_degree'].tolist() == [n['degree'] for n in dicts]
+
+def test_notes_to_score():
+    notes = scale_notes(62, MAJOR)
+    score = notes_to_score(notes, 120, 'D', 'major', (3, 4))
+    assert [n.pitch.midi for n in score.flatten().notes] == notes['pitch'].tolist()
+    assert score.flatten().getElementsByClass('TimeSignature')[0].ratioString == '3/4'
+    assert score.flatten().getElementsByClass('Key')[0].tonic.name == 'D'
+
+    chord = note_arrays([(0.0, 0.5, 60, 1.0, None), (0.0, 0.5, 64, 1.0, None)])
+    assert [[p.midi for p in c.pitches] for c in notes_to_score(chord, 120).flatten().notes] == [
+        [60, 64]]
+
+def test_note_names_match_music21_steps():
+    midi = np.arange(48, 72)
+    expected = [f"{music21.pitch.Pitch(midi=int(m)).step}{music21.pitch.Pitch(midi=int(m)).octave}"
+                for m in midi]
+    assert note_names(midi).tolist() == expected
+
+def test_score_notes():
+    notes = scale_notes(69, [0, 3, 7], beats=0.5, tempo=100)
+    assert score_notes(notes, 100) == [
+        {'noteName': 'A4', 'start': 0.0, 'duration': 0.5},
+        {'noteName': 'C5', 'start': 0.5, 'duration': 0.5},
+        {'noteName': 'E5', 'start': 1.0, 'duration': 0.5},
+    ]
+
+def test_score_notes_degrees_and_colors():
+    notes = scale_notes(69, [0, 2, 3, 4])
+    key = key_name(*estimate_key(scale_notes(57, MINOR))[:2])
+    assert key == 'Am'
+    assert [(n['degree'], n['color']) for n in score_notes(notes, 120, key)] == [
+        (1, '#FF0080'), (2, '#8000FF'), (3, '#0000FF'), (0, '#0084FF')]
+
+def test_note_arrays_roundtrip(tmp_path):
+    notes = scale_notes(60, MAJOR)
+    save_note_arrays(tmp_path / 'notes.npz', notes)
+    loaded = load_note_arrays(tmp_path / 'notes.npz')
+    for k in notes:
+        np.testing.assert_array_equal(loaded[k], notes[k])
+
+def test_midi_note_arrays(tmp_path):
+    """Notes read back from a MIDI file give the same summary"""
+    import pretty_midi
+    notes = scale_notes(62, MAJOR)
+    midi = pretty_midi.PrettyMIDI(initial_tempo=120)
+    instrument = pretty_midi.Instrument(0)
+    instrument.notes = [pretty_midi.Note(100, int(p), float(s), float(e))
+                        for s, e, p in zip(notes['start'], notes['end'], notes['pitch'])]
+    midi.instruments.append(instrument)
+    midi.write(str(tmp_path / 'notes.mid'))
+
+    loaded = midi_note_arrays(tmp_path / 'notes.mid')
+    assert loaded['pitch'].tolist() == notes['pitch'].tolist()
+    assert score_notes(loaded, 120) == score_notes(notes, 120)
+    assert estimate_key(loaded)[:2] == ('D', 'major')
@@ -0,0 +1,85 @@
+import numpy as np
+import librosa
+import pytest
+from notes import note_arrays
+from performance import (band_starts, banded_dtw, decimate, frame_costs, melody_notes,
+                         score_performance)
+from pitch import analyze_contour
+
+SR = 22050
+FPS = SR / 512
+
+
+def sing(pitches, durations, cents=0.0, rate=1.0, lead=0.0, skip=()):
+    """Harmonic tones of a melody, and its notes; `skip` notes are left silent"""
+    blocks, events, t0 = [np.zeros(int(lead * SR), np.float32)], [], lead
+    for k, (pitch, duration) in enumerate(zip(pitches, durations)):
+        duration *= rate
+        t = np.arange(int(duration * SR)) / SR
+        f = 440 * 2 ** ((pitch + cents / 100 - 69) / 12)
+        envelope = np.clip(np.minimum(t, duration * 0.85 - t) / 0.02, 0, 1)
+        tone = sum(np.sin(2 * np.pi * f * h * t) / h for h in (1, 2, 3)) * envelope
+        blocks.append(0.3 * tone * (k not in skip))
+        events.append((t0, t0 + duration * 0.85, pitch, 1.0, None))
+        t0 += duration
+    return np.concatenate(blocks).astype(np.float32), note_arrays(events)
+
+def full_dtw_cost(x, y):
+    """Cost of the optimal path, from librosa's unconstrained DTW"""
+    costs = frame_costs(x, y, np.zeros(len(x), np.int64), len(y))[:, :len(y)]
+    return librosa.sequence.dtw(C=costs)[0][-1, -1], costs
+
+@pytest.mark.parametrize('m', [240, 300, 370])
+def test_banded_dtw_is_optimal_within_its_band(m):
+    rng = np.random.default_rng(m)
+    x = rng.integers(55, 70, 300).astype(np.float32)
+    x[rng.random(300) < 0.2] = np.nan
+    y = x[np.round(np.linspace(0, 299, m)).astype(int)] + rng.normal(0, 0.3, m).astype(np.float32)
+    expected, costs = full_dtw_cost(x, y)
+    for width in (len(y), 40):
+        path = banded_dtw(x, y, width)
+        assert path[0].tolist() == [0, 0] and path[-1].tolist() == [len(x) - 1, len(y) - 1]
+        assert (np.diff(path, axis=0) >= 0).all() and (np.diff(path, axis=0).sum(axis=1) >= 1).all()
+        assert costs[path[:, 0], path[:, 1]].sum() == pytest.approx(expected, rel=1e-5)
+
+def test_band_starts_end_on_the_last_column():
+    starts = band_starts(100, 150, 10)
+    assert starts[0] == 0 and starts[-1] + 20 == 149
+    assert (np.diff(starts) >= 0).all()
+
+def test_decimate_keeps_voiced_frames():
+    pitch = np.array([60, 61, np.nan, 62, np.nan, np.nan, 63], np.float32)
+    np.testing.assert_array_equal(decimate(pitch), [60, 62, np.nan])
+
+def test_melody_notes_leave_out_harmonics():
+    notes = note_arrays([(0.0, 1.0, 60, 1.0, None), (0.0, 1.0, 79, 0.5, None),
+                         (1.0, 2.0, 74, 1.0, None), (2.0, 3.0, 64, 1.0, None)])
+    pitch = np.repeat(np.array([60, 62, np.nan], np.float32), FPS)
+    assert melody_notes(notes, pitch, FPS)['pitch'].tolist() == [60, 74]
+
+def test_score_a_late_slow_take_an_octave_below():
+    rng = np.random.default_rng(0)
+    pitches, durations = rng.integers(60, 76, 60), rng.choice([0.25, 0.5, 0.75], 60)
+    reference, notes = sing(pitches, durations)
+    take, _ = sing(pitches - 12, durations, cents=20, rate=1.03, lead=0.5, skip={30, 31})
+    result = score_performance(analyze_contour(take, SR), analyze_contour(reference, SR),
+                               notes, FPS)
+
+    assert result['offset'] == pytest.approx(0.5, abs=0.05)
+    assert result['tempo_ratio'] == pytest.approx(1.03, abs=0.005)
+    sung = [n for n in result['notes'] if n['sung']]
+    assert not result['notes'][30]['sung'] and not result['notes'][31]['sung']
+    assert len(sung) >= 56
+    assert np.median([n['pitch_error'] for n in sung]) == pytest.approx(20, abs=5)
+    assert np.percentile([abs(n['timing_error']) for n in sung], 90) < 0.06
+    assert result['pitch_accuracy'] > 0.9 and result['timing_accuracy'] > 0.9
+
+    perfect = score_performance(analyze_contour(reference, SR), analyze_contour(reference, SR),
+                                notes, FPS)
+    assert perfect['score'] > result['score'] > 50
+    assert perfect['offset'] == pytest.approx(0, abs=0.03)
+
+def test_score_without_notes_or_audio():
+    contour = analyze_contour(np.zeros(SR, np.float32), SR)
+    result = score_performance(contour, contour, note_arrays([]), FPS)
+    assert result['score'] == 0 and result['notes'] == []
@@ -0,0 +1,86 @@
+import numpy as np
+import librosa
+import pytest
+import soundfile as sf
+from pitch import (analyze_contour, hz_to_midi, midi_to_note_names, pitch_contour,
+                   stream_analysis)
+
+
+@pytest.fixture(scope="module")
+def melody():
+    """A4, C#5 and E5 for half a second each, then silence"""
+    sr = 22050
+    t = np.arange(sr // 2) / sr
+    y = np.concatenate([0.5 * np.sin(2 * np.pi * f * t) for f in (440.0, 554.37, 659.25)]
+                       + [np.zeros(sr // 2)])
+    return y.astype(np.float32), sr
+
+def test_hz_to_midi():
+    midi = hz_to_midi([440.0, 261.63, 0.0])
+    assert midi[0] == pytest.approx(69)
+    assert midi[1] == pytest.approx(60, abs=0.01)
+    assert np.isnan(midi[2])
+
+def test_note_names_match_librosa():
+    midi = np.array([21, 60, 69, 80])
+    assert midi_to_note_names(midi).tolist() == [librosa.midi_to_note(m) for m in midi]
+
+def test_contour_matches_frame_loop(melody):
+    """The vectorized contour agrees with picking the peak frame by frame"""
+    y, sr = melody
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
+    contour = pitch_contour(pitches, magnitudes, sr)
+
+    expected = []
+    for i in range(pitches.shape[1]):
+        pitch = pitches[magnitudes[:, i].argmax(), i]
+        if pitch > 0:
+            expected.append(librosa.hz_to_note(pitch))
+    assert midi_to_note_names(contour['midi'][contour['voiced']]).tolist() == expected
+
+def test_contour_arrays(melody):
+    y, sr = melody
+    contour = analyze_contour(y, sr)
+    n = len(contour['times'])
+    assert all(len(a) == n for a in contour.values())
+    assert contour['midi'].dtype == np.int16
+    assert contour['cents'].dtype == np.int16
+    assert contour['times'].dtype == np.float32
+
+    voiced = contour['voiced']
+    assert not voiced[contour['times'] > 1.6].any()
+    assert np.all(np.abs(contour['cents'][voiced]) <= 50)
+    assert np.all(contour['midi'][~voiced] == -1)
+    assert set(contour['midi'][voiced]) >= {69, 73, 76}
+
+@pytest.fixture(scope="module")
+def beats_file(tmp_path_factory):
+    """Twelve seconds of notes on every beat at 120 BPM"""
+    sr = 22050
+    t = np.arange(int(0.45 * sr)) / sr
+    beat = np.zeros(sr // 2)
+    y = np.concatenate([
+        np.concatenate([0.5 * np.sin(2 * np.pi * 440 * 2 ** ((i % 3) * 4 / 12) * t),
+                        beat[len(t):]])
+        for i in range(24)])
+    path = tmp_path_factory.mktemp('stream') / 'beats.wav'
+    sf.write(path, y, sr)
+    return path, len(y), sr
+
+def test_stream_analysis(beats_file):
+    """Blocks cover the whole file with onsets on the beats"""
+    path, n_samples, sr = beats_file
+    blocks = list(stream_analysis(path, block_frames=64))
+    assert len(blocks) > 2
+
+    times = np.concatenate([b['times'] for b in blocks[:-1]])
+    assert np.all(np.diff(times) > 0)
+    assert times[-1] == pytest.approx(n_samples / sr, abs=0.1)
+
+    midi = np.concatenate([b['midi'][b['voiced']] for b in blocks[:-1]])
+    assert set(midi) >= {69, 73, 77}
+
+    onsets = np.concatenate([b['onsets'] for b in blocks])
+    assert 20 <= len(onsets) <= 24
+    assert np.all(np.abs(onsets - np.round(onsets * 2) / 2) < 0.1)
+    assert blocks[-1]['song_tempo'] == pytest.approx(120, rel=0.05)
@@ -0,0 +1,65 @@
+import hashlib
+import io
+import os
+import pytest
+from resumable import IncompleteUpload, OffsetMismatch, UploadNotFound, UploadStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(tmp_path)
+
+DATA = os.urandom(3 * 1024 + 17)
+
+def test_chunked_upload(store, tmp_path):
+    upload_id = store.create('song.wav', len(DATA))
+    assert store.append(upload_id, 0, io.BytesIO(DATA[:1024])) == 1024
+    assert store.status(upload_id)['offset'] == 1024
+    assert store.append(upload_id, 1024, io.BytesIO(DATA[1024:])) == len(DATA)
+
+    content_hash = store.finalize(upload_id, tmp_path / 'song.wav')
+    assert content_hash == hashlib.sha256(DATA).hexdigest()
+    assert (tmp_path / 'song.wav').read_bytes() == DATA
+    with pytest.raises(UploadNotFound):
+        store.status(upload_id)
+
+def test_offset_mismatch(store):
+    """A retried chunk is rejected instead of being written twice"""
+    upload_id = store.create('song.wav', len(DATA))
+    store.append(upload_id, 0, io.BytesIO(DATA[:1024]))
+    with pytest.raises(OffsetMismatch) as e:
+        store.append(upload_id, 0, io.BytesIO(DATA[:1024]))
+    assert e.value.expected == 1024
+
+def test_body_beyond_length_is_ignored(store):
+    upload_id = store.create('song.wav', 10)
+    assert store.append(upload_id, 0, io.BytesIO(DATA[:20])) == 10
+
+def test_resume_after_restart(store, tmp_path):
+    """A new process rehashes the bytes already received"""
+    upload_id = store.create('song.wav', len(DATA))
+    store.append(upload_id, 0, io.BytesIO(DATA[:2000]))
+
+    restarted = UploadStore(tmp_path)
+    offset = restarted.status(upload_id)['offset']
+    restarted.append(upload_id, offset, io.BytesIO(DATA[offset:]))
+    assert restarted.finalize(upload_id, tmp_path / 'song.wav') == hashlib.sha256(DATA).hexdigest()
+
+def test_incomplete_upload(store, tmp_path):
+    upload_id = store.create('song.wav', len(DATA))
+    store.append(upload_id, 0, io.BytesIO(DATA[:100]))
+    with pytest.raises(IncompleteUpload):
+        store.finalize(upload_id, tmp_path / 'song.wav')
+
+def test_unknown_and_invalid_ids(store):
+    with pytest.raises(UploadNotFound):
+        store.status('0' * 32)
+    with pytest.raises(UploadNotFound):
+        store.status('../jobs')
+
+def test_expire(store):
+    upload_id = store.create('song.wav', len(DATA))
+    os.utime(store.partial / f'{upload_id}.part', (0, 0))
+    store.expire()
+    with pytest.raises(UploadNotFound):
+        store.status(upload_id)
@@ -0,0 +1,147 @@
+from pathlib import Path
+import numpy as np
+import pytest
+import soundfile as sf
+from separation import (ChunkedSeparator, MixReader, hann_window, istft, normalize_gain,
+                        stft)
+
+onnx = pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+N_FFT, DIM_F, DIM_T, HOP = 256, 64, 16, 64
+SR = 8000
+
+
+@pytest.fixture
+def model(tmp_path):
+    """Tiny stand-in for an MDX-Net model: halves the spectrogram"""
+    from onnx import TensorProto, helper
+    x = helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch', 4, DIM_F, DIM_T])
+    y = helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch', 4, DIM_F, DIM_T])
+    half = helper.make_tensor('half', TensorProto.FLOAT, [], [0.5])
+    graph = helper.make_graph([helper.make_node('Mul', ['input', 'half'], ['output'])],
+                              'half', [x], [y], [half])
+    path = tmp_path / 'half.onnx'
+    onnx.save(helper.make_model(graph, ir_version=8, opset_imports=[helper.make_opsetid('', 13)]),
+              str(path))
+    return path
+
+
+@pytest.fixture
+def song(tmp_path):
+    t = np.arange(int(SR * 1.3)) / SR
+    audio = np.stack([np.sin(2 * np.pi * 220 * t), 0.5 * np.sin(2 * np.pi * 330 * t)], axis=1)
+    path = tmp_path / 'song.wav'
+    sf.write(str(path), 1.5 * audio, SR, subtype='FLOAT')
+    return path
+
+
+def separator(model, **kwargs):
+    return ChunkedSeparator(model, N_FFT, DIM_F, DIM_T, compensate=1.0, hop_length=HOP,
+                            sr=SR, **kwargs)
+
+
+def whole_song_instrumental(sep, path):
+    """The instrumental as audio-separator computes it, with the whole song in memory"""
+    mix, _ = sf.read(str(path), dtype='float32', always_2d=True)
+    mix = mix.T * normalize_gain(np.abs(mix).max())
+    n = mix.shape[1]
+    pad = sep.gen_size + sep.trim - n % sep.gen_size
+    mixture = np.pad(mix, ((0, 0), (sep.trim, pad)))
+    step = int((1 - sep.overlap) * sep.chunk_size)
+    result = np.zeros_like(mixture)
+    divider = np.zeros_like(mixture)
+    for start in range(0, mixture.shape[1], step):
+        segment = mixture[:, start:start + sep.chunk_size]
+        size = segment.shape[1]
+        segment = np.pad(segment, ((0, 0), (0, sep.chunk_size - size)))
+        window = np.hanning(size)
+        result[:, start:start + size] += sep.run_model(segment[None])[0][:, :size] * window
+        divider[:, start:start + size] += window
+    divider[divider == 0] = 1
+    return mix, (result / divider)[:, sep.trim:sep.trim + n]
+
+
+def test_stft_round_trip():
+    x = np.random.default_rng(0).standard_normal((2, 2, 2000)).astype(np.float32)
+    window = hann_window(N_FFT)
+    spec = stft(x, N_FFT, HOP, window)
+    assert spec.shape == (2, 2, N_FFT // 2 + 1, 2000 // HOP + 1)
+    np.testing.assert_allclose(istft(spec, N_FFT, HOP, window, 2000), x, atol=1e-5)
+
+
+def test_mix_reader_pads_and_normalizes(song):
+    reader = MixReader(song, lead=10, sr=SR)
+    try:
+        audio, _ = sf.read(str(song), dtype='float32', always_2d=True)
+        block = reader.read(0, 30)
+        assert not block[:, :10].any()
+        np.testing.assert_allclose(block[:, 10:], audio[:20].T * 0.9 / 1.5, atol=1e-6)
+        assert not reader.read(reader.length + 10, reader.length + 20).any()
+    finally:
+        reader.close()
+
+
+def test_mix_reader_resamples_block_by_block(tmp_path):
+    """Songs at another rate read as librosa would decode them whole"""
+    import librosa
+    t = np.arange(int(11025 * 1.3)) / 11025
+    path = tmp_path / 'song.wav'
+    sf.write(str(path), 0.5 * np.sin(2 * np.pi * 220 * t), 11025)
+    reader = MixReader(path, lead=0, sr=SR, block_size=1000)
+    try:
+        expected, _ = librosa.load(str(path), sr=SR, mono=False)
+        assert reader.length == len(expected)
+        np.testing.assert_allclose(reader.read(0, reader.length),
+                                   np.stack([expected, expected]) * 0.6 / np.abs(expected).max(),
+                                   atol=1e-5)
+    finally:
+        reader.close()
+    assert not reader.resampled
+
+
+@pytest.mark.parametrize('workers,batch_size', [(1, 1), (3, 2)])
+def test_chunked_matches_whole_song(model, song, tmp_path, workers, batch_size):
+    """Streaming in segments gives the stems of separating the whole song at once"""
+    sep = separator(model, workers=workers, batch_size=batch_size)
+    fractions = []
+    instrumental, vocal = sep.separate(song, tmp_path / 'inst.wav', tmp_path / 'vocal.wav',
+                                       progress=fractions.append)
+
+    mix, expected = whole_song_instrumental(sep, song)
+    for path, stem in ((instrumental, expected), (vocal, mix - expected)):
+        written, sr = sf.read(path, dtype='float32', always_2d=True)
+        assert sr == SR and sf.info(path).subtype == 'PCM_16'
+        np.testing.assert_allclose(written.T, stem * normalize_gain(np.abs(stem).max()),
+                                   atol=2e-4)
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
+    assert not list(tmp_path.glob('.*.raw.wav'))
+
+
+def test_separate_task_streams_writable_formats(model, tmp_path, monkeypatch):
+    """Songs soundfile can write are separated in chunks, once enabled, into cached stems"""
+    import app
+    import separation
+    from models import ModelRegistry
+    monkeypatch.setitem(separation.MDX_MODELS, model.name,
+                        {'n_fft': N_FFT, 'dim_f': DIM_F, 'dim_t': DIM_T, 'compensate': 1.0})
+    monkeypatch.setattr(app, 'SEPARATOR_MODEL', model.name)
+    monkeypatch.setattr(app, 'SEPARATOR_MODEL_DIR', str(model.parent))
+    registry = ModelRegistry()
+    registry.register('chunked-separator', app.load_chunked_separator)
+    monkeypatch.setattr(app, 'model_registry', registry)
+
+    t = np.arange(separation.SAMPLE_RATE // 2) / separation.SAMPLE_RATE
+    path = app.UPLOAD_FOLDER / f'separate_{np.random.default_rng().integers(1 << 30)}.flac'
+    sf.write(str(path), np.sin(2 * np.pi * 440 * t), separation.SAMPLE_RATE)
+    try:
+        assert app.separation_method(path) == 'full'
+        monkeypatch.setattr(app, 'SEPARATOR_CHUNKED', True)
+        assert app.separation_method(path) == 'chunked'
+        result = app.separate_task(path)
+        for stem in ('vocal', 'instrumental'):
+            audio, sr = sf.read(result[stem], always_2d=True)
+            assert sr == separation.SAMPLE_RATE and audio.shape == (len(t), 2)
+    finally:
+        for p in [path, *app.separation_paths(path)]:
+            Path(p).unlink(missing_ok=True)
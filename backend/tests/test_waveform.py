@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import soundfile as sf
+import waveform
+from cache import AnalysisCache
+from waveform import load_waveform
+
+
+@pytest.fixture
+def song(tmp_path):
+    """One second of A4 at 44.1 kHz"""
+    sr = 44100
+    t = np.arange(sr) / sr
+    path = tmp_path / 'song.wav'
+    sf.write(path, 0.5 * np.sin(2 * np.pi * 440 * t), sr)
+    return path
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnalysisCache(tmp_path / 'cache')
+
+@pytest.fixture
+def decode_calls(monkeypatch):
+    """Count how often the codec is used"""
+    calls = []
+    decode = waveform.decode
+    monkeypatch.setattr(waveform, 'decode', lambda *a, **kw: calls.append(a) or decode(*a, **kw))
+    return calls
+
+def test_native_rate(song, cache):
+    y, sr = load_waveform(song, cache)
+    assert sr == 44100
+    assert y.dtype == np.float32
+    assert len(y) == 44100
+    assert isinstance(y, np.memmap)
+
+def test_decoded_once_per_song(song, cache, decode_calls):
+    """All sample rates and repeated loads reuse a single decode"""
+    y, sr = load_waveform(song, cache, sr=22050)
+    assert sr == 22050
+    assert len(y) == 22050
+    load_waveform(song, cache, sr=22050)
+    load_waveform(song, cache, sr=16000)
+    load_waveform(song, cache)
+    assert len(decode_calls) == 1
+
+def test_same_content_under_another_name(song, cache, decode_calls, tmp_path):
+    copy = tmp_path / 'copy.wav'
+    copy.write_bytes(song.read_bytes())
+    load_waveform(song, cache)
+    load_waveform(copy, cache)
+    assert len(decode_calls) == 1
@@ -1,46 +1,70 @@
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import plotly.express as px
-import colour
+try:
+    from utils.music_scale import PITCH_CLASSES
+except ImportError:  # Run as a script from utils/
+    from music_scale import PITCH_CLASSES
+
+# matplotlib and colour are imported by the functions that need them, so the
+# note colors can be used without either installed
+
+# Custom color palette designed for musical notes, by pitch class from C:
+# a combination of warm and cool colors with good contrast
+NOTE_HEX = np.array([
+    '#0000FF',  # C  Blue
+    '#0084FF',  # d  Sky Blue
+    '#00FFFF',  # D  Cyan
+    '#00FFAA',  # e  Spring Green
+    '#00FF00',  # E  Bright Green
+    '#FFD700',  # F  Gold
+    '#FF8000',  # g  Orange
+    '#FF0000',  # G  Bright Red
+    '#FF4040',  # a  Light Red
+    '#FF0080',  # A  Pink
+    '#FF00FF',  # b  Magenta
+    '#8000FF',  # B  Purple
+])
+NOTE_RGB = np.array([[int(h[i:i + 2], 16) for i in (1, 3, 5)] for h in NOTE_HEX], dtype=np.uint8)
+
+
+def note_colors(pitch):
+    """RGB of each MIDI number, as a (notes, 3) uint8 array"""
+    return NOTE_RGB[np.asarray(pitch) % 12]
+
+
+def note_hex(pitch):
+    return NOTE_HEX[np.asarray(pitch) % 12]
+
+
+@functools.lru_cache(maxsize=None)
+def spectral_locus():
+    """Wavelengths of the CIE 1931 spectral locus and their (x, y) chromaticity"""
+    import colour
+    cmfs = colour.MSDS_CMFS['CIE 1931 2 Degree Standard Observer']
+    return cmfs.wavelengths, colour.XYZ_to_xy(colour.MSDS_to_XYZ(cmfs))
+
 
 def rgb_to_wavelength(R, G, B):
-    # Step 1: Normalize and Linearize RGB
-    def linearize(c):
-        c = c / 255.0
-        if c <= 0.04045:
-            return c / 12.92
-        else:
-            return ((c + 0.055) / 1.055) ** 2.4
-
-    R_lin = linearize(R)
-    G_lin = linearize(G)
-    B_lin = linearize(B)
-
-    # Step 2: Convert Linear RGB to XYZ
-    rgb_linear = np.array([R_lin, G_lin, B_lin])
-    XYZ = colour.sRGB_to_XYZ(rgb_linear)
-
-    # Step 3: Calculate Chromaticity Coordinates (x, y)
-    x, y = colour.XYZ_to_xy(XYZ)
-
-    # Step 4: Get Spectral Locus Data
-    cmfs = colour.MSDS_CMFS['CIE 1931 2 Degree Standard Observer']
-    wavelengths = cmfs.wavelengths
-    spectral_xy = colour.MSDS_to_XYZ(cmfs)
-    spectral_xy = colour.XYZ_to_xy(spectral_xy)
+    """Wavelength of the spectral color closest to sRGB colors (0-255)
 
-    # Step 5: Find the Closest Point on the Spectral Locus
-    spectral_x = spectral_xy[:, 0]
-    spectral_y = spectral_xy[:, 1]
-    distances = np.sqrt((spectral_x - x) ** 2 + (spectral_y - y) ** 2)
-    min_index = np.argmin(distances)
-    closest_wavelength = wavelengths[min_index]
+    Scalars or arrays of any shape; the spectral locus is computed once.
+    """
+    import colour
 
-    return closest_wavelength
+    # Linearize sRGB, convert to chromaticity coordinates
+    rgb = np.stack(np.broadcast_arrays(R, G, B), axis=-1).astype(np.float64) / 255.0
+    rgb = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xy = colour.XYZ_to_xy(colour.sRGB_to_XYZ(rgb))
+
+    # Closest point of the spectral locus
+    wavelengths, locus = spectral_locus()
+    distances = np.linalg.norm(xy[..., None, :] - locus, axis=-1)
+    closest = wavelengths[distances.argmin(axis=-1)]
+    return closest if closest.ndim else closest.item()
 
 def wavelength_to_rgb(wavelength_nm):
     """Convert monochromatic light of a given wavelength to RGB."""
+    import colour
 
     cmfs = colour.MSDS_CMFS["CIE 1931 2 Degree Standard Observer"]
     xyz = colour.wavelength_to_XYZ(wavelength_nm, cmfs)
@@ -49,41 +73,17 @@ def wavelength_to_rgb(wavelength_nm):
     return (np.clip(rgb, 0, 1) * 255).astype(int)
 
 def get_note_colors():
-    """Get colors for each note in the chromatic scale."""
-    notes = ['G', 'g', 'F', 'E', 'e', 'D', 'd', 'C', 'B', 'b', 'A', 'a']
-
-    # Custom color palette designed for musical notes
-    # Using a combination of warm and cool colors with good contrast
-    hex_colors = [
-        '#FF0000',  # Bright Red
-        '#FF8000',  # Orange
-        '#FFD700',  # Gold
-        '#00FF00',  # Bright Green
-        '#00FFAA',  # Spring Green
-        '#00FFFF',  # Cyan
-        '#0084FF',  # Sky Blue
-        '#0000FF',  # Blue
-        '#8000FF',  # Purple
-        '#FF00FF',  # Magenta
-        '#FF0080',  # Pink
-        '#FF4040',  # Light Red
-    ]
-    
-    colors = []
-    for color in hex_colors:
-        # Convert hex to RGB
-        color = color.lstrip('#')
-        r = int(color[0:2], 16)
-        g = int(color[2:4], 16)
-        b = int(color[4:6], 16)
-        colors.append((r, g, b))
+    """Get colors for each note in the chromatic scale, from G down."""
+    order = (7 - np.arange(12)) % 12
 
     # colors = wavelength_to_rgb(np.logspace(np.log10(440), np.log10(622), 12))
 
-    return list(zip(notes, colors))
+    return [(PITCH_CLASSES[p], tuple(int(c) for c in NOTE_RGB[p])) for p in order]
 
 def visualize_color_wheel(colors):
     """Create a visualization of the musical color wheel."""
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
 
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(10, 10))
@@ -1,27 +1,88 @@
+import numpy as np
+
 notes = 'aAbBCdDeEFgG'
 
 major_scale = [2, 2, 1, 2, 2, 2, 1]
 minor_scale = [2, 1, 2, 2, 1, 2, 2]
 
 all_keys = [
-  'C', 'G', 'D', 'A', 'E', 'B', 
+  'C', 'G', 'D', 'A', 'E', 'B',
   'F', 'b', 'e', 'a', 'd', 'g',
-  'Am', 'Em', 'Bm', 'gm', 'dm', 'am', 
+  'Am', 'Em', 'Bm', 'gm', 'dm', 'am',
   'em', 'Dm', 'Gm', 'Cm', 'Fm', 'bm'
 ]
 
+# Note letters by pitch class from C, lowercase for flats (the frontend's
+# allNotes); note arrays index every table below with `pitch % 12`
+PITCH_CLASSES = 'CdDeEFgGaAbB'
+
+# Semitones from the tonic of each degree of the scale
+SCALE_INTERVALS = {
+    'major': np.concatenate([[0], np.cumsum(major_scale)[:-1]]),
+    'minor': np.concatenate([[0], np.cumsum(minor_scale)[:-1]]),
+}
+
+# The 24 keys as 12 * minor + tonic pitch class, the order of the key
+# profiles in notes.py
+KEY_NAMES = [p for p in PITCH_CLASSES] + [p + 'm' for p in PITCH_CLASSES]
+KEY_INDEX = {name: i for i, name in enumerate(KEY_NAMES)}
+
+
+def _key_tables():
+    """Pitch classes, bitmask and degree of each pitch class of the 24 keys"""
+    intervals = np.stack([SCALE_INTERVALS['major']] * 12 + [SCALE_INTERVALS['minor']] * 12)
+    scales = (np.arange(24)[:, None] % 12 + intervals) % 12
+    masks = np.bitwise_or.reduce(1 << scales, axis=1).astype(np.uint16)
+    degrees = np.zeros((24, 12), dtype=np.int8)
+    degrees[np.arange(24)[:, None], scales] = np.arange(1, 8)
+    return scales, masks, degrees
+
+# KEY_SCALES[k]: pitch classes of the scale of key k, from the tonic
+# KEY_MASKS[k]: bit p set if pitch class p is in the scale
+# SCALE_DEGREES[k, p]: degree 1-7 of pitch class p in key k, 0 outside it
+KEY_SCALES, KEY_MASKS, SCALE_DEGREES = _key_tables()
+
+SCALE_NOTES = {name: [PITCH_CLASSES[p] for p in KEY_SCALES[i]]
+               for i, name in enumerate(KEY_NAMES)}
+
+
 def get_key_scale(key):
-    if key[-1] == 'm':
-        steps = minor_scale
-    else:
-        steps = major_scale
-    scale = []
-    i = notes.index(key[0])
-    for s in steps:
-        scale.append(notes[i])
-        i = (i + s) % 12
-    return scale
+    return list(SCALE_NOTES[key])
+
+
+def pitch_class_mask(pitch):
+    """Bitmask of the pitch classes of MIDI numbers"""
+    return int(np.bitwise_or.reduce(1 << (np.asarray(pitch, dtype=np.int64) % 12), initial=0))
+
+
+def keys_containing(pitch):
+    """Keys whose scale contains every pitch class of `pitch`"""
+    mask = pitch_class_mask(pitch)
+    return [KEY_NAMES[i] for i in np.flatnonzero(KEY_MASKS & mask == mask)]
+
+
+def scale_degrees(pitch, key):
+    """Degree 1-7 of each MIDI number in the scale of `key`, 0 outside it"""
+    return SCALE_DEGREES[KEY_INDEX[key]][np.asarray(pitch) % 12]
+
+
+def in_scale(pitch, key):
+    return (KEY_MASKS[KEY_INDEX[key]] >> (np.asarray(pitch) % 12)) & 1 == 1
+
+
+def key_indices(key, times):
+    """Index in KEY_NAMES of the key at each time (seconds)
+
+    `key` is a key name, or a key map: `{'start', 'key'}` spans in order.
+    """
+    times = np.asarray(times)
+    if isinstance(key, str):
+        return np.full(times.shape, KEY_INDEX[key], dtype=np.int64)
+    starts = np.array([span['start'] for span in key])
+    names = np.array([KEY_INDEX[span['key']] for span in key], dtype=np.int64)
+    return names[np.clip(np.searchsorted(starts, times, side='right') - 1, 0, len(names) - 1)]
+
 
 if __name__ == '__main__':
     for key in all_keys:
-        print(f"'{key}': {get_key_scale(key)},")
\ No newline at end of file
+        print(f"'{key}': {get_key_scale(key)},")
@@ -0,0 +1,49 @@
+"""Decoded audio shared by all analyses of a song.
+
+Each song is decoded once at its native sample rate and stored in the
+analysis cache as float32 .npy, keyed by content hash. Other sample rates
+are resampled from that copy and cached too, so repeated analyses map the
+arrays from disk without touching the codec.
+"""
+import json
+import os
+import numpy as np
+import librosa
+from cache import cache_key, file_hash
+from metrics import span
+
+
+def decode(path, sr=None):
+    """Decode an audio file to mono float32 PCM at `sr` (native if None)"""
+    y, sr = librosa.load(str(path), sr=sr, mono=True)
+    return y.astype(np.float32, copy=False), sr
+
+
+def waveform_key(content_hash, sr=None):
+    return cache_key(content_hash, 'pcm', sr=sr, mono=True)
+
+
+def load_waveform(path, cache, sr=None):
+    """Return `(y, sr)` of an audio file, memory-mapped from the cache"""
+    key = waveform_key(file_hash(path), sr)
+    with cache.lock(key):
+        entry = cache.lookup(key)
+        if entry is None:
+            if sr is None:
+                with span('decode', size=os.path.getsize(path)):
+                    y, sr = decode(path)
+            else:
+                native, native_sr = load_waveform(path, cache)
+                with span('resample', size=native.nbytes):
+                    y = librosa.resample(np.asarray(native), orig_sr=native_sr, target_sr=sr)
+                    y = y.astype(np.float32, copy=False)
+
+            with cache.store(key) as tmp:
+                np.save(tmp / 'pcm.npy', y)
+                with open(tmp / 'meta.json', 'w') as f:
+                    json.dump({'sr': sr, 'samples': len(y)}, f)
+            entry = cache.entry(key)
+
+    with open(entry / 'meta.json') as f:
+        sr = json.load(f)['sr']
+    return np.load(entry / 'pcm.npy', mmap_mode='r'), sr
@@ -0,0 +1,31 @@
+import { describe, it, expect } from 'vitest'
+import { beatRate, beatsToTime, tempoAt, timeToBeats } from '@/sound/beats'
+
+// Beats at 120 BPM that slow down after the second one
+const BEATS = [0.5, 1.0, 1.6, 2.2]
+
+describe('Beat grid', () => {
+  it('puts tracked beats on whole beats counted at the tempo', () => {
+    expect(BEATS.map(t => timeToBeats(t, BEATS, 2))).toEqual([1, 2, 3, 4])
+    expect(timeToBeats(1.3, BEATS, 2)).toBeCloseTo(2.5)
+  })
+
+  it('extrapolates at the tempo outside the track', () => {
+    expect(timeToBeats(0.25, BEATS, 2)).toBeCloseTo(0.5)
+    expect(timeToBeats(3.2, BEATS, 2)).toBeCloseTo(6)
+    expect(timeToBeats(3, [], 2)).toBe(6)
+  })
+
+  it('maps beats back to the same times', () => {
+    for (const t of [0, 0.3, 0.7, 1.3, 2.0, 2.9])
+      expect(beatsToTime(timeToBeats(t, BEATS, 2), BEATS, 2)).toBeCloseTo(t)
+  })
+
+  it('scrolls at the local tempo', () => {
+    expect(beatRate(1.5, BEATS, 2)).toBeCloseTo(2)
+    expect(beatRate(2.5, BEATS, 2)).toBeCloseTo(1 / 0.6)
+    expect(beatRate(5, BEATS, 2)).toBe(2)
+    expect(tempoAt(1.0, [{ start: 0.5, end: 2.2, tempo: 110 }], 120)).toBe(110)
+    expect(tempoAt(3.0, [{ start: 0.5, end: 2.2, tempo: 110 }], 120)).toBe(120)
+  })
+})
@@ -37,4 +37,23 @@ describe('Music Store', () => {
     store.setProgress(0.5)
     expect(store.currentBeats).toBe(store.totalBeats * 0.5)
   })
-})
\ No newline at end of file
+
+  it('should scroll along the beat grid of the song', () => {
+    const store = useMusicStore()
+    store.setBpm(120)
+    store.setBeatGrid([0.5, 1.0, 1.6, 2.2], [{ start: 0.5, end: 2.2, tempo: 109.09 }])
+    store.setIsPlaying(true)
+    store.step(0.8)
+    expect(store.currentBeats).toBeCloseTo(1.6)
+    expect(store.scrollSpeed).toBeCloseTo(store.beatPixels * 2)
+    expect(store.currentTempo).toBe(109.09)
+    store.step(0.8)
+    expect(store.currentBeats).toBeCloseTo(3)
+    expect(store.currentTime).toBeCloseTo(1.6)
+    expect(store.scrollSpeed).toBeCloseTo(store.beatPixels / 0.6)
+
+    store.setBpm(60, true)
+    expect(store.beatTimes).toEqual([])
+    expect(store.currentTime).toBeCloseTo(3)
+  })
+})
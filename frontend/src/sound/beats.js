@@ -0,0 +1,63 @@
+// Mapping between song time (seconds) and sheet position (beats) along the
+// beat track of /api/sheet, as the backend's notes.beat_positions places the
+// notes: tracked beats fall on whole beats counted from the start of the song
+// at `bps`, and times before the first or after the last tracked beat are
+// extrapolated at `bps`. Without a beat track the grid is `bps` alone.
+
+// Index of the last beat at or before `time`
+function beatIndex(beatTimes, time) {
+  let lo = 0
+  let hi = beatTimes.length - 1
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1
+    if (beatTimes[mid] <= time) lo = mid
+    else hi = mid - 1
+  }
+  return lo
+}
+
+function firstBeat(beatTimes, bps) {
+  return Math.round(beatTimes[0] * bps)
+}
+
+export function timeToBeats(time, beatTimes, bps) {
+  const n = beatTimes.length
+  if (n < 2) return time * bps
+  const first = firstBeat(beatTimes, bps)
+  let beats
+  if (time < beatTimes[0]) {
+    beats = first + (time - beatTimes[0]) * bps
+  } else if (time > beatTimes[n - 1]) {
+    beats = first + n - 1 + (time - beatTimes[n - 1]) * bps
+  } else {
+    const i = Math.min(beatIndex(beatTimes, time), n - 2)
+    beats = first + i + (time - beatTimes[i]) / (beatTimes[i + 1] - beatTimes[i])
+  }
+  return Math.max(beats, 0)
+}
+
+export function beatsToTime(beats, beatTimes, bps) {
+  const n = beatTimes.length
+  if (n < 2) return beats / bps
+  const first = firstBeat(beatTimes, bps)
+  const i = beats - first
+  if (i < 0) return Math.max(beatTimes[0] + i / bps, 0)
+  if (i > n - 1) return beatTimes[n - 1] + (i - n + 1) / bps
+  const k = Math.min(Math.floor(i), n - 2)
+  return beatTimes[k] + (i - k) * (beatTimes[k + 1] - beatTimes[k])
+}
+
+// Beats per second of the grid at position `beats`
+export function beatRate(beats, beatTimes, bps) {
+  const n = beatTimes.length
+  if (n < 2) return bps
+  const i = Math.floor(beats - firstBeat(beatTimes, bps))
+  if (i < 0 || i > n - 2) return bps
+  return 1 / (beatTimes[i + 1] - beatTimes[i])
+}
+
+// Tempo (BPM) of the tempo map span at `time`, or `bpm` outside of them
+export function tempoAt(time, tempoMap, bpm) {
+  const span = tempoMap.find(s => s.start <= time && time < s.end)
+  return span ? span.tempo : bpm
+}
@@ -1,4 +1,5 @@
 import { defineStore } from 'pinia'
+import { beatRate, beatsToTime, tempoAt, timeToBeats } from '../sound/beats'
 
 export const allNotes = ['C', 'd', 'D', 'e', 'E', 'F', 'g', 'G', 'a', 'A', 'b', 'B']
 
@@ -106,6 +107,8 @@ export const useMusicStore = defineStore('music', {
   state: () => ({
     title: '',
     bpm: 80,
+    beatTimes: [],  // seconds of the tracked beats, on whole beats of the sheet
+    tempoMap: [],  // {start, end, tempo} spans in seconds
     beatsPerBar: 4,
     beatsPerWholeNote: 4,
     beatPixels: 48,
@@ -123,11 +126,22 @@ export const useMusicStore = defineStore('music', {
     setTitle(title) {
       this.title = title
     },
-    setBpm(bpm) {
+    setBpm(bpm, constant = false) {
       this.bpm = bpm
+      if (constant) this.setBeatGrid([], [])  // the whole song at `bpm`
+    },
+    setBeatGrid(beatTimes, tempoMap) {
+      this.beatTimes = beatTimes ?? []
+      this.tempoMap = tempoMap ?? []
+    },
+    timeToBeats(time) {
+      return timeToBeats(time, this.beatTimes, this.bps)
+    },
+    beatsToTime(beats) {
+      return beatsToTime(beats, this.beatTimes, this.bps)
     },
     step(dt) {
-      const beats = this.bps * dt
+      const beats = this.timeToBeats(this.currentTime + dt) - this.currentBeats
       if (this.isPlaying) {
         this.currentBeats += beats
         if (this.currentBeats >= this.totalBeats) {
@@ -146,13 +160,13 @@ export const useMusicStore = defineStore('music', {
       this.notes.forEach(note => note.resetColor())
     },
     setDuration(duration) {
-      this.totalBeats = duration / this.bps
+      this.totalBeats = this.timeToBeats(duration)
     },
     setIsPlaying(isPlaying) {
       this.isPlaying = isPlaying
       if (!this.bgm) return
       if (isPlaying) {
-        this.bgm.currentTime = this.currentBeats
+        this.bgm.currentTime = this.currentTime
         this.bgm.play()
       } else {
         this.bgm.pause()
@@ -261,6 +275,8 @@ export const useMusicStore = defineStore('music', {
         notes: this.notes.map(note => note.toJSON()),
         key: this.currentKey,
         bpm: this.bpm,
+        beats: this.beatTimes,
+        tempoMap: this.tempoMap,
         timeSignature: [this.beatsPerBar, this.beatsPerWholeNote],
         bgmData: localStorage.getItem('currentBGM'),
         savedAt: new Date().toISOString()
@@ -278,6 +294,7 @@ export const useMusicStore = defineStore('music', {
       this.setNotes(data.notes.map(n => new Note({ ...n, store: this })))
       this.setKey(data.key)
       this.setBpm(data.bpm)
+      this.setBeatGrid(data.beats, data.tempoMap)
       this.setTimeSignature(...data.timeSignature)
       
       if (data.bgmData) {
@@ -330,14 +347,15 @@ export const useMusicStore = defineStore('music', {
 
   getters: {
     bps: (state) => state.bpm / 60,
-    duration: (state) => state.totalBeats / state.bps,
-    currentTime: (state) => state.currentBeats / state.bps,
+    duration: (state) => beatsToTime(state.totalBeats, state.beatTimes, state.bps),
+    currentTime: (state) => beatsToTime(state.currentBeats, state.beatTimes, state.bps),
+    currentTempo: (state) => tempoAt(state.currentTime, state.tempoMap, state.bpm),
     barPixels: (state) => state.beatPixels * state.beatsPerBar,
     sheetPixels: (state) => state.barPixels * state.numBars,
-    scrollSpeed: (state) => state.beatPixels * state.bps,
+    scrollSpeed: (state) => state.beatPixels * beatRate(state.currentBeats, state.beatTimes, state.bps),
     currentScroll: (state) => state.currentBeats * state.beatPixels,
     numBars: (state) => Math.ceil(state.totalBeats / state.beatsPerBar),
-    totalTime: (state) => state.totalBeats / state.bps,
+    totalTime: (state) => beatsToTime(state.totalBeats, state.beatTimes, state.bps),
     progressPercent: (state) => state.currentBeats / state.totalBeats * 100,
     timeSignature: (state) => [state.beatsPerBar, state.beatsPerWholeNote],
     currentScale: (state) => scaleMap[state.currentKey],